@@ -0,0 +1,172 @@
+"""End-to-end throughput benchmark of both generators against the local mock endpoint.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_generation --num 2000 --latency_ms 200
+    python -m benchmarks.bench_generation --targets async --num 5000 --json bench.json
+
+Reports accepted instructions/sec, API calls per accepted item, client CPU time spent in
+parsing, similarity filtering and file I/O, and peak RSS of the generator process.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import tempfile
+import time
+import urllib.request
+from functools import wraps
+
+from benchmarks import mock_server
+
+
+class StageTimer:
+    """Accumulate per-stage CPU time of the calling thread"""
+
+    def __init__(self):
+        self.seconds = {}
+
+    def wrap(self, stage: str, fn):
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.thread_time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.seconds[stage] = self.seconds.get(stage, 0.0) + time.thread_time() - start
+        return timed
+
+
+def run_async(base_url: str, num: int, workdir: str, options: dict) -> dict:
+    import generate_instructions_async as target
+
+    timer = StageTimer()
+    target.JsonlSink.append = timer.wrap("io", target.JsonlSink.append)
+    target.compact = timer.wrap("io", target.compact)
+    generator = target.AlpacaDataGenerator(base_url=base_url, max_workers=options["max_workers"],
+                                           stream=options["stream"], adaptive_sizing=not options["fixed_size"])
+    # parse_positions is bypassed by the streaming path, which parses block by block
+    if options["stream"]:
+        generator.parse_block = timer.wrap("parse", generator.parse_block)
+    else:
+        generator.parse_positions = timer.wrap("parse", generator.parse_positions)
+    generator.check_similarity = timer.wrap("similarity", generator.check_similarity)
+    index = generator.similarity_index
+    index.add = timer.wrap("similarity", index.add)
+
+    asyncio.run(generator.generate_dataset("data/seed_tasks.jsonl", num, os.path.join(workdir, "async.json")))
+    return timer.seconds
+
+
+def run_sync(base_url: str, num: int, workdir: str, options: dict) -> dict:
+    import generate_instructions as target
+
+    timer = StageTimer()
+    generator = target.AlpacaDataGenerator(base_url=base_url)
+    generator.parse_response = timer.wrap("parse", generator.parse_response)
+    generator.check_similarity = timer.wrap("similarity", generator.check_similarity)
+    generator.save_dataset = timer.wrap("io", generator.save_dataset)
+
+    generator.generate_dataset("data/seed_tasks.jsonl", num, os.path.join(workdir, "sync.json"))
+    return timer.seconds
+
+
+RUNNERS = {"async": run_async, "sync": run_sync}
+
+
+def _child(name: str, base_url: str, num: int, options: dict, results) -> None:
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    with tempfile.TemporaryDirectory() as workdir:
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        stages = RUNNERS[name](base_url, num, workdir, options)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+    results.put({
+        "wall_seconds": wall,
+        "cpu_seconds": cpu,
+        "stage_cpu_seconds": stages,
+        # ru_maxrss is reported in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def _serve(port: int, config: dict) -> None:
+    mock_server.serve(port=port, **config).serve_forever()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _stats(base_url: str) -> dict:
+    with urllib.request.urlopen(f"{base_url}/stats") as response:
+        return json.load(response)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--targets", type=str, default="async,sync")
+    parser.add_argument("--num", type=int, default=1000)
+    parser.add_argument("--max_workers", type=int, default=64)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--fixed_size", action="store_true", help="Disable adaptive task count / max_tokens in the async target")
+    parser.add_argument("--json", type=str, default=None, help="Also write the report to this file")
+    mock_server.add_arguments(parser)
+    args = vars(parser.parse_args())
+
+    config = {name: args[name] for name in mock_server.DEFAULTS}
+    options = {"max_workers": args["max_workers"], "stream": args["stream"], "fixed_size": args["fixed_size"]}
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    ctx = multiprocessing.get_context("spawn")
+    server = ctx.Process(target=_serve, args=(port, config), daemon=True)
+    server.start()
+    for _ in range(100):
+        try:
+            _stats(base_url)
+            break
+        except OSError:
+            time.sleep(0.1)
+
+    report = {"num_instructions": args["num"], "mock": config, "options": options, "results": {}}
+    try:
+        for name in args["targets"].split(","):
+            before = _stats(base_url)
+            results = ctx.Queue()
+            child = ctx.Process(target=_child, args=(name, base_url, args["num"], options, results))
+            child.start()
+            result = results.get()
+            child.join()
+            after = _stats(base_url)
+
+            calls = after["requests"] - before["requests"]
+            result["api_calls"] = calls
+            result["api_calls_per_accepted"] = calls / args["num"]
+            result["completion_tokens_per_accepted"] = (after["completion_tokens"] - before["completion_tokens"]) / args["num"]
+            result["mean_call_latency"] = (after["latency_seconds"] - before["latency_seconds"]) / calls if calls else 0.0
+            result["accepted_per_second"] = args["num"] / result["wall_seconds"]
+            report["results"][name] = result
+    finally:
+        server.terminate()
+
+    for name, result in report["results"].items():
+        stages = "  ".join(f"{stage} {seconds:.2f}s" for stage, seconds in sorted(result["stage_cpu_seconds"].items()))
+        print(f"{name:>6}: {result['accepted_per_second']:8.1f} accepted/s  "
+              f"{result['api_calls_per_accepted']:.3f} calls/accepted  "
+              f"{result['completion_tokens_per_accepted']:.0f} tokens/accepted  "
+              f"{result['mean_call_latency']:.2f}s/call  "
+              f"cpu {result['cpu_seconds']:.2f}s ({stages})  "
+              f"peak rss {result['peak_rss_mb']:.0f} MB")
+    if args["json"]:
+        with open(args["json"], 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Serial check_similarity vs. the process-sharded ShardedSimilarityFilter.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_parallel_similarity --num 2000 --workers 8
+
+Candidates arrive in batches of --batch (one API response), exactly like the synchronous
+generator, and both paths must accept the same items in the same order.
+"""
+import argparse
+import json
+import os
+import time
+
+from rouge_score import rouge_scorer
+
+from benchmarks.bench_similarity import synthetic_instructions
+from parallel_similarity import ShardedSimilarityFilter
+
+
+def run_serial(seeds, candidates, batch, threshold):
+    """The original O(n^2) loop of generate_instructions.check_similarity"""
+    scorer = rouge_scorer.RougeScorer(['rougeL'], use_stemmer=False)
+    existing = list(seeds)
+    accepted = []
+    start = time.perf_counter()
+    for pos in range(0, len(candidates), batch):
+        for candidate in candidates[pos:pos + batch]:
+            if all(scorer.score(ref, candidate)['rougeL'].fmeasure <= threshold for ref in existing):
+                existing.append(candidate)
+                accepted.append(candidate)
+    return accepted, time.perf_counter() - start
+
+
+def run_sharded(seeds, candidates, batch, threshold, workers):
+    accepted = []
+    with ShardedSimilarityFilter(workers, threshold) as similarity_filter:
+        similarity_filter.add(seeds)
+        start = time.perf_counter()
+        for pos in range(0, len(candidates), batch):
+            chunk = candidates[pos:pos + batch]
+            new = [c for c, ok in zip(chunk, similarity_filter.filter_batch(chunk)) if ok]
+            similarity_filter.add(new)
+            accepted.extend(new)
+        elapsed = time.perf_counter() - start
+    return accepted, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed_file", type=str, default="data/seed_tasks.jsonl")
+    parser.add_argument("--num", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--threshold", type=float, default=0.7)
+    parser.add_argument("--skip_serial", action="store_true", help="Only time the sharded filter")
+    args = parser.parse_args()
+
+    with open(args.seed_file, 'r') as f:
+        seeds = [json.loads(l)["instruction"] for l in f]
+    candidates = synthetic_instructions(args.seed_file, args.num)
+
+    sharded, sharded_time = run_sharded(seeds, candidates, args.batch, args.threshold, args.workers)
+    print(f"sharded ({args.workers} workers): {sharded_time:8.2f}s  "
+          f"{sharded_time / args.num * 1e3:7.2f} ms/candidate  accepted {len(sharded)}")
+    if not args.skip_serial:
+        serial, serial_time = run_serial(seeds, candidates, args.batch, args.threshold)
+        print(f"serial rouge_score    : {serial_time:8.2f}s  "
+              f"{serial_time / args.num * 1e3:7.2f} ms/candidate  accepted {len(serial)}")
+        print(f"speedup {serial_time / sharded_time:.1f}x, identical decisions: {serial == sharded}")
+
+
+if __name__ == "__main__":
+    main()
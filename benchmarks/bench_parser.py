@@ -0,0 +1,183 @@
+"""Legacy split/substring parser+validator vs. completion_parser over recorded completions.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_parser --cache data/responses.db
+    python -m benchmarks.bench_parser --num 5000
+
+Without --cache the corpus is synthesised with the mock server's task generator plus the
+messy variants seen in real completions (numbered blocks, multi-line outputs, CRLF, truncated
+tails). Items accepted by both implementations must serialise to identical JSON, and both must
+reject the same blocks for the same reason. The only allowed difference is a blacklisted word
+that occurs solely inside another word ("paragraph", "profile", "roadmap"), which the legacy
+substring check rejects and the compiled blacklist accepts; any other difference is listed and
+makes the benchmark exit non-zero.
+"""
+import argparse
+import json
+import random
+import re
+import string
+import time
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.mock_server import DEFAULTS, MockState
+from completion_parser import InstructionValidator, iter_blocks
+from response_cache import ResponseCache
+
+LEGACY_BLACKLIST = [
+    "image", "images", "graph", "graphs", "picture", "pictures",
+    "file", "files", "map", "maps", "draw", "plot", "go to",
+    "video", "audio", "music", "flowchart", "diagram"
+]
+
+
+def legacy_parse_block(example: str) -> Dict:
+    parts = example.strip().split("\n")
+    current_item = {}
+    current_key = None
+    for part in parts:
+        part = part.strip()
+        if "Instruction:" in part:
+            current_key = "instruction"
+            current_item[current_key] = part.split("Instruction:")[-1].strip()
+        elif "Input:" in part:
+            current_key = "input"
+            current_item[current_key] = part.split("Input:")[-1].strip()
+        elif "Output:" in part:
+            current_key = "output"
+            current_item[current_key] = part.split("Output:")[-1].strip()
+        elif current_key:
+            current_item[current_key] = current_item.get(current_key, "") + " " + part
+    return current_item
+
+
+def legacy_rejection_reason(item: Dict) -> Optional[str]:
+    if not all(k in item for k in ["instruction", "input", "output"]):
+        return "missing_fields"
+    item["instruction"] = item["instruction"].strip()
+    item["input"] = "" if item["input"].lower() == "<noinput>" else item["input"].strip()
+    item["output"] = item["output"].strip()
+    if len(item["instruction"].split()) <= 3 or len(item["instruction"].split()) > 150:
+        return "length"
+    if any(word in item["instruction"].lower() for word in LEGACY_BLACKLIST):
+        return "blacklist"
+    if item["instruction"][0] in string.punctuation:
+        return "punctuation"
+    if not item["instruction"][0].isascii():
+        return "non_ascii"
+    return None
+
+
+def legacy_parse(raw_text: str) -> List[Tuple[Dict, Optional[str]]]:
+    items = []
+    for example in re.split("###", raw_text):
+        if not example.strip():
+            continue
+        item = legacy_parse_block(example)
+        items.append((item, legacy_rejection_reason(item)))
+    return items
+
+
+def compiled_parse(raw_text: str, validator: InstructionValidator) -> List[Tuple[Dict, Optional[str]]]:
+    return [(item, validator.rejection_reason(item)) for item in iter_blocks(raw_text)]
+
+
+def mid_word_only(instruction: str) -> bool:
+    """Every legacy blacklist hit in the instruction starts inside another word"""
+    text = instruction.lower()
+    hits = [m.start() for word in LEGACY_BLACKLIST for m in re.finditer(re.escape(word), text)]
+    return bool(hits) and all(i > 0 and (text[i - 1].isalnum() or text[i - 1] == "_") for i in hits)
+
+
+def messy(text: str, rng: random.Random) -> str:
+    """Inject the formatting noise real completions contain"""
+    blocks = text.split("###")
+    for i, block in enumerate(blocks):
+        roll = rng.random()
+        if roll < 0.05:
+            block = block.replace("Instruction:", f"{i}. Instruction:", 1)
+        elif roll < 0.15:
+            block = block.rstrip("\n") + "\n- first point\n\n- second point\n"
+        elif roll < 0.2:
+            block = block.replace("\n", "\r\n")
+        elif roll < 0.25:
+            block = block.replace("Instruction: ", "Instruction: Build a profile or roadmap, then ", 1)
+        elif roll < 0.28:
+            block = block.replace("Output:", "Output: see Input: above.", 1)
+        elif roll < 0.31:
+            block = block.replace("Instruction: ", "Instruction: Explain these diagrams and drawings, then ", 1)
+        blocks[i] = block
+    text = "###".join(blocks)
+    if rng.random() < 0.1:
+        text = text[:rng.randint(len(text) // 2, len(text))]
+    return text
+
+
+def synthetic_corpus(num: int, seed: int = 0) -> List[str]:
+    state = MockState(dict(DEFAULTS, seed=seed))
+    rng = random.Random(seed)
+    return [messy(state.completion_text(), rng) for _ in range(num)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache", type=str, default=None, help="ResponseCache database with recorded completions")
+    parser.add_argument("--num", type=int, default=2000, help="Synthetic completions when --cache is not given")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.cache:
+        cache = ResponseCache(args.cache)
+        corpus = list(cache.completions())
+        cache.close()
+    else:
+        corpus = synthetic_corpus(args.num)
+    size_mb = sum(len(t.encode()) for t in corpus) / 2 ** 20
+
+    timings = {}
+    for name in ("legacy", "compiled"):
+        best = float("inf")
+        for _ in range(args.repeat):
+            validator = InstructionValidator()
+            start = time.perf_counter()
+            if name == "legacy":
+                results = [legacy_parse(t) for t in corpus]
+            else:
+                results = [compiled_parse(t, validator) for t in corpus]
+            best = min(best, time.perf_counter() - start)
+        timings[name] = (best, results)
+
+    legacy, compiled = timings["legacy"][1], timings["compiled"][1]
+    both = identical = rejected = mid_word = 0
+    changed = []
+    for old_items, new_items in zip(legacy, compiled):
+        if len(old_items) != len(new_items):
+            changed.append(f"block count {len(old_items)} != {len(new_items)}")
+            continue
+        for (old, old_reason), (new, new_reason) in zip(old_items, new_items):
+            if old_reason is None and new_reason is None:
+                both += 1
+                identical += json.dumps(old, ensure_ascii=False) == json.dumps(new, ensure_ascii=False)
+            elif old_reason == new_reason:
+                rejected += 1
+            elif old_reason == "blacklist" and new_reason != "blacklist" and mid_word_only(old["instruction"]):
+                mid_word += 1
+            else:
+                changed.append(f"{old_reason} -> {new_reason}: {old.get('instruction', new.get('instruction'))}")
+
+    for name, (seconds, _) in timings.items():
+        print(f"{name:>8}: {seconds:7.3f}s  {len(corpus) / seconds:9.0f} completions/s  {size_mb / seconds:6.1f} MB/s")
+    print(f"speedup {timings['legacy'][0] / timings['compiled'][0]:.2f}x over {len(corpus)} completions")
+    print(f"accepted by both: {both}, byte-identical: {identical}")
+    print(f"rejected by both for the same reason: {rejected}")
+    print(f"blacklisted by legacy only, word inside another word: {mid_word}")
+    print(f"unexpected differences: {len(changed)}")
+    for difference in changed[:5]:
+        print(f"  {difference}")
+    print(f"rejections by rule: {dict(validator.rejections)}")
+    if changed or identical != both:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
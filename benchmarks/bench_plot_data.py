@@ -0,0 +1,88 @@
+"""Time plot_data.py's verb/object analysis: per-document full pipeline vs. batched nlp.pipe.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_plot_data --data data/alpaca_data.json
+    python -m benchmarks.bench_plot_data --num 52000 --n_process 8
+
+Three variants are timed on the same instructions: the legacy loop calling nlp() one document at
+a time through the full pipeline, nlp.pipe batching with the full pipeline, and nlp.pipe with the
+unused components excluded across --n_process workers. The verb/object hierarchies of all three
+must be identical.
+"""
+import argparse
+import json
+import os
+import time
+from collections import defaultdict
+
+import spacy
+
+from benchmarks.bench_similarity import synthetic_instructions
+from plot_data import analyze_instructions, extract_verb_and_object, load_dataset, load_nlp
+
+
+def legacy_analyze(data, nlp):
+    hierarchy = defaultdict(lambda: defaultdict(int))
+    for item in data:
+        verb, obj = extract_verb_and_object(item['instruction'], nlp)
+        hierarchy[verb][obj] += 1
+    return hierarchy
+
+
+def as_plain(hierarchy):
+    return {verb: dict(objs) for verb, objs in hierarchy.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", type=str, default=None, help="Alpaca-format JSON; synthetic instructions if omitted")
+    parser.add_argument("--num", type=int, default=52000, help="Synthetic instructions when --data is not given")
+    parser.add_argument("--seed_file", type=str, default="data/seed_tasks.jsonl")
+    parser.add_argument("--model", type=str, default="en_core_web_sm", help="spaCy package name or model path")
+    parser.add_argument("--batch_size", type=int, default=1000)
+    parser.add_argument("--n_process", type=int, default=os.cpu_count())
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this file")
+    args = parser.parse_args()
+
+    if args.data:
+        data = load_dataset(args.data)
+    else:
+        data = [{"instruction": text} for text in synthetic_instructions(args.seed_file, args.num)]
+
+    full = spacy.load(args.model)
+    lean = load_nlp(args.model)
+    variants = [
+        ("per_doc_full_pipeline", lambda: legacy_analyze(data, full), full.pipe_names, 1),
+        ("pipe_full_pipeline", lambda: analyze_instructions(data, full, args.batch_size, 1), full.pipe_names, 1),
+        ("pipe_excluded_components",
+         lambda: analyze_instructions(data, lean, args.batch_size, args.n_process), lean.pipe_names, args.n_process),
+    ]
+
+    results = {}
+    reference = None
+    for name, run, pipes, n_process in variants:
+        start = time.perf_counter()
+        hierarchy = as_plain(run())
+        seconds = time.perf_counter() - start
+        if reference is None:
+            reference = hierarchy
+        results[name] = {
+            "seconds": seconds,
+            "instructions_per_second": len(data) / seconds,
+            "components": pipes,
+            "n_process": n_process,
+            "identical": hierarchy == reference,
+        }
+        print(f"{name:>26}: {seconds:7.2f}s  {len(data) / seconds:8.0f} instr/s  "
+              f"n_process={n_process}  identical={hierarchy == reference}  [{', '.join(pipes)}]")
+
+    base = results["per_doc_full_pipeline"]["seconds"]
+    print(f"speedup over {len(data)} instructions: "
+          + ", ".join(f"{name} {base / r['seconds']:.2f}x" for name, r in results.items()))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"instructions": len(data), "model": args.model, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
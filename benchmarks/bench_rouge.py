@@ -0,0 +1,48 @@
+"""Microbenchmark: rouge_score pairwise scoring vs. the batched RougeLKernel.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_rouge --refs 1000 --queries 50
+"""
+import argparse
+import time
+
+import numpy as np
+from rouge_score import rouge_scorer
+
+from benchmarks.bench_similarity import synthetic_instructions
+from similarity import RougeLKernel
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed_file", type=str, default="data/seed_tasks.jsonl")
+    parser.add_argument("--refs", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    instructions = synthetic_instructions(args.seed_file, args.refs + args.queries)
+    refs, queries = instructions[:args.refs], instructions[args.refs:]
+
+    scorer = rouge_scorer.RougeScorer(['rougeL'], use_stemmer=False)
+    start = time.perf_counter()
+    expected = [[scorer.score(ref, q)['rougeL'].fmeasure for ref in refs] for q in queries]
+    baseline = time.perf_counter() - start
+
+    kernel = RougeLKernel()
+    start = time.perf_counter()
+    for ref in refs:
+        kernel.add(ref)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    got = [kernel.score_many(q) for q in queries]
+    batched = time.perf_counter() - start
+
+    identical = all(np.array_equal(np.array(e), g) for e, g in zip(expected, got))
+    pairs = args.refs * len(queries)
+    print(f"rouge_score : {baseline:8.3f}s  {baseline / pairs * 1e6:8.2f} us/pair")
+    print(f"RougeLKernel: {batched:8.3f}s  {batched / pairs * 1e6:8.2f} us/pair  (+{build:.3f}s one-off encoding)")
+    print(f"speedup {baseline / batched:.1f}x, identical F-measures: {identical}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Compare the deque-window ROUGE-L scan against the MinHash/LSH index.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_similarity --num 20000
+    python -m benchmarks.bench_similarity --data data/alpaca_data.json
+"""
+import argparse
+import json
+import random
+import time
+from typing import List
+
+from rouge_score import rouge_scorer
+
+from similarity import DequeSimilarityIndex, MinHashLSHIndex, tokenize
+
+
+def synthetic_instructions(seed_file: str, num: int, seed: int = 0) -> List[str]:
+    """Mutate seed instructions so that the stream contains both novel and near-duplicate items"""
+    rng = random.Random(seed)
+    with open(seed_file, 'r') as f:
+        seeds = [json.loads(l)["instruction"] for l in f]
+    vocab = sorted({tok for s in seeds for tok in tokenize(s)})
+
+    instructions = []
+    for _ in range(num):
+        words = rng.choice(seeds).split()
+        # 30% lightly edited (near-duplicates), the rest heavily rewritten
+        rate = 0.1 if rng.random() < 0.3 else 0.6
+        words = [rng.choice(vocab) if rng.random() < rate else w for w in words]
+        instructions.append(" ".join(words))
+    return instructions
+
+
+def run(index, instructions: List[str], threshold: float):
+    accepted = []
+    start = time.perf_counter()
+    for instruction in instructions:
+        if not index.has_near_duplicate(instruction, threshold):
+            index.add(instruction)
+            accepted.append(instruction)
+    return accepted, time.perf_counter() - start
+
+
+def missed_duplicates(accepted: List[str], sample: int, threshold: float, seed: int = 0) -> int:
+    """Exhaustively re-check a sample of accepted items against everything accepted before them"""
+    scorer = rouge_scorer.RougeScorer(['rougeL'], use_stemmer=False)
+    rng = random.Random(seed)
+    positions = rng.sample(range(len(accepted)), min(sample, len(accepted)))
+    missed = 0
+    for pos in positions:
+        if any(scorer.score(prev, accepted[pos])['rougeL'].fmeasure > threshold
+               for prev in accepted[:pos]):
+            missed += 1
+    return missed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed_file", type=str, default="data/seed_tasks.jsonl")
+    parser.add_argument("--data", type=str, default=None, help="Alpaca-format JSON to replay instead of synthetic data")
+    parser.add_argument("--num", type=int, default=10000)
+    parser.add_argument("--threshold", type=float, default=0.7)
+    parser.add_argument("--window", type=int, default=1000)
+    parser.add_argument("--verify_sample", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.data:
+        with open(args.data, 'r', encoding='utf-8') as f:
+            instructions = [item["instruction"] for item in json.load(f)][:args.num]
+    else:
+        instructions = synthetic_instructions(args.seed_file, args.num)
+
+    for name, index in [("deque", DequeSimilarityIndex(window=args.window)),
+                        ("minhash-lsh", MinHashLSHIndex())]:
+        accepted, elapsed = run(index, instructions, args.threshold)
+        missed = missed_duplicates(accepted, args.verify_sample, args.threshold)
+        print(f"{name:>12}: {elapsed:8.2f}s  "
+              f"{elapsed / len(instructions) * 1e3:7.3f} ms/query  "
+              f"accepted {len(accepted)}/{len(instructions)}  "
+              f"missed duplicates {missed}/{min(args.verify_sample, len(accepted))} sampled")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""Local OpenAI-compatible chat-completions endpoint for benchmarking the generators.
+
+Point a generator at it through ``base_url``:
+    python -m benchmarks.mock_server --port 8000 --latency_ms 800 --error_rate 0.02
+    AlpacaDataGenerator(base_url="http://127.0.0.1:8000")
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from similarity import tokenize
+
+DEFAULTS = {
+    "latency_ms": 800.0,        # median end-to-end latency of one completion
+    "latency_sigma": 0.5,       # sigma of the log-normal latency distribution
+    "error_rate": 0.0,          # fraction of requests answered with HTTP 500
+    "rate_limit_rate": 0.0,     # fraction of requests answered with HTTP 429
+    "retry_after": 1.0,         # Retry-After header sent with 429 responses
+    "duplicate_ratio": 0.1,     # fraction of tasks copied from earlier responses
+    "duplicate_growth": 0.0,    # extra duplicate probability per task position within a response
+    "tasks_per_response": 20,   # used when the prompt does not say how many tasks to generate
+    "stream_chunks": 40,        # number of SSE chunks when stream=true
+    "seed_file": "data/seed_tasks.jsonl",
+    "seed": 0,
+}
+
+TASK_COUNT_RE = re.compile(r"generate (\d+) new")
+
+VERBS = [
+    "Write", "Explain", "Summarize", "Classify", "Rewrite", "Translate", "Suggest",
+    "Describe", "Compare", "List", "Identify", "Generate", "Evaluate", "Convert",
+    "Outline", "Recommend", "Predict", "Analyze", "Create", "Find",
+]
+
+
+class MockState:
+    """Synthetic task generator plus counters shared by all handler threads"""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.rng = random.Random(config["seed"])
+        self.lock = threading.Lock()
+        with open(config["seed_file"], 'r') as f:
+            seeds = [json.loads(l) for l in f]
+        self.vocab = sorted({tok for t in seeds for tok in tokenize(t["instruction"]) if len(tok) > 2})
+        self.served = []
+        # Typical length of a full response, used to scale latency with output length. Drawn
+        # from its own RNG so the served task stream depends only on the seed and the requests.
+        reference_rng = random.Random(config["seed"])
+        self.reference_chars = len("".join(
+            self.task_block(reference_rng, self.instruction(reference_rng))
+            for _ in range(config["tasks_per_response"])) + "###\n### END")
+        self.seen_prefixes = set()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.completion_tokens = 0
+        self.latency_seconds = 0.0
+
+    def instruction(self, rng: random.Random) -> str:
+        words = rng.sample(self.vocab, rng.randint(6, 14))
+        return f"{rng.choice(VERBS)} {' '.join(words)}."
+
+    def task_block(self, rng: random.Random, instruction: str) -> str:
+        has_input = rng.random() < 0.4
+        task_input = " ".join(rng.sample(self.vocab, 12)) if has_input else "<noinput>"
+        output = " ".join(rng.sample(self.vocab, rng.randint(10, 40)))
+        return f"###\nInstruction: {instruction}\nInput: {task_input}\nOutput: {output}\n"
+
+    def completion_text(self, num_tasks: int = None) -> str:
+        blocks = []
+        with self.lock:
+            for position in range(num_tasks or self.config["tasks_per_response"]):
+                duplicate = self.config["duplicate_ratio"] + self.config["duplicate_growth"] * position
+                if self.served and self.rng.random() < duplicate:
+                    instruction = self.rng.choice(self.served)
+                else:
+                    instruction = self.instruction(self.rng)
+                    self.served.append(instruction)
+                blocks.append(self.task_block(self.rng, instruction))
+        return "".join(blocks) + "###\n### END"
+
+    def cached_prompt_chars(self, messages: list) -> int:
+        """Emulate provider prefix caching at message boundaries"""
+        hit = 0
+        prefix = hashlib.sha256()
+        length = 0
+        with self.lock:
+            for message in messages:
+                prefix.update(json.dumps(message, sort_keys=True).encode())
+                length += len(message.get("content", ""))
+                key = prefix.hexdigest()
+                if key in self.seen_prefixes:
+                    hit = length
+                self.seen_prefixes.add(key)
+        return hit
+
+    def latency(self) -> float:
+        median = self.config["latency_ms"] / 1000.0
+        with self.lock:
+            return median * math.exp(self.rng.gauss(0.0, self.config["latency_sigma"]))
+
+    def outcome(self) -> str:
+        with self.lock:
+            self.requests += 1
+            roll = self.rng.random()
+            if roll < self.config["rate_limit_rate"]:
+                self.rate_limited += 1
+                return "rate_limited"
+            if roll < self.config["rate_limit_rate"] + self.config["error_rate"]:
+                self.errors += 1
+                return "error"
+        return "ok"
+
+
+def make_handler(state: MockState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, payload: dict, headers: dict = None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                self._send_json(200, {
+                    "requests": state.requests,
+                    "errors": state.errors,
+                    "rate_limited": state.rate_limited,
+                    "completion_tokens": state.completion_tokens,
+                    "latency_seconds": state.latency_seconds,
+                })
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+
+            outcome = state.outcome()
+            if outcome == "rate_limited":
+                self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit"}},
+                                {"Retry-After": str(state.config["retry_after"])})
+                return
+            if outcome == "error":
+                time.sleep(state.latency() / 4)
+                self._send_json(500, {"error": {"message": "internal error", "type": "server_error"}})
+                return
+
+            messages = request.get("messages", [])
+            asked = TASK_COUNT_RE.search(messages[-1].get("content", "")) if messages else None
+            text = state.completion_text(int(asked.group(1)) if asked else None)
+            # Honour stop sequences and max_tokens (4 characters per token) like a real endpoint
+            finish_reason = "stop"
+            for stop in request.get("stop") or []:
+                if stop in text:
+                    text = text[:text.index(stop)]
+            max_chars = request.get("max_tokens", 0) * 4
+            if max_chars and len(text) > max_chars:
+                text = text[:max_chars]
+                finish_reason = "length"
+            prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+            hit_tokens = state.cached_prompt_chars(messages) // 4
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(text) // 4,
+                "total_tokens": prompt_tokens + len(text) // 4,
+                "prompt_cache_hit_tokens": hit_tokens,
+                "prompt_cache_miss_tokens": prompt_tokens - hit_tokens,
+            }
+            common = {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+            }
+            # Decoding time grows with the number of generated tokens
+            latency = state.latency() * len(text) / state.reference_chars
+            with state.lock:
+                state.completion_tokens += len(text) // 4
+                state.latency_seconds += latency
+
+            if not request.get("stream"):
+                time.sleep(latency)
+                self._send_json(200, dict(common, object="chat.completion", usage=usage, choices=[{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": finish_reason,
+                }]))
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            chunks = state.config["stream_chunks"]
+            size = max(1, math.ceil(len(text) / chunks))
+            try:
+                for start in range(0, len(text), size):
+                    time.sleep(latency / chunks)
+                    chunk = dict(common, object="chat.completion.chunk", choices=[{
+                        "index": 0,
+                        "delta": {"content": text[start:start + size]},
+                        "finish_reason": None,
+                    }])
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                done = dict(common, object="chat.completion.chunk", usage=usage, choices=[{
+                    "index": 0, "delta": {}, "finish_reason": finish_reason,
+                }])
+                self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode())
+            except (BrokenPipeError, ConnectionResetError):
+                # The client aborted the stream early
+                pass
+            self.close_connection = True
+
+    return Handler
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients abort streams and cancel in-flight requests all the time
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+def serve(host: str = "127.0.0.1", port: int = 8000, **overrides) -> MockServer:
+    """Create (but do not start) a mock server; call serve_forever() on the result"""
+    config = dict(DEFAULTS, **overrides)
+    return MockServer((host, port), make_handler(MockState(config)))
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    for name, default in DEFAULTS.items():
+        parser.add_argument(f"--{name}", type=type(default), default=default)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_arguments(parser)
+    args = vars(parser.parse_args())
+    server = serve(**args)
+    print(f"Mock chat-completions endpoint on http://{args['host']}:{args['port']}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import re
+import string
+from collections import defaultdict
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+# 过滤需要图像、文件、音视频等非文本能力的指令
+BLACKLIST = (
+    "image", "images", "graph", "graphs", "picture", "pictures",
+    "file", "files", "map", "maps", "draw", "plot", "go to",
+    "video", "audio", "music", "flowchart", "diagram",
+)
+
+_PUNCTUATION = frozenset(string.punctuation)
+
+
+def compile_blacklist(words: Sequence[str]) -> "re.Pattern":
+    """把黑名单编译成一个正则，需作用于小写文本
+
+    只要求匹配从词首开始：复数和屈折形式（diagrams、drawing、flowcharts、musical）
+    与原来的子串匹配一样被拒绝，只有词中间的出现（paragraph、profile、roadmap）不再误伤。
+    """
+    return re.compile(r"\b(?:%s)" % "|".join(re.escape(w.lower()) for w in words))
+
+
+def parse_block(block: str) -> Dict:
+    """解析单个 ### 块中的 Instruction / Input / Output 字段
+
+    逐行走一遍状态机：某行包含字段名时切换到该字段（Instruction 优先于 Input
+    优先于 Output），取最后一个字段名之后的内容，否则作为当前字段的续行以空格拼接。
+    """
+    item = {}
+    current_key = None
+    for part in block.strip().split("\n"):
+        part = part.strip()
+        # 绝大多数续行不含冒号，先用一次查找跳过三个字段名的匹配
+        if ":" in part:
+            if "Instruction:" in part:
+                current_key = "instruction"
+                item[current_key] = part[part.rfind("Instruction:") + 12:].strip()
+                continue
+            if "Input:" in part:
+                current_key = "input"
+                item[current_key] = part[part.rfind("Input:") + 6:].strip()
+                continue
+            if "Output:" in part:
+                current_key = "output"
+                item[current_key] = part[part.rfind("Output:") + 7:].strip()
+                continue
+        if current_key:
+            item[current_key] = item.get(current_key, "") + " " + part
+    return item
+
+
+def iter_blocks(text: str) -> Iterator[Dict]:
+    """依次产出补全文本中每个非空 ### 块解析出的字段"""
+    for block in text.split("###"):
+        if block.strip():
+            yield parse_block(block)
+
+
+class Rule(NamedTuple):
+    """一条校验规则；check 返回 False 时以 name 作为拒绝原因"""
+    name: str
+    check: Callable[[Dict], bool]
+
+
+def default_rules(blacklist: Sequence[str] = BLACKLIST) -> List[Rule]:
+    blacklist_re = compile_blacklist(blacklist)
+    return [
+        Rule("length", lambda item: 3 < len(item["instruction"].split()) <= 150),
+        Rule("blacklist", lambda item: blacklist_re.search(item["instruction"].lower()) is None),
+        Rule("punctuation", lambda item: item["instruction"][0] not in _PUNCTUATION),
+        Rule("non_ascii", lambda item: item["instruction"][0].isascii()),
+    ]
+
+
+class InstructionValidator:
+    """按顺序执行规则列表，并按规则名统计拒绝次数
+
+    规则之前先检查三个字段是否齐全，并把字段规范化（去除首尾空白、
+    <noinput> 替换为空字符串）。
+    """
+
+    def __init__(self, rules: Optional[Sequence[Rule]] = None):
+        self.rules = list(rules) if rules is not None else default_rules()
+        self.rejections = defaultdict(int)
+
+    def rejection_reason(self, item: Dict) -> Optional[str]:
+        """返回指令被拒绝的原因，有效时返回 None"""
+        if "instruction" not in item or "input" not in item or "output" not in item:
+            self.rejections["missing_fields"] += 1
+            return "missing_fields"
+
+        item["instruction"] = item["instruction"].strip()
+        item["input"] = "" if item["input"].lower() == "<noinput>" else item["input"].strip()
+        item["output"] = item["output"].strip()
+
+        for rule in self.rules:
+            if not rule.check(item):
+                self.rejections[rule.name] += 1
+                return rule.name
+        return None
@@ -0,0 +1,67 @@
+import os
+import json
+from typing import List, Dict
+
+
+class JsonlSink:
+    """只追加的 JSONL 输出，每条指令一行，定期 fsync"""
+
+    def __init__(self, path: str, fsync_every: int = 100, append: bool = True):
+        self.path = path
+        self.fsync_every = fsync_every
+        self._pending = 0
+        self._file = open(path, 'a' if append else 'w', encoding='utf-8')
+
+    def append(self, item: Dict) -> None:
+        self._file.write(json.dumps(item, ensure_ascii=False) + "\n")
+        self._pending += 1
+        if self._pending >= self.fsync_every:
+            self.flush()
+
+    def flush(self) -> None:
+        """把缓冲写入磁盘并 fsync，保证崩溃后最多丢失未同步的几条"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_jsonl(path: str) -> List[Dict]:
+    """读取 JSONL；写到一半被中断的末行会被丢弃，并把文件截断到最后一条完整记录"""
+    items = []
+    valid_bytes = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+            valid_bytes += len(line)
+    if valid_bytes != os.path.getsize(path):
+        with open(path, 'r+b') as f:
+            f.truncate(valid_bytes)
+    return items
+
+
+def compact(jsonl_path: str, json_path: str) -> int:
+    """把 JSONL 整理成 Alpaca 格式的 JSON 数组；先写临时文件再原子替换"""
+    items = load_jsonl(jsonl_path)
+    tmp_path = json_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(items, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, json_path)
+    return len(items)
@@ -0,0 +1,247 @@
+import json
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+import openai
+from openai import AsyncOpenAI
+
+try:
+    import httpx
+except ImportError:  # 较新的 openai SDK 基于 httpx2
+    import httpx2 as httpx
+
+from rate_limit import APIController, AIMDConcurrencyLimiter, TrackedStream, is_retryable
+
+# 密钥失效、无权限、模型不存在说明该接口配置有误：立即摘除，只在其他可用接口上重试
+ENDPOINT_FAULT_STATUS = {401, 403, 404}
+
+ROUTING_STRATEGIES = ("least_outstanding", "latency")
+
+
+class Endpoint:
+    """一个上游接口：地址、密钥、模型名、路由权重和并发上限
+
+    每个接口有独立的 keep-alive 连接池（连接数与并发上限一致）和独立的
+    APIController（AIMD 并发窗口与可选的每分钟请求数 / token 数限速）。
+    """
+
+    def __init__(self,
+                 base_url: str,
+                 api_key: Optional[str] = None,
+                 model: Optional[str] = None,
+                 weight: float = 1.0,
+                 max_concurrency: int = 64,
+                 requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None,
+                 latency_target: Optional[float] = None,
+                 keepalive_expiry: float = 30.0):
+        self.base_url = base_url
+        self.model = model
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        limits = httpx.Limits(max_connections=max_concurrency,
+                              max_keepalive_connections=max_concurrency,
+                              keepalive_expiry=keepalive_expiry)
+        # 重试和故障转移由 EndpointPool 负责，关闭 SDK 自带的重试
+        self.client = AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=0,
+                                  http_client=openai.DefaultAsyncHttpxClient(limits=limits))
+        self.controller = APIController(
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            concurrency=AIMDConcurrencyLimiter(
+                initial=min(16, max_concurrency),
+                maximum=max_concurrency,
+                latency_target=latency_target
+            ),
+            max_retries=0
+        )
+        self.outstanding = 0
+        # 成功请求延迟的指数滑动平均
+        self.latency = None
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    @classmethod
+    def from_dict(cls, spec: Dict) -> "Endpoint":
+        return cls(**spec)
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def record_success(self, latency: float) -> None:
+        self.requests += 1
+        self.failures = 0
+        self.ejections = 0
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+    def record_failure(self, eject_after: int, eject_seconds: float, max_eject_seconds: float) -> bool:
+        """记录一次失败；连续失败 eject_after 次时摘除该接口并返回 True"""
+        # 摘除前已发出的请求陆续失败时不再重复计数
+        if not self.available(time.monotonic()):
+            return False
+        self.failures += 1
+        if self.failures < eject_after:
+            return False
+        self.eject(eject_seconds, max_eject_seconds)
+        # 恢复后先试探：再失败一次就立即以加倍的时长重新摘除
+        self.failures = eject_after - 1
+        return True
+
+    def eject(self, eject_seconds: float, max_eject_seconds: float) -> None:
+        """摘除该接口，每次连续摘除的时长加倍"""
+        self.ejected_until = time.monotonic() + min(max_eject_seconds, eject_seconds * 2 ** self.ejections)
+        self.ejections += 1
+
+    def status(self) -> Dict:
+        return {
+            "base_url": self.base_url,
+            "model": self.model,
+            "outstanding": self.outstanding,
+            "latency": self.latency,
+            "requests": self.requests,
+            "concurrency_limit": self.controller.concurrency.limit,
+            "ejected": not self.available(time.monotonic()),
+        }
+
+
+def load_endpoints(path: str) -> List[Endpoint]:
+    """从 JSON 文件读取接口列表，每项为 Endpoint 的构造参数"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [Endpoint.from_dict(spec) for spec in json.load(f)]
+
+
+class EndpointPool:
+    """在多个接口之间路由请求
+
+    least_outstanding 选择 (在途请求数 + 1) / weight 最小的接口；latency 再乘以
+    该接口的平均延迟。连续失败的接口被摘除一段时间（每次加倍），到期后自动恢复；
+    失败的请求换一个接口重试，只有全部接口都不可用时才退避等待。
+    """
+
+    def __init__(self,
+                 endpoints: Sequence[Endpoint],
+                 strategy: str = "least_outstanding",
+                 max_retries: int = 6,
+                 eject_after: int = 5,
+                 eject_seconds: float = 30.0,
+                 max_eject_seconds: float = 600.0):
+        if not endpoints:
+            raise ValueError("至少需要一个接口")
+        if strategy not in ROUTING_STRATEGIES:
+            raise ValueError(f"未知的路由策略 {strategy}，可选 {ROUTING_STRATEGIES}")
+        self.endpoints = list(endpoints)
+        self.strategy = strategy
+        self.max_retries = max_retries
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.retries = 0
+        self.ejections = 0
+
+    @property
+    def concurrency_limit(self) -> float:
+        return sum(ep.controller.concurrency.limit for ep in self.endpoints)
+
+    def healthy_count(self) -> int:
+        now = time.monotonic()
+        return sum(ep.available(now) for ep in self.endpoints)
+
+    def _score(self, endpoint: Endpoint, default_latency: float) -> float:
+        load = (endpoint.outstanding + 1) / endpoint.weight
+        if self.strategy == "latency":
+            load *= endpoint.latency if endpoint.latency is not None else default_latency
+        return load
+
+    def choose(self, exclude: Optional[Endpoint] = None) -> Endpoint:
+        now = time.monotonic()
+        live = [ep for ep in self.endpoints if ep.available(now)]
+        if not live:
+            # 全部被摘除时提前恢复最早到期的那个，而不是停止生成
+            return min(self.endpoints, key=lambda ep: ep.ejected_until)
+        if exclude is not None and len(live) > 1:
+            live = [ep for ep in live if ep is not exclude]
+        # 还有空闲并发的接口优先
+        live = [ep for ep in live if ep.outstanding < ep.max_concurrency] or live
+        known = [ep.latency for ep in live if ep.latency is not None]
+        # 还没有延迟样本的接口按已知平均值估计，保证它能分到流量
+        default_latency = sum(known) / len(known) if known else 1.0
+        return min(live, key=lambda ep: self._score(ep, default_latency))
+
+    async def call(self, request: Callable[[Endpoint], Awaitable], estimated_tokens: int = 0):
+        """选择接口执行 request(endpoint)；失败时换接口重试，重试耗尽或遇到不可重试错误时抛出
+
+        401 / 403 / 404 不会在原接口上退避重试：该接口被立即摘除，没有其他可用接口时直接抛出。
+        """
+        attempt = 0
+        failed = None
+        while True:
+            endpoint = self.choose(exclude=failed)
+            endpoint.outstanding += 1
+            start = None
+
+            async def timed():
+                nonlocal start
+                start = time.monotonic()
+                return await request(endpoint)
+
+            try:
+                response = await endpoint.controller.call(timed, estimated_tokens)
+            except asyncio.CancelledError:
+                endpoint.outstanding -= 1
+                raise
+            except Exception as e:
+                endpoint.outstanding -= 1
+                if not self._endpoint_fault(e):
+                    raise
+                self._record_failure(endpoint, e)
+                if attempt >= self.max_retries or (self._misconfigured(e) and not self._others_available(endpoint)):
+                    raise
+                self.retries += 1
+                attempt += 1
+                failed = endpoint
+                # 没有其他可用接口时才在原接口上退避
+                if self.choose(exclude=endpoint) is endpoint:
+                    await asyncio.sleep(endpoint.controller.backoff(attempt - 1, e))
+                continue
+
+            if isinstance(response, TrackedStream):
+                # 流式响应要等流结束才释放在途计数并记录成败，中途出错同样计入摘除
+                response.add_done_callback(
+                    lambda stream, error, endpoint=endpoint, start=start: self._finish_stream(endpoint, error, start))
+                return response
+            endpoint.outstanding -= 1
+            endpoint.record_success(time.monotonic() - start)
+            return response
+
+    @staticmethod
+    def _misconfigured(error: BaseException) -> bool:
+        return getattr(error, "status_code", None) in ENDPOINT_FAULT_STATUS
+
+    @classmethod
+    def _endpoint_fault(cls, error: BaseException) -> bool:
+        """可重试错误和密钥、权限、模型类错误说明接口本身有问题"""
+        return is_retryable(error) or cls._misconfigured(error)
+
+    def _others_available(self, endpoint: Endpoint) -> bool:
+        now = time.monotonic()
+        return any(ep is not endpoint and ep.available(now) for ep in self.endpoints)
+
+    def _record_failure(self, endpoint: Endpoint, error: BaseException) -> None:
+        if self._misconfigured(error):
+            if endpoint.available(time.monotonic()):
+                endpoint.eject(self.eject_seconds, self.max_eject_seconds)
+                self.ejections += 1
+                print(f"接口 {endpoint.base_url} 返回 {error.status_code}，暂时摘除")
+        elif endpoint.record_failure(self.eject_after, self.eject_seconds, self.max_eject_seconds):
+            self.ejections += 1
+            print(f"接口 {endpoint.base_url} 连续失败，暂时摘除")
+
+    async def _finish_stream(self, endpoint: Endpoint, error: Optional[BaseException], start: float) -> None:
+        endpoint.outstanding -= 1
+        if error is None:
+            endpoint.record_success(time.monotonic() - start)
+        elif not isinstance(error, asyncio.CancelledError) and self._endpoint_fault(error):
+            self._record_failure(endpoint, error)
@@ -0,0 +1,150 @@
+import random
+from collections import defaultdict
+from typing import List, Optional
+
+from similarity import tokenize
+
+
+def task_verb(instruction: str) -> str:
+    """用指令的第一个词近似动词 / 任务类型（疑问句为 what、how 等疑问词）"""
+    tokens = tokenize(instruction)
+    return tokens[0] if tokens else ""
+
+
+class AliasTable:
+    """Vose 别名表：O(n) 构建，O(1) 按权重抽样"""
+
+    def __init__(self, weights: List[float], rng: random.Random):
+        self.rng = rng
+        n = len(weights)
+        self.size = n
+        self.total = float(sum(weights))
+        self.prob = [0.0] * n
+        self.alias = [0] * n
+        if n == 0 or self.total <= 0:
+            return
+        scaled = [w * n / self.total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def sample(self) -> int:
+        i = self.rng.randrange(self.size)
+        return i if self.rng.random() < self.prob[i] else self.alias[i]
+
+
+class ExamplePool:
+    """提示词示例的选择策略
+
+    池中包含种子任务和此后接受的全部指令。每个示例的权重为
+    (1 + 该动词已接受的条数) ** -rarity_power * 该示例参与的提示词产出指令的接受率，
+    使冷门动词 / 任务类型和历史上产出新颖指令的示例更常被选中。接受率以整体接受率为
+    先验做平滑。
+
+    抽样使用别名表，权重变化和新示例累积到池大小的 rebuild_fraction 时才整体重建；
+    重建之间新加入的示例单独按拒绝抽样选取，因此每次抽样都是期望 O(1)。
+    """
+
+    def __init__(self,
+                 seed_tasks,
+                 rng: Optional[random.Random] = None,
+                 rarity_power: float = 0.5,
+                 prior_strength: float = 5.0,
+                 rebuild_fraction: float = 0.05,
+                 min_rebuild: int = 64):
+        self.rng = rng if rng is not None else random.Random()
+        self.rarity_power = rarity_power
+        self.prior_strength = prior_strength
+        self.rebuild_fraction = rebuild_fraction
+        self.min_rebuild = min_rebuild
+        self.blocks: List[str] = []
+        self.verbs: List[str] = []
+        self.trials: List[int] = []
+        self.successes: List[int] = []
+        self.verb_counts = defaultdict(int)
+        self.total_trials = 0
+        self.total_successes = 0
+        self._table = AliasTable([], self.rng)
+        # 上次重建之后加入的示例下标及其当时的权重
+        self._pending: List[int] = []
+        self._pending_weights: List[float] = []
+        self._pending_total = 0.0
+        self._pending_max = 0.0
+        self._dirty = 0
+        for task in seed_tasks:
+            self.add(task["instruction"], task["example"])
+        self.rebuild()
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def weight(self, idx: int) -> float:
+        prior = (self.total_successes + 1) / (self.total_trials + 2)
+        acceptance = (self.successes[idx] + self.prior_strength * prior) / (self.trials[idx] + self.prior_strength)
+        rarity = (1 + self.verb_counts[self.verbs[idx]]) ** -self.rarity_power
+        return acceptance * rarity
+
+    def add(self, instruction: str, block: str) -> int:
+        """加入一条已接受的指令及其渲染好的示例块"""
+        idx = len(self.blocks)
+        verb = task_verb(instruction)
+        self.blocks.append(block)
+        self.verbs.append(verb)
+        self.trials.append(0)
+        self.successes.append(0)
+        self.verb_counts[verb] += 1
+        weight = self.weight(idx)
+        self._pending.append(idx)
+        self._pending_weights.append(weight)
+        self._pending_total += weight
+        self._pending_max = max(self._pending_max, weight)
+        self._touch()
+        return idx
+
+    def observe(self, example_ids: List[int], accepted: bool) -> None:
+        """记录由这些示例引出的一条指令最终是否被接受"""
+        self.total_trials += 1
+        self.total_successes += accepted
+        for idx in example_ids:
+            self.trials[idx] += 1
+            self.successes[idx] += accepted
+        self._touch()
+
+    def _touch(self) -> None:
+        self._dirty += 1
+        if self._dirty >= max(self.min_rebuild, int(len(self.blocks) * self.rebuild_fraction)):
+            self.rebuild()
+
+    def rebuild(self) -> None:
+        self._table = AliasTable([self.weight(i) for i in range(len(self.blocks))], self.rng)
+        self._pending = []
+        self._pending_weights = []
+        self._pending_total = 0.0
+        self._pending_max = 0.0
+        self._dirty = 0
+
+    def _sample_one(self) -> int:
+        total = self._pending_total + self._table.total
+        if self._pending and self.rng.random() * total < self._pending_total:
+            while True:
+                k = self.rng.randrange(len(self._pending))
+                if self.rng.random() * self._pending_max < self._pending_weights[k]:
+                    return self._pending[k]
+        return self._table.sample()
+
+    def sample(self, k: int) -> List[int]:
+        """按权重不放回地抽取 k 个示例下标"""
+        k = min(k, len(self.blocks))
+        chosen = []
+        while len(chosen) < k:
+            idx = self._sample_one()
+            if idx not in chosen:
+                chosen.append(idx)
+        return chosen
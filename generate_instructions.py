@@ -1,24 +1,31 @@
+import os
 import time
 import json
 import random
-import string
 from typing import List, Dict
 import re
 from rouge_score import rouge_scorer
 from openai import OpenAI
 import tqdm
 
+from completion_parser import InstructionValidator, iter_blocks
+from parallel_similarity import ShardedSimilarityFilter
+
 class AlpacaDataGenerator:
     def __init__(self, 
                  model_name="deepseek-chat", 
                  temperature=1.0, 
                  top_p=1.0, 
-                 base_url="https://api.deepseek.com"):
+                 base_url="https://api.deepseek.com",
+                 similarity_workers=0):
         self.model_name = model_name
         self.temperature = temperature
         self.top_p = top_p
         self.scorer = rouge_scorer.RougeScorer(['rougeL'], use_stemmer=False)
         self.client = OpenAI(base_url=base_url)
+        # 大于 0 时把相似度过滤分片到多个进程，结果与串行 check_similarity 相同
+        self.similarity_workers = similarity_workers
+        self.validator = InstructionValidator()
         
         self.system_prompt = """You are a helpful assistant that generates diverse task instructions. These instructions will be used to evaluate language models."""
 
@@ -101,70 +108,12 @@ Output: [output]
         if not response or not response.choices:
             return []
             
-        instructions = []
         raw_text = response.choices[0].message.content
-        examples = re.split("###", raw_text)
-        
-        for example in examples:
-            if not example.strip():
-                continue
-                
-            # 解析指令、输入和输出
-            parts = example.strip().split("\n")
-            current_item = {}
-            current_key = None
-            
-            for part in parts:
-                part = part.strip()
-                if "Instruction:" in part:
-                    current_key = "instruction"
-                    current_item[current_key] = part.split("Instruction:")[-1].strip()
-                elif "Input:" in part:
-                    current_key = "input"
-                    current_item[current_key] = part.split("Input:")[-1].strip()
-                elif "Output:" in part:
-                    current_key = "output"
-                    current_item[current_key] = part.split("Output:")[-1].strip()
-                elif current_key:
-                    current_item[current_key] = current_item.get(current_key, "") + " " + part
-            
-            if self.validate_instruction(current_item):
-                instructions.append(current_item)
-                
-        return instructions
+        return [item for item in iter_blocks(raw_text) if self.validate_instruction(item)]
 
     def validate_instruction(self, item: Dict) -> bool:
         """验证生成的指令是否有效"""
-        if not all(k in item for k in ["instruction", "input", "output"]):
-            return False
-            
-        # 清理和标准化数据
-        item["instruction"] = item["instruction"].strip()
-        item["input"] = "" if item["input"].lower() == "<noinput>" else item["input"].strip()
-        item["output"] = item["output"].strip()
-        
-        # 基本验证规则
-        if len(item["instruction"].split()) <= 3 or len(item["instruction"].split()) > 150:
-            return False
-            
-        # 检查黑名单词
-        blacklist = [
-            "image", "images", "graph", "graphs", "picture", "pictures",
-            "file", "files", "map", "maps", "draw", "plot", "go to",
-            "video", "audio", "music", "flowchart", "diagram"
-        ]
-        if any(word in item["instruction"].lower() for word in blacklist):
-            return False
-            
-        # 检查是否以标点符号开头
-        if item["instruction"][0] in string.punctuation:
-            return False
-            
-        # 检查是否以非英文字符开头
-        if not item["instruction"][0].isascii():
-            return False
-            
-        return True
+        return self.validator.rejection_reason(item) is None
 
     def check_similarity(self, new_instruction: str, existing_instructions: List[str], threshold: float = 0.7) -> bool:
         """检查新指令与现有指令的相似度"""
@@ -191,29 +140,49 @@ Output: [output]
         dataset = []
         existing_instructions = [t["instruction"] for t in seed_tasks]
         
+        similarity_filter = None
+        if self.similarity_workers:
+            similarity_filter = ShardedSimilarityFilter(self.similarity_workers)
+            similarity_filter.add(existing_instructions)
+        
         pbar = tqdm.tqdm(total=num_instructions)
         
-        while len(dataset) < num_instructions:            
-            messages = self.create_prompt(seed_tasks)
-            
-            new_instructions = self.generate_instructions(messages)
-            
-            # 过滤相似指令
-            for item in new_instructions:
-                if self.check_similarity(item["instruction"], existing_instructions):
-                    dataset.append(item)
-                    existing_instructions.append(item["instruction"])
-                    pbar.update(1)
-                    
-                    # 定期保存
-                    if len(dataset) % 100 == 0:
-                        self.save_dataset(dataset, output_file)
+        try:
+            while len(dataset) < num_instructions:            
+                messages = self.create_prompt(seed_tasks)
+                
+                new_instructions = self.generate_instructions(messages)
+                
+                # 过滤相似指令
+                decisions = None
+                if similarity_filter is not None:
+                    decisions = similarity_filter.filter_batch([item["instruction"] for item in new_instructions])
+                accepted = []
+                for i, item in enumerate(new_instructions):
+                    if decisions is not None:
+                        is_new = decisions[i]
+                    else:
+                        is_new = self.check_similarity(item["instruction"], existing_instructions)
+                    if is_new:
+                        dataset.append(item)
+                        existing_instructions.append(item["instruction"])
+                        accepted.append(item["instruction"])
+                        pbar.update(1)
+                        
+                        # 定期保存
+                        if len(dataset) % 100 == 0:
+                            self.save_dataset(dataset, output_file)
+                            
+                    if len(dataset) >= num_instructions:
+                        break
+                if similarity_filter is not None:
+                    similarity_filter.add(accepted)
                         
-                if len(dataset) >= num_instructions:
-                    break
-                    
-            # 添加延迟避免超出API限制
-            # time.sleep(1)
+                # 添加延迟避免超出API限制
+                # time.sleep(1)
+        finally:
+            if similarity_filter is not None:
+                similarity_filter.close()
         
         # 最终保存
         self.save_dataset(dataset, output_file)
@@ -230,9 +199,10 @@ def main():
     seed_file = "data/seed_tasks.jsonl"
     output_file = "data/alpaca_data.json"
     num_instructions = 52000
+    similarity_workers = os.cpu_count()
     
     # 创建生成器实例
-    generator = AlpacaDataGenerator(model_name=model_name)
+    generator = AlpacaDataGenerator(model_name=model_name, similarity_workers=similarity_workers)
     
     # 生成数据集
     generator.generate_dataset(
@@ -1,16 +1,35 @@
+import os
 import time
 import json
+import math
+import argparse
 import random
-import string
 import asyncio
+import contextlib
+import itertools
 import concurrent.futures
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 import re
-from rouge_score import rouge_scorer
-from openai import AsyncOpenAI
 import tqdm
-from collections import deque
 from functools import lru_cache
+from similarity import MinHashLSHIndex
+from completion_parser import InstructionValidator, iter_blocks, parse_block
+from endpoints import Endpoint, EndpointPool, load_endpoints
+from request_sizing import RequestSizer
+from example_selection import ExamplePool
+from dataset_sink import JsonlSink, load_jsonl, compact
+from response_cache import ResponseCache
+from telemetry import PipelineMetrics, serve_prometheus
+
+# 提示词要求模型在最后一个任务之后输出的结束标记，同时作为 stop 序列
+END_MARKER = "### END"
+
+
+def strip_partial_block(text: str) -> str:
+    """去掉因 max_tokens 截断而不完整的最后一个块"""
+    end = text.rfind("###")
+    return text[:end] if end >= 0 else ""
+
 
 class AlpacaDataGenerator:
     def __init__(self, 
@@ -18,18 +37,87 @@ class AlpacaDataGenerator:
                  temperature=1.0, 
                  top_p=1.0, 
                  base_url="https://api.deepseek.com",
-                 batch_size=5,
-                 max_workers=3):
+                 max_workers=3,
+                 queue_size=1000,
+                 requests_per_minute=None,
+                 tokens_per_minute=None,
+                 latency_target=None,
+                 max_retries=6,
+                 stream=False,
+                 tasks_per_request=20,
+                 max_malformed_blocks=3,
+                 cache=None,
+                 metrics_file=None,
+                 metrics_interval=30.0,
+                 similarity_index=None,
+                 validator=None,
+                 api_key=None,
+                 shard_id=0,
+                 num_shards=1,
+                 seed=None,
+                 endpoints=None,
+                 routing="least_outstanding",
+                 adaptive_sizing=True,
+                 max_tokens_limit=8192,
+                 example_selection="adaptive"):
         self.model_name = model_name
         self.temperature = temperature
         self.top_p = top_p
-        self.batch_size = batch_size
+        # 同时在途的请求数上限；每个请求完成后立即补上新的请求
         self.max_workers = max_workers
-        self.scorer = rouge_scorer.RougeScorer(['rougeL'], use_stemmer=False)
-        self.client = AsyncOpenAI(base_url=base_url)
+        self.queue_size = queue_size
+        self.max_tokens = 3072
+        self.stop = [END_MARKER]
+        # 可选的 ResponseCache：命中时直接解析缓存的原始补全，不再请求 API
+        self.cache = cache
+        self._sample_counts = {}
+        # 多机分片生成：每个分片有独立、可复现的随机数流用于抽取示例
+        if num_shards > 1 and seed is None:
+            raise ValueError("分片生成需要指定 seed，否则各分片的示例抽取无法复现")
+        self.shard_id = shard_id
+        self.num_shards = num_shards
+        self.rng = random.Random(None if seed is None else f"{seed}:{shard_id}")
+        self._stopping = False
+        # 各阶段指标；设置 metrics_file 时每 metrics_interval 秒追加一行 JSON 快照
+        self.metrics = PipelineMetrics()
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        # 流式模式下边生成边解析：凑够本次请求的任务数，或连续 max_malformed_blocks
+        # 个格式错误的块、复述提示词中的示例时提前中止
+        self.stream = stream
+        self.tasks_per_request = tasks_per_request
+        # 按每任务 token、截断率和各位置的接受率调整每次请求的任务数与 max_tokens
+        self.sizer = RequestSizer(
+            initial_tasks=tasks_per_request,
+            initial_max_tokens=self.max_tokens,
+            max_tokens_limit=max_tokens_limit,
+            adaptive=adaptive_sizing
+        )
+        self.max_malformed_blocks = max_malformed_blocks
+        # 未给出 endpoints 时只使用 base_url 一个接口；多个接口时按 routing 策略分流，
+        # 失败的请求换接口重试，连续失败的接口会被暂时摘除
+        if endpoints is None:
+            endpoints = [Endpoint(
+                base_url=base_url,
+                api_key=api_key,
+                model=model_name,
+                max_concurrency=max_workers,
+                requests_per_minute=requests_per_minute,
+                tokens_per_minute=tokens_per_minute,
+                latency_target=latency_target
+            )]
+        self.pool = EndpointPool(endpoints, strategy=routing, max_retries=max_retries)
         
-        # Cache recently checked instructions to avoid repeated Rouge calculations
-        self.recent_instructions = deque(maxlen=1000)
+        # 覆盖全部已接受指令的近重复索引，可替换为 similarity.DequeSimilarityIndex
+        self.similarity_index = similarity_index if similarity_index is not None else MinHashLSHIndex()
+        # adaptive：从种子和已接受指令组成的池中按动词稀缺度和历史接受率抽取示例；
+        # uniform：与原来一样只从种子任务中均匀抽取
+        if example_selection not in ("adaptive", "uniform"):
+            raise ValueError(f"未知的示例选择策略 {example_selection}")
+        self.example_selection = example_selection
+        self.example_pool = None
+        # 可插拔的校验规则列表，按规则名统计拒绝次数
+        self.validator = validator if validator is not None else InstructionValidator()
         
         self.system_prompt = """You are a helpful assistant that generates diverse task instructions. These instructions will be used to evaluate language models."""
         
@@ -49,197 +137,613 @@ Format each task as:
 Instruction: [instruction]
 Input: [input]
 Output: [output]
-###"""
+###
+
+After the last task, write "### END" on its own line."""
+        
+        # 所有请求共享、逐字节相同的前缀消息，便于服务端前缀缓存命中；
+        # 随机示例只出现在最后一条消息中
+        self.prefix_messages = (
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": self.task_requirements},
+        )
+
+    @staticmethod
+    def render_example(task: Dict) -> str:
+        """把种子任务渲染成提示词中的示例块"""
+        instruction = re.sub(r"\s+", " ", task["instruction"]).strip().rstrip(":")
+        input_text = "<noinput>" if task["input"].lower() == "" else task["input"]
+        return (
+            f"###\n"
+            f"Instruction: {instruction}\n"
+            f"Input: {input_text}\n"
+            f"Output: {task['output']}\n"
+        )
 
     @lru_cache(maxsize=1000)
     def load_seed_tasks(self, seed_file_path: str) -> tuple:
-        """加载种子任务并缓存结果"""
+        """加载种子任务并缓存结果，示例块在加载时预先渲染"""
         with open(seed_file_path, 'r') as f:
             seed_tasks = [json.loads(l) for l in f]
-        return tuple(
-            {
+        tasks = []
+        for t in seed_tasks:
+            task = {
                 "instruction": t["instruction"],
                 "input": t["instances"][0]["input"],
                 "output": t["instances"][0]["output"]
             }
-            for t in seed_tasks
+            task["example"] = self.render_example(task)
+            tasks.append(task)
+        return tuple(tasks)
+
+    def create_prompt(self,
+                      seed_tasks: tuple,
+                      num_examples: int = 3,
+                      num_tasks: Optional[int] = None) -> Tuple[List[Dict], List[int]]:
+        """创建一个提示词，同时返回所用示例在示例池中的下标（均匀抽样时为空）"""
+        num_tasks = num_tasks or self.tasks_per_request
+        if self.example_pool is not None:
+            example_ids = self.example_pool.sample(num_examples)
+            blocks = [self.example_pool.blocks[idx] for idx in example_ids]
+        else:
+            example_ids = []
+            blocks = [task["example"] for task in self.rng.sample(seed_tasks, num_examples)]
+        examples_text = "Here are some examples:\n\n" + "".join(blocks)
+        examples_text += f"\nNow generate {num_tasks} new, diverse task instructions following the same format:"
+        
+        messages = list(self.prefix_messages)
+        messages.append({"role": "user", "content": examples_text})
+        return messages, example_ids
+
+    def create_prompts_batch(self,
+                             seed_tasks: tuple,
+                             batch_size: int,
+                             num_examples: int = 3,
+                             num_tasks: Optional[int] = None) -> List[List[Dict]]:
+        """批量创建提示词；num_tasks 为要求模型生成的任务数，默认 tasks_per_request"""
+        return [self.create_prompt(seed_tasks, num_examples, num_tasks)[0] for _ in range(batch_size)]
+
+    def _create_completion(self,
+                           messages: List[Dict],
+                           stream: bool = False,
+                           max_tokens: Optional[int] = None,
+                           served: Optional[Dict] = None):
+        """经 APIController 流控后发起 chat completion 请求
+
+        served 不为 None 时，served["model"] 记录最终响应该请求的接口所用的模型名。
+        """
+        max_tokens = max_tokens or self.max_tokens
+        # 粗略按 4 字符 1 个 token 预估，用于每分钟 token 限速，返回后按实际用量校正
+        estimated_tokens = sum(len(m["content"]) for m in messages) // 4 + max_tokens
+        # 流式响应只有在最后一个 chunk 中才带 usage
+        extra = {"stream_options": {"include_usage": True}} if stream else {}
+        served = served if served is not None else {}
+
+        def request(endpoint):
+            # 换接口重试时被覆盖，最终留下成功的那个接口的模型
+            served["model"] = endpoint.model or self.model_name
+            return endpoint.client.chat.completions.create(
+                model=served["model"],
+                messages=messages,
+                temperature=self.temperature,
+                top_p=self.top_p,
+                max_tokens=max_tokens,
+                stop=self.stop,
+                stream=stream,
+                **extra
+            )
+
+        return self.pool.call(request, estimated_tokens=estimated_tokens)
+
+    @property
+    def cache_models(self) -> List[str]:
+        """接口池中可能响应请求的模型名，缓存按实际响应的模型分别记录"""
+        return list(dict.fromkeys(ep.model or self.model_name for ep in self.pool.endpoints))
+
+    def _cache_keys(self, messages: List[Dict], max_tokens: Optional[int] = None) -> Dict[str, str]:
+        """每个模型的缓存键；同一提示词在一次运行中的第 n 次请求使用 sample_index=n"""
+        params = (messages, self.temperature, self.top_p, max_tokens or self.max_tokens, self.stop)
+        prompt_key = ResponseCache.make_key("", *params, 0)
+        index = self._sample_counts.get(prompt_key, 0)
+        self._sample_counts[prompt_key] = index + 1
+        return {model: ResponseCache.make_key(model, *params, index) for model in self.cache_models}
+
+    def _cache_lookup(self, keys: Optional[Dict[str, str]]) -> Optional[str]:
+        """依次查找各模型的缓存条目：池中任一模型都可能响应这个请求"""
+        if keys is None:
+            return None
+        for key in keys.values():
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        return None
+
+    async def generate_single(self,
+                              messages: List[Dict],
+                              max_tokens: Optional[int] = None) -> List[Tuple[int, Dict]]:
+        """异步生成单个提示词对应的指令，返回 (块序号, 指令) 列表
+
+        因 max_tokens 截断的补全会丢弃最后一个不完整的块；缓存中保存的也是去掉该块后的文本。
+        """
+        keys = self._cache_keys(messages, max_tokens) if self.cache is not None else None
+        cached = self._cache_lookup(keys)
+        if cached is not None:
+            self.metrics.observe_cache_hit()
+            return self.parse_positions(cached)
+        
+        start = time.perf_counter()
+        served = {}
+        try:
+            response = await self._create_completion(messages, max_tokens=max_tokens, served=served)
+        except Exception as e:
+            self.metrics.observe_error()
+            print(f"生成指令时出错: {e}")
+            return []
+        usage = getattr(response, "usage", None)
+        self.metrics.observe_request(time.perf_counter() - start, usage)
+        if not response or not response.choices or not response.choices[0].message.content:
+            return []
+        
+        text = response.choices[0].message.content
+        truncated = response.choices[0].finish_reason == "length"
+        if truncated:
+            text = strip_partial_block(text)
+            self.metrics.reject("truncated")
+        if keys is not None and text.strip():
+            self.cache.put(keys[served["model"]], served["model"], text)
+        with self.metrics.timer("parse"):
+            items = self.parse_positions(text)
+        self.sizer.observe_completion(
+            sum(1 for block in text.split("###") if block.strip()),
+            getattr(usage, "completion_tokens", None),
+            getattr(usage, "prompt_tokens", None),
+            truncated
         )
+        self.metrics.observe_completion(len(items))
+        return items
 
-    def create_prompts_batch(self, seed_tasks: tuple, batch_size: int, num_examples: int = 3) -> List[List[Dict]]:
-        """批量创建提示词"""
-        prompts = []
-        for _ in range(batch_size):
-            messages = [
-                {"role": "system", "content": self.system_prompt},
-            ]
-            
-            messages.append({"role": "user", "content": self.task_requirements})
-            
-            examples = random.sample(seed_tasks, num_examples)
-            examples_text = "Here are some examples:\n\n"
-            
-            for task in examples:
-                instruction = re.sub(r"\s+", " ", task["instruction"]).strip().rstrip(":")
-                input_text = "<noinput>" if task["input"].lower() == "" else task["input"]
-                
-                examples_text += f"###\n"
-                examples_text += f"Instruction: {instruction}\n"
-                examples_text += f"Input: {input_text}\n"
-                examples_text += f"Output: {task['output']}\n"
-            
-            examples_text += "\nNow generate 20 new, diverse task instructions following the same format:"
-            messages.append({"role": "user", "content": examples_text})
-            prompts.append(messages)
+    async def generate_streaming(self,
+                                 messages: List[Dict],
+                                 num_tasks: Optional[int] = None,
+                                 max_tokens: Optional[int] = None):
+        """流式生成：每个 ### 块一闭合就解析、校验并立即产出 (块序号, 指令)"""
+        num_tasks = num_tasks or self.tasks_per_request
+        keys = self._cache_keys(messages, max_tokens) if self.cache is not None else None
+        cached = self._cache_lookup(keys)
+        if cached is not None:
+            self.metrics.observe_cache_hit()
+            for pair in self.parse_positions(cached):
+                yield pair
+            return
+        
+        start = time.perf_counter()
+        served = {}
+        try:
+            stream = await self._create_completion(messages, stream=True, max_tokens=max_tokens, served=served)
+        except Exception as e:
+            self.metrics.observe_error()
+            print(f"生成指令时出错: {e}")
+            return
+        
+        # 提示词中各示例的指令，用于发现模型开始复述示例
+        example_instructions = {item["instruction"].strip() for item in iter_blocks(messages[-1]["content"])
+                                if "instruction" in item}
+        buffer = ""
+        # 已处理且没有触发中止的文本；中止时只缓存这一部分，避免缓存被截断的块
+        consumed = ""
+        blocks = 0
+        produced = 0
+        malformed = 0
+        usage = None
+        finish_reason = None
+        try:
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                buffer += chunk.choices[0].delta.content or ""
+                while "###" in buffer:
+                    block, buffer = buffer.split("###", 1)
+                    if not block.strip():
+                        consumed += block + "###"
+                        continue
+                    position = blocks
+                    blocks += 1
+                    item = self.parse_block(block)
+                    if not all(k in item for k in ["instruction", "input", "output"]):
+                        malformed += 1
+                        if malformed >= self.max_malformed_blocks:
+                            return
+                        consumed += block + "###"
+                        continue
+                    malformed = 0
+                    if not self.validate_instruction(item):
+                        consumed += block + "###"
+                        continue
+                    # 通过校验的指令与某个示例完全相同：模型开始复述提示词，说明已经偏离任务
+                    if item["instruction"] in example_instructions:
+                        return
+                    consumed += block + "###"
+                    produced += 1
+                    yield position, item
+                    if produced >= num_tasks:
+                        return
             
-        return prompts
+            # 被 max_tokens 截断时最后一个块不完整，直接丢弃
+            if finish_reason == "length":
+                self.metrics.reject("truncated")
+            elif buffer.strip():
+                # 正常结束时最后一个块没有结尾的 ###
+                consumed += buffer
+                position = blocks
+                blocks += 1
+                item = self.parse_block(buffer)
+                if self.validate_instruction(item) and item["instruction"] not in example_instructions:
+                    produced += 1
+                    yield position, item
+        except Exception as e:
+            print(f"流式生成时出错: {e}")
+        finally:
+            # 提前中止时关闭连接，不再为后续 token 付费
+            await stream.close()
+            self.metrics.observe_request(time.perf_counter() - start, usage)
+            self.metrics.observe_completion(produced)
+            self.sizer.observe_blocks(blocks)
+            # 提前中止时没有 usage，不计入每任务 token 的统计
+            if usage is not None:
+                self.sizer.observe_completion(
+                    blocks,
+                    getattr(usage, "completion_tokens", None),
+                    getattr(usage, "prompt_tokens", None),
+                    finish_reason == "length"
+                )
+            if keys is not None and consumed.strip():
+                self.cache.put(keys[served["model"]], served["model"], consumed)
 
     async def generate_instructions_batch(self, messages_batch: List[List[Dict]]) -> List[Dict]:
         """异步批量生成指令"""
-        async def generate_single(messages):
+        tasks = [self.generate_single(messages) for messages in messages_batch]
+        results = await asyncio.gather(*tasks)
+        return [item for sublist in results for _, item in sublist]
+
+    async def _produce(self, seed_tasks: tuple, queue: asyncio.Queue) -> None:
+        """生产者：占用一个并发槽位，不断发起请求并把解析出的指令逐条放入队列"""
+        # 关闭流式连接时底层 HTTP 库可能吞掉取消信号，因此另外检查停止标志
+        while not self._stopping:
+            num_tasks, max_tokens = self.sizer.plan()
+            messages, example_ids = self.create_prompt(seed_tasks, num_tasks=num_tasks)
+            if self.stream:
+                async with contextlib.aclosing(self.generate_streaming(messages, num_tasks, max_tokens)) as items:
+                    async for position, item in items:
+                        if self._stopping:
+                            return
+                        await queue.put((position, item, example_ids))
+            else:
+                for position, item in await self.generate_single(messages, max_tokens):
+                    if self._stopping:
+                        return
+                    await queue.put((position, item, example_ids))
+
+    @staticmethod
+    async def _next_item(queue: asyncio.Queue, producers: List[asyncio.Task]):
+        """取出队列中的下一条指令，同时监视生产者
+
+        任一生产者抛出异常时重新抛出（由调用方取消其余生产者）；所有生产者都已结束
+        且队列为空时返回 None。
+        """
+        while True:
+            if not queue.empty():
+                return queue.get_nowait()
+            for producer in producers:
+                if producer.done() and not producer.cancelled() and producer.exception() is not None:
+                    raise producer.exception()
+            running = [producer for producer in producers if not producer.done()]
+            if not running:
+                return None
+            getter = asyncio.ensure_future(queue.get())
             try:
-                response = await self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=messages,
-                    temperature=self.temperature,
-                    top_p=self.top_p,
-                    max_tokens=3072,
-                    stop=["20.", "20:"]
-                )
-                return self.parse_response(response)
-            except Exception as e:
-                print(f"生成指令时出错: {e}")
-                return []
+                await asyncio.wait([getter, *running], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                if not getter.done():
+                    getter.cancel()
+            if getter.done() and not getter.cancelled():
+                return getter.result()
 
-        tasks = [generate_single(messages) for messages in messages_batch]
-        results = await asyncio.gather(*tasks)
-        return [item for sublist in results for item in sublist]
+    def parse_block(self, example: str) -> Dict:
+        """解析单个 ### 块中的 Instruction / Input / Output 字段"""
+        return parse_block(example)
 
     def parse_response(self, response) -> List[Dict]:
         """解析API响应"""
         if not response or not response.choices:
             return []
-            
-        instructions = []
-        raw_text = response.choices[0].message.content
-        examples = re.split("###", raw_text)
-        
-        for example in examples:
-            if not example.strip():
-                continue
-                
-            parts = example.strip().split("\n")
-            current_item = {}
-            current_key = None
-            
-            for part in parts:
-                part = part.strip()
-                if "Instruction:" in part:
-                    current_key = "instruction"
-                    current_item[current_key] = part.split("Instruction:")[-1].strip()
-                elif "Input:" in part:
-                    current_key = "input"
-                    current_item[current_key] = part.split("Input:")[-1].strip()
-                elif "Output:" in part:
-                    current_key = "output"
-                    current_item[current_key] = part.split("Output:")[-1].strip()
-                elif current_key:
-                    current_item[current_key] = current_item.get(current_key, "") + " " + part
-            
-            if self.validate_instruction(current_item):
-                instructions.append(current_item)
-                
-        return instructions
+        return self.parse_text(response.choices[0].message.content)
+
+    def parse_text(self, raw_text: str) -> List[Dict]:
+        """解析补全文本中的所有 ### 块"""
+        return [item for item in iter_blocks(raw_text) if self.validate_instruction(item)]
+
+    def parse_positions(self, raw_text: str) -> List[Tuple[int, Dict]]:
+        """解析补全文本，返回有效指令及其块序号；块序号用于统计各位置的接受率"""
+        blocks = list(iter_blocks(raw_text))
+        self.sizer.observe_blocks(len(blocks))
+        return [(pos, item) for pos, item in enumerate(blocks) if self.validate_instruction(item)]
+
+    def rejection_reason(self, item: Dict) -> Optional[str]:
+        """返回指令被拒绝的原因，有效时返回 None"""
+        return self.validator.rejection_reason(item)
 
     def validate_instruction(self, item: Dict) -> bool:
         """验证生成的指令是否有效"""
-        if not all(k in item for k in ["instruction", "input", "output"]):
-            return False
-            
-        item["instruction"] = item["instruction"].strip()
-        item["input"] = "" if item["input"].lower() == "<noinput>" else item["input"].strip()
-        item["output"] = item["output"].strip()
-        
-        if len(item["instruction"].split()) <= 3 or len(item["instruction"].split()) > 150:
-            return False
-            
-        blacklist = [
-            "image", "images", "graph", "graphs", "picture", "pictures",
-            "file", "files", "map", "maps", "draw", "plot", "go to",
-            "video", "audio", "music", "flowchart", "diagram"
-        ]
-        if any(word in item["instruction"].lower() for word in blacklist):
-            return False
-            
-        if item["instruction"][0] in string.punctuation:
+        reason = self.rejection_reason(item)
+        if reason is not None:
+            self.metrics.reject(reason)
             return False
-            
-        if not item["instruction"][0].isascii():
-            return False
-            
         return True
 
     def check_similarity(self, new_instruction: str, threshold: float = 0.7) -> bool:
-        """检查新指令与最近指令的相似度"""
-        if not self.recent_instructions:
-            return True
-            
-        for existing in self.recent_instructions:
-            scores = self.scorer.score(existing, new_instruction)
-            if scores['rougeL'].fmeasure > threshold:
-                return False
-        return True
+        """检查新指令与已接受指令的相似度"""
+        return not self.similarity_index.has_near_duplicate(new_instruction, threshold)
+
+    def load_existing(self, jsonl_file: str, output_file: str) -> List[Dict]:
+        """续跑时读取已有输出并重建去重索引；没有 JSONL 时退回读取旧的 JSON 数组"""
+        if os.path.exists(jsonl_file):
+            dataset = load_jsonl(jsonl_file)
+        elif os.path.exists(output_file):
+            with open(output_file, 'r', encoding='utf-8') as f:
+                dataset = json.load(f)
+            with JsonlSink(jsonl_file, append=False) as sink:
+                for item in dataset:
+                    sink.append(item)
+        else:
+            dataset = []
+        
+        for item in dataset:
+            self.similarity_index.add(item["instruction"])
+        return dataset
 
     async def generate_dataset(self, 
                            seed_file: str,
                            num_instructions: int,
-                           output_file: str) -> None:
-        """异步生成完整数据集"""
+                           output_file: str,
+                           resume: bool = False,
+                           compact_output: bool = True) -> None:
+        """异步生成完整数据集
+
+        接受的指令逐条追加到与 output_file 同名的 .jsonl 文件；结束时可选地
+        整理成 Alpaca 格式的 JSON 数组写入 output_file。
+        """
         seed_tasks = self.load_seed_tasks(seed_file)
         print(f"加载了 {len(seed_tasks)} 个种子任务")
         
+        jsonl_file = os.path.splitext(output_file)[0] + ".jsonl"
+        dataset = self.load_existing(jsonl_file, output_file) if resume else []
+        if resume:
+            print(f"从 {jsonl_file} 恢复了 {len(dataset)} 条指令")
+        if self.example_selection == "adaptive":
+            self.example_pool = ExamplePool(seed_tasks, rng=self.rng)
+            for item in dataset:
+                self.example_pool.add(item["instruction"], self.render_example(item))
+        
+        pbar = tqdm.tqdm(total=num_instructions, initial=min(len(dataset), num_instructions))
+        sink = JsonlSink(jsonl_file, append=resume)
+        emitter = None
+        if self.metrics_file:
+            emitter = asyncio.create_task(self.metrics.emit_periodically(self.metrics_file, self.metrics_interval))
+        
+        # 固定数量的生产者保持 max_workers 个请求在途，消费者在队列另一端去重、接收
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._stopping = False
+        producers = [asyncio.create_task(self._produce(seed_tasks, queue))
+                     for _ in range(self.max_workers)]
+        
+        try:
+            while len(dataset) < num_instructions:
+                entry = await self._next_item(queue, producers)
+                if entry is None:
+                    print(f"所有生产者都已结束，只生成了 {len(dataset)} 条指令")
+                    break
+                position, item, example_ids = entry
+                with self.metrics.timer("similarity"):
+                    novel = self.check_similarity(item["instruction"])
+                    if novel:
+                        self.similarity_index.add(item["instruction"])
+                self.sizer.observe_item(position, novel)
+                if self.example_pool is not None:
+                    self.example_pool.observe(example_ids, novel)
+                    if novel:
+                        self.example_pool.add(item["instruction"], self.render_example(item))
+                if not novel:
+                    self.metrics.reject("similarity")
+                    continue
+                
+                dataset.append(item)
+                with self.metrics.timer("save"):
+                    sink.append(item)
+                self.metrics.accept()
+                self.metrics.set_gauge("concurrency_limit", self.pool.concurrency_limit)
+                self.metrics.set_gauge("healthy_endpoints", self.pool.healthy_count())
+                self.metrics.set_gauge("queue_size", queue.qsize())
+                self.metrics.set_gauge("retries", self.pool.retries)
+                num_tasks, max_tokens = self.sizer.plan()
+                self.metrics.set_gauge("tasks_per_request", num_tasks)
+                self.metrics.set_gauge("max_tokens", max_tokens)
+                pbar.update(1)
+        finally:
+            # 达到目标后取消所有在途请求
+            self._stopping = True
+            for producer in producers:
+                producer.cancel()
+            await asyncio.gather(*producers, return_exceptions=True)
+            sink.close()
+            pbar.close()
+            if emitter is not None:
+                emitter.cancel()
+        
+        if compact_output:
+            with self.metrics.timer("save"):
+                compact(jsonl_file, output_file)
+            print(f"已生成 {len(dataset)} 条指令并保存到 {output_file}")
+        else:
+            print(f"已生成 {len(dataset)} 条指令并保存到 {jsonl_file}")
+        
+        tokens = self.metrics.snapshot()["tokens"]
+        if tokens.get("prompt_tokens"):
+            hit = tokens.get("prompt_cache_hit_tokens", 0)
+            print(f"提示词缓存命中 {hit}/{tokens['prompt_tokens']} tokens ({hit / tokens['prompt_tokens']:.1%})")
+        if self.metrics_file:
+            self.metrics.write_jsonl(self.metrics_file)
+
+    def replay_dataset(self, output_file: str, num_instructions: Optional[int] = None) -> None:
+        """仅用缓存中的原始补全重建数据集，不访问网络
+
+        修改 parse_response / validate_instruction 之后可以用它在几秒内重新套用到
+        全部缓存响应上。
+        """
+        if self.cache is None:
+            raise ValueError("replay_dataset 需要设置 cache")
+        
+        jsonl_file = os.path.splitext(output_file)[0] + ".jsonl"
         dataset = []
-        pbar = tqdm.tqdm(total=num_instructions)
+        with JsonlSink(jsonl_file, append=False) as sink:
+            for raw_text in itertools.chain.from_iterable(self.cache.completions(m) for m in self.cache_models):
+                for item in self.parse_text(raw_text):
+                    if self.check_similarity(item["instruction"]):
+                        dataset.append(item)
+                        self.similarity_index.add(item["instruction"])
+                        sink.append(item)
+                    if num_instructions is not None and len(dataset) >= num_instructions:
+                        break
+                if num_instructions is not None and len(dataset) >= num_instructions:
+                    break
         
-        while len(dataset) < num_instructions:
-            messages_batch = self.create_prompts_batch(seed_tasks, self.batch_size)
-            new_instructions = await self.generate_instructions_batch(messages_batch)
-            
-            for item in new_instructions:
-                if self.check_similarity(item["instruction"]):
-                    dataset.append(item)
-                    self.recent_instructions.append(item["instruction"])
-                    pbar.update(1)
-                    
-                    if len(dataset) % 100 == 0:
-                        self.save_dataset(dataset, output_file)
-                        
+        compact(jsonl_file, output_file)
+        print(f"从缓存重放生成 {len(dataset)} 条指令并保存到 {output_file}")
+
+    def merge_shards(self, shard_files: List[str], output_file: str, num_instructions: int) -> None:
+        """合并各分片的输出：全局近重复去除后截断到 num_instructions 条
+
+        分片之间轮流取条目，使截断后的结果在各分片间均匀分布。
+        """
+        shards = []
+        for path in shard_files:
+            jsonl_file = os.path.splitext(path)[0] + ".jsonl"
+            if not os.path.exists(jsonl_file):
+                raise FileNotFoundError(f"找不到分片输出 {jsonl_file}")
+            shards.append(load_jsonl(jsonl_file))
+        total = sum(len(items) for items in shards)
+        
+        jsonl_file = os.path.splitext(output_file)[0] + ".jsonl"
+        dataset = []
+        with JsonlSink(jsonl_file, append=False) as sink:
+            for group in itertools.zip_longest(*shards):
+                for item in group:
+                    if item is None or len(dataset) >= num_instructions:
+                        continue
+                    if self.check_similarity(item["instruction"]):
+                        dataset.append(item)
+                        self.similarity_index.add(item["instruction"])
+                        sink.append(item)
+                    else:
+                        self.metrics.reject("similarity")
                 if len(dataset) >= num_instructions:
                     break
         
-        self.save_dataset(dataset, output_file)
-        print(f"已生成 {len(dataset)} 条指令并保存到 {output_file}")
+        compact(jsonl_file, output_file)
+        print(f"合并 {len(shards)} 个分片共 {total} 条，去重后保留 {len(dataset)} 条并保存到 {output_file}")
+        if len(dataset) < num_instructions:
+            print(f"警告：不足 {num_instructions} 条，可用 --resume 和更大的 --oversample 继续生成各分片")
 
-    def save_dataset(self, dataset: List[Dict], filename: str) -> None:
-        """保存数据集"""
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(dataset, f, ensure_ascii=False, indent=2)
+
+def shard_path(output_file: str, shard_id: int, num_shards: int) -> str:
+    """分片的输出文件名，如 data/alpaca_data-00001-of-00004.json"""
+    root, ext = os.path.splitext(output_file)
+    return f"{root}-{shard_id:05d}-of-{num_shards:05d}{ext}"
 
 async def main():
-    model_name = "deepseek-chat"
-    seed_file = "data/seed_tasks.jsonl"
-    output_file = "data/alpaca_data.json"
-    num_instructions = 52000
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_name", type=str, default="deepseek-chat")
+    parser.add_argument("--seed_file", type=str, default="data/seed_tasks.jsonl")
+    parser.add_argument("--output_file", type=str, default="data/alpaca_data.json")
+    parser.add_argument("--num_instructions", type=int, default=52000)
+    parser.add_argument("--max_workers", type=int, default=256)
+    parser.add_argument("--stream", action="store_true", help="Parse completions as they stream in and stop early")
+    parser.add_argument("--resume", action="store_true", help="Continue from the existing output instead of starting over")
+    parser.add_argument("--cache_path", type=str, default=None, help="SQLite file for caching raw completions")
+    parser.add_argument("--cache_max_mb", type=float, default=None, help="Evict least recently used completions beyond this size")
+    parser.add_argument("--replay", action="store_true", help="Rebuild the dataset from cached completions without calling the API")
+    parser.add_argument("--metrics_file", type=str, default=None, help="Append periodic JSON metric snapshots to this file")
+    parser.add_argument("--metrics_interval", type=float, default=30.0)
+    parser.add_argument("--prometheus_port", type=int, default=None, help="Serve Prometheus metrics on this port")
+    parser.add_argument("--no_compact", action="store_true", help="Keep only the JSONL output, skip writing the JSON array")
+    parser.add_argument("--api_key", type=str, default=None, help="Defaults to the OPENAI_API_KEY environment variable")
+    parser.add_argument("--num_shards", type=int, default=1, help="Number of independent generator workers")
+    parser.add_argument("--shard_id", type=int, default=0, help="Which shard this worker generates, in [0, num_shards)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Base seed; each shard draws prompt examples from its own stream derived from (seed, shard_id)")
+    parser.add_argument("--oversample", type=float, default=1.05,
+                        help="Each shard generates num_instructions * oversample / num_shards items to cover cross-shard duplicates")
+    parser.add_argument("--merge", action="store_true", help="Merge all shard outputs with global dedup instead of generating")
+    parser.add_argument("--endpoints", type=str, default=None,
+                        help="JSON file listing endpoints (base_url, api_key, model, weight, max_concurrency, ...)")
+    parser.add_argument("--routing", type=str, default="least_outstanding", choices=["least_outstanding", "latency"])
+    parser.add_argument("--fixed_size", action="store_true",
+                        help="Always request 20 tasks with max_tokens=3072 instead of adapting them online")
+    parser.add_argument("--max_tokens_limit", type=int, default=8192, help="Largest max_tokens the model accepts")
+    parser.add_argument("--example_selection", type=str, default="adaptive", choices=["adaptive", "uniform"],
+                        help="adaptive: weighted draw from seeds plus accepted instructions; uniform: seeds only")
+    args = parser.parse_args()
+    if not 0 <= args.shard_id < args.num_shards:
+        parser.error("--shard_id must be in [0, num_shards)")
+    
+    cache = None
+    if args.cache_path:
+        max_bytes = int(args.cache_max_mb * 1024 * 1024) if args.cache_max_mb else None
+        cache = ResponseCache(args.cache_path, max_bytes=max_bytes)
     
     generator = AlpacaDataGenerator(
-        model_name=model_name,
-        batch_size=500,  
-        max_workers=256
+        model_name=args.model_name,
+        max_workers=args.max_workers,
+        stream=args.stream,
+        cache=cache,
+        metrics_file=args.metrics_file,
+        metrics_interval=args.metrics_interval,
+        api_key=args.api_key,
+        shard_id=args.shard_id,
+        num_shards=args.num_shards,
+        seed=args.seed,
+        endpoints=load_endpoints(args.endpoints) if args.endpoints else None,
+        routing=args.routing,
+        adaptive_sizing=not args.fixed_size,
+        max_tokens_limit=args.max_tokens_limit,
+        example_selection=args.example_selection
     )
+    if args.prometheus_port:
+        serve_prometheus(generator.metrics, args.prometheus_port)
+    
+    if args.replay:
+        generator.replay_dataset(args.output_file, args.num_instructions)
+        return
+    
+    if args.merge:
+        shard_files = [shard_path(args.output_file, i, args.num_shards) for i in range(args.num_shards)]
+        generator.merge_shards(shard_files, args.output_file, args.num_instructions)
+        return
+    
+    output_file = args.output_file
+    num_instructions = args.num_instructions
+    if args.num_shards > 1:
+        output_file = shard_path(args.output_file, args.shard_id, args.num_shards)
+        num_instructions = math.ceil(args.num_instructions * args.oversample / args.num_shards)
     
     await generator.generate_dataset(
-        seed_file=seed_file,
+        seed_file=args.seed_file,
         num_instructions=num_instructions,
-        output_file=output_file
+        output_file=output_file,
+        resume=args.resume,
+        compact_output=not args.no_compact
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,101 @@
+import os
+import multiprocessing
+from typing import List, Optional, Sequence
+
+from similarity import RougeLKernel
+
+
+def _shard_worker(conn) -> None:
+    """常驻工作进程：持有一个参考分片，只接收新增参考和待检查的候选"""
+    kernel = RougeLKernel()
+    while True:
+        command, payload = conn.recv()
+        if command == "add":
+            for text in payload:
+                kernel.add(text)
+        elif command == "match":
+            candidates, threshold = payload
+            conn.send([kernel.has_match(text, threshold) for text in candidates])
+        elif command == "close":
+            conn.close()
+            return
+
+
+class ShardedSimilarityFilter:
+    """把参考指令按轮询分片到多个进程的 ROUGE-L 过滤器
+
+    每个工作进程常驻自己的分片（RougeLKernel），每批候选广播给所有分片并行打分，
+    任一分片命中即视为与已有指令重复。批内候选之间的比较在主进程中按顺序进行，
+    因此接受/拒绝结果与逐条调用 check_similarity 再把通过者加入参考集完全一致。
+    """
+
+    def __init__(self, num_workers: Optional[int] = None, threshold: float = 0.7):
+        self.num_workers = max(1, num_workers or os.cpu_count() or 1)
+        self.threshold = threshold
+        self._next_shard = 0
+        self._size = 0
+        # spawn 避免在持有 HTTP 客户端和 tqdm 线程的进程里 fork
+        ctx = multiprocessing.get_context("spawn")
+        self._conns = []
+        self._workers = []
+        for _ in range(self.num_workers):
+            parent, child = ctx.Pipe()
+            worker = ctx.Process(target=_shard_worker, args=(child,), daemon=True)
+            worker.start()
+            child.close()
+            self._conns.append(parent)
+            self._workers.append(worker)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, instructions: Sequence[str]) -> None:
+        """把新接受的指令分配到各分片"""
+        shards = [[] for _ in range(self.num_workers)]
+        for text in instructions:
+            shards[self._next_shard].append(text)
+            self._next_shard = (self._next_shard + 1) % self.num_workers
+        for conn, shard in zip(self._conns, shards):
+            if shard:
+                conn.send(("add", shard))
+        self._size += len(instructions)
+
+    def filter_batch(self, candidates: Sequence[str]) -> List[bool]:
+        """按顺序判断每条候选是否可以接受；不会修改参考集，接受后需调用 add"""
+        candidates = list(candidates)
+        if not candidates:
+            return []
+        for conn in self._conns:
+            conn.send(("match", (candidates, self.threshold)))
+        duplicate = [False] * len(candidates)
+        for conn in self._conns:
+            for i, matched in enumerate(conn.recv()):
+                duplicate[i] = duplicate[i] or matched
+
+        # 同一批中先被接受的候选也要参与比较
+        batch = RougeLKernel()
+        decisions = []
+        for text, dup in zip(candidates, duplicate):
+            accepted = not dup and not batch.has_match(text, self.threshold)
+            if accepted:
+                batch.add(text)
+            decisions.append(accepted)
+        return decisions
+
+    def close(self) -> None:
+        for conn in self._conns:
+            try:
+                conn.send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+        for worker in self._workers:
+            worker.join(timeout=5)
+        self._conns = []
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
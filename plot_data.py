@@ -1,4 +1,9 @@
+import os
 import json
+import time
+import sqlite3
+import hashlib
+import argparse
 import spacy
 import pandas as pd
 import plotly.graph_objects as go
@@ -6,15 +11,32 @@ from collections import defaultdict
 from typing import List, Dict, Tuple
 import plotly.express as px
 
+# Components extract_verb_and_object never reads (it only needs tags, dependencies and lemmas)
+UNUSED_COMPONENTS = ["ner", "entity_ruler", "entity_linker", "textcat", "textcat_multilabel", "spancat"]
+
 
 def load_dataset(file_path: str) -> List[Dict]:
-    """Load the Alpaca-format dataset"""
+    """Load the Alpaca-format dataset (a JSON array, or the generator's JSONL output)
+
+    A JSONL file may be read while the generator is still appending to it, so an incomplete
+    last line is skipped instead of raising.
+    """
     with open(file_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+        if not file_path.endswith(".jsonl"):
+            return json.load(f)
+        return [json.loads(line) for line in f if line.endswith("\n")]
 
-def extract_verb_and_object(instruction: str, nlp) -> Tuple[str, str]:
-    """Extract root verb and its direct object using spaCy"""
-    doc = nlp(instruction)
+def load_nlp(model_name: str = "en_core_web_sm"):
+    """Load the spaCy pipeline without the components the analysis does not use"""
+    try:
+        return spacy.load(model_name, exclude=UNUSED_COMPONENTS)
+    except OSError:
+        print("Downloading spaCy model...")
+        spacy.cli.download(model_name)
+        return spacy.load(model_name, exclude=UNUSED_COMPONENTS)
+
+def verb_and_object(doc) -> Tuple[str, str]:
+    """Extract root verb and its direct object from a parsed Doc"""
     root_verb = None
     direct_object = None
     
@@ -32,12 +54,88 @@ def extract_verb_and_object(instruction: str, nlp) -> Tuple[str, str]:
     
     return root_verb or "other", direct_object or "other"
 
-def analyze_instructions(data: List[Dict], nlp) -> Dict:
-    """Analyze instructions to get verb-object hierarchy"""
+def extract_verb_and_object(instruction: str, nlp) -> Tuple[str, str]:
+    """Extract root verb and its direct object using spaCy"""
+    return verb_and_object(nlp(instruction))
+
+class ParseCache:
+    """SQLite cache of (root_verb, direct_object) per instruction
+
+    Rows are keyed by the SHA-256 of the instruction text and by the spaCy model name, model
+    version and spaCy version, so upgrading either one re-parses everything instead of mixing
+    results from different parsers.
+    """
+
+    def __init__(self, path: str, nlp):
+        self.path = path
+        self.model = f"{nlp.meta['lang']}_{nlp.meta['name']}-{nlp.meta['version']}/spacy-{spacy.__version__}"
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS parses ("
+            " model TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " verb TEXT NOT NULL,"
+            " object TEXT NOT NULL,"
+            " PRIMARY KEY (model, key))"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(instruction: str) -> str:
+        return hashlib.sha256(instruction.encode("utf-8")).hexdigest()
+
+    def load(self) -> Dict[str, Tuple[str, str]]:
+        """All cached results for the current model, by instruction key"""
+        cursor = self._conn.execute("SELECT key, verb, object FROM parses WHERE model = ?", (self.model,))
+        return {key: (verb, obj) for key, verb, obj in cursor}
+
+    def put_many(self, results: Dict[str, Tuple[str, str]]) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO parses (model, key, verb, object) VALUES (?, ?, ?, ?)",
+            [(self.model, key, verb, obj) for key, (verb, obj) in results.items()]
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+def parse_instructions(texts: List[str], nlp, batch_size: int = 1000, n_process: int = None) -> List[Tuple[str, str]]:
+    """Parse instructions in batches with nlp.pipe, across n_process worker processes"""
+    if n_process is None:
+        # Worker start-up only pays off with at least one batch per process
+        n_process = max(1, min(os.cpu_count() or 1, len(texts) // batch_size))
+    return [verb_and_object(doc) for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process)]
+
+def analyze_instructions(data: List[Dict], nlp, batch_size: int = 1000, n_process: int = None,
+                         cache: ParseCache = None) -> Dict:
+    """Analyze instructions to get verb-object hierarchy
+
+    With a cache, only instructions missing from it are parsed; the hierarchy is then rebuilt
+    from the cached results, so it is identical to parsing everything.
+    """
     hierarchy = defaultdict(lambda: defaultdict(int))
     
-    for item in data:
-        verb, obj = extract_verb_and_object(item['instruction'], nlp)
+    texts = [item['instruction'] for item in data]
+    if cache is None:
+        results = parse_instructions(texts, nlp, batch_size, n_process)
+    else:
+        keys = [ParseCache.make_key(text) for text in texts]
+        known = cache.load()
+        missing = {}
+        hits = 0
+        for key, text in zip(keys, texts):
+            if key in known:
+                hits += 1
+            else:
+                missing[key] = text
+        parsed = dict(zip(missing, parse_instructions(list(missing.values()), nlp, batch_size, n_process)))
+        cache.put_many(parsed)
+        known.update(parsed)
+        results = [known[key] for key in keys]
+        print(f"Parse cache: {hits} hits, {len(missing)} new instructions parsed")
+    
+    for verb, obj in results:
         hierarchy[verb][obj] += 1
     
     return hierarchy
@@ -100,23 +198,27 @@ def create_sunburst_chart(hierarchy: Dict, min_count: int = 5):
     
     return fig
 
-def main(file_path: str):
+def main(file_path: str, batch_size: int = 1000, n_process: int = None, cache_path: str = None,
+         output_file: str = "instruction_diversity.html", nlp=None):
     """Main function to process dataset and create visualization"""
     # Load spaCy model
-    try:
-        nlp = spacy.load("en_core_web_sm")
-    except OSError:
-        print("Downloading spaCy model...")
-        spacy.cli.download("en_core_web_sm")
-        nlp = spacy.load("en_core_web_sm")
+    if nlp is None:
+        nlp = load_nlp()
     
     # Load and process data
     data = load_dataset(file_path)
-    hierarchy = analyze_instructions(data, nlp)
+    cache = ParseCache(cache_path, nlp) if cache_path else None
+    start = time.perf_counter()
+    try:
+        hierarchy = analyze_instructions(data, nlp, batch_size=batch_size, n_process=n_process, cache=cache)
+    finally:
+        if cache is not None:
+            cache.close()
+    print(f"Analyzed {len(data)} instructions in {time.perf_counter() - start:.1f}s")
     
     # Create and save visualization
     fig = create_sunburst_chart(hierarchy)
-    fig.write_html("instruction_diversity.html")
+    fig.write_html(output_file)
     
     # Print some statistics
     print(f"Total instructions analyzed: {len(data)}")
@@ -139,5 +241,22 @@ if __name__ == "__main__":
             print(f"Installing {package}...")
             subprocess.check_call([sys.executable, "-m", "pip", "install", package])
     
-    file_path = "data/alpaca_data.json"  # Replace with your dataset path
-    main(file_path)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", type=str, default="data/alpaca_data.json",
+                        help="Alpaca-format JSON, or the generator's .jsonl while it is still running")
+    parser.add_argument("--cache", type=str, default="data/parse_cache.db",
+                        help="Parse cache database; pass an empty string to disable")
+    parser.add_argument("--output", type=str, default="instruction_diversity.html")
+    parser.add_argument("--model", type=str, default="en_core_web_sm")
+    parser.add_argument("--batch_size", type=int, default=1000)
+    parser.add_argument("--n_process", type=int, default=None)
+    parser.add_argument("--watch", type=float, default=0,
+                        help="Re-run every this many seconds, parsing only new instructions")
+    args = parser.parse_args()
+
+    nlp = load_nlp(args.model)
+    while True:
+        main(args.data, args.batch_size, args.n_process, args.cache or None, args.output, nlp)
+        if not args.watch:
+            break
+        time.sleep(args.watch)
\ No newline at end of file
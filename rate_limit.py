@@ -0,0 +1,270 @@
+import time
+import random
+import asyncio
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional
+
+import openai
+
+# 可重试的 HTTP 状态码：超时、冲突、限流以及服务端错误
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """令牌桶限速器，速率以每分钟计"""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        # 默认允许 10 秒的突发量
+        self.capacity = capacity if capacity is not None else per_minute / 6.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        """等待直到可以扣除 amount 个令牌；超过桶容量的请求会以欠账方式放行"""
+        async with self._lock:
+            while True:
+                self._refill()
+                needed = min(amount, self.capacity)
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+
+    def refund(self, amount: float) -> None:
+        """按实际用量退还（amount 为负时补扣）预估多扣的令牌"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AIMDConcurrencyLimiter:
+    """加性增、乘性减的并发窗口
+
+    每次成功且延迟不超过 latency_target 时窗口增加 increase / limit（约每轮
+    增加 increase）；遇到限流、服务端错误或延迟超标时窗口乘以 decrease，
+    cooldown 秒内最多缩小一次，避免同一波失败把窗口压到底。
+    """
+
+    def __init__(self,
+                 initial: float = 16,
+                 minimum: float = 1,
+                 maximum: float = 256,
+                 increase: float = 1.0,
+                 decrease: float = 0.5,
+                 latency_target: Optional[float] = None,
+                 cooldown: float = 5.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.in_flight = 0
+        # 错误率的指数滑动平均，供日志和监控使用
+        self.error_rate = 0.0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def abandon(self) -> None:
+        """归还槽位但不调整窗口：请求被取消，或因请求本身的问题（如 400、401）失败时使用"""
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def release(self, success: bool, latency: Optional[float] = None) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self.error_rate = 0.95 * self.error_rate + 0.05 * (0.0 if success else 1.0)
+            slow = (self.latency_target is not None and latency is not None
+                    and latency > self.latency_target)
+            if success and not slow:
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            else:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self._last_decrease = now
+            self._condition.notify_all()
+
+
+def is_retryable(error: Exception) -> bool:
+    """判断是否为可重试的瞬时错误"""
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError))
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """从响应头 retry-after-ms / retry-after 中读取服务端建议的等待秒数"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class APIController:
+    """包裹 AsyncOpenAI 调用的客户端流控
+
+    依次经过 AIMD 并发窗口、每分钟请求数和每分钟 token 数两个令牌桶；瞬时错误
+    按带抖动的指数退避重试，并优先遵循 Retry-After。
+    """
+
+    def __init__(self,
+                 requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None,
+                 concurrency: Optional[AIMDConcurrencyLimiter] = None,
+                 max_retries: int = 6,
+                 base_delay: float = 1.0,
+                 max_delay: float = 60.0):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = concurrency if concurrency is not None else AIMDConcurrencyLimiter()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        """第 attempt 次重试前的等待时间（full jitter），不短于 Retry-After"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        hint = retry_after(error)
+        if hint is not None:
+            delay = max(delay, min(hint, self.max_delay))
+        return delay
+
+    async def call(self, request: Callable[[], Awaitable], estimated_tokens: int = 0):
+        """执行 request()，失败时按需重试；重试耗尽或遇到不可重试错误时抛出最后的异常
+
+        流式响应在连接建立时就返回，此时包装成 TrackedStream：并发槽位一直占用到流被
+        读完、出错或关闭，延迟和成败也在那时才计入 AIMD 窗口。
+        """
+        attempt = 0
+        while True:
+            if self.request_bucket:
+                await self.request_bucket.acquire(1)
+            if self.token_bucket:
+                await self.token_bucket.acquire(estimated_tokens)
+
+            await self.concurrency.acquire()
+            start = time.monotonic()
+            try:
+                response = await request()
+            except asyncio.CancelledError:
+                await self.concurrency.abandon()
+                raise
+            except Exception as e:
+                retryable = is_retryable(e)
+                # 只有限流和服务端故障才收缩并发窗口；其他错误与负载无关，不计成败
+                if retryable:
+                    await self.concurrency.release(success=False)
+                else:
+                    await self.concurrency.abandon()
+                if self.token_bucket:
+                    self.token_bucket.refund(estimated_tokens)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.backoff(attempt, e))
+                attempt += 1
+                continue
+
+            if hasattr(response, "__aiter__"):
+                return TrackedStream(response, lambda stream, error: self._finish_stream(
+                    stream, error, start, estimated_tokens))
+            await self.concurrency.release(success=True, latency=time.monotonic() - start)
+            self._refund_usage(getattr(response, "usage", None), estimated_tokens)
+            return response
+
+    def _refund_usage(self, usage, estimated_tokens: int) -> None:
+        if self.token_bucket and usage is not None and usage.total_tokens is not None:
+            self.token_bucket.refund(estimated_tokens - usage.total_tokens)
+
+    async def _finish_stream(self, stream: "TrackedStream", error: Optional[BaseException],
+                             start: float, estimated_tokens: int) -> None:
+        # 流中途出错不会重试：已经产出的内容无法重放
+        if error is None:
+            await self.concurrency.release(success=True, latency=time.monotonic() - start)
+        elif is_retryable(error):
+            await self.concurrency.release(success=False)
+        else:
+            await self.concurrency.abandon()
+        self._refund_usage(stream.usage, estimated_tokens)
+
+
+class TrackedStream:
+    """包装流式响应，在流被读完、出错或关闭时依次调用结束回调
+
+    回调形如 callback(stream, error)：正常读完或被调用方提前关闭时 error 为 None，
+    读取出错时为该异常（包括取消）。每个回调只调用一次；usage 记录最后一个 chunk
+    带回的用量。其余属性转发给原始流。
+    """
+
+    def __init__(self, stream, on_done: Callable[["TrackedStream", Optional[BaseException]], Awaitable]):
+        self._stream = stream
+        self._callbacks = [on_done]
+        self._done = False
+        self.usage = None
+
+    def add_done_callback(self, callback: Callable[["TrackedStream", Optional[BaseException]], Awaitable]) -> None:
+        self._callbacks.append(callback)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._done:
+            raise StopAsyncIteration
+        try:
+            chunk = await self._stream.__anext__()
+        except StopAsyncIteration:
+            await self._finish(None)
+            raise
+        except BaseException as e:
+            await self._finish(e)
+            raise
+        if getattr(chunk, "usage", None) is not None:
+            self.usage = chunk.usage
+        return chunk
+
+    async def close(self) -> None:
+        try:
+            await self._stream.close()
+        finally:
+            await self._finish(None)
+
+    async def _finish(self, error: Optional[BaseException]) -> None:
+        if self._done:
+            return
+        self._done = True
+        # 外层回调（如 EndpointPool 的在途计数）后注册、先执行
+        for callback in reversed(self._callbacks):
+            await callback(self, error)
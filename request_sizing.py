@@ -0,0 +1,106 @@
+import math
+from typing import Optional, Tuple
+
+
+class RequestSizer:
+    """根据在线统计为每次请求选择任务数和 max_tokens
+
+    统计量：
+    - 每个完整任务块消耗的输出 token（只用未被截断的补全，指数滑动平均）；
+    - 补全中第 i 个块最终被接受（通过校验和去重）的比例，越靠后的块越容易重复；
+    - 提示词 token 数，按 prompt_token_weight 折算成输出 token 的成本。
+
+    任务数取使「期望接受条数 / 期望 token 成本」最大的 n；max_tokens 为
+    n * 每任务 token * margin，margin 在被截断时放大、否则缓慢收缩，使截断率
+    稳定在百分之几。adaptive=False 时始终返回初始值。
+    """
+
+    # 预留给结束标记的输出 token
+    _END_TOKENS = 16
+
+    def __init__(self,
+                 initial_tasks: int = 20,
+                 initial_max_tokens: int = 3072,
+                 min_tasks: int = 5,
+                 max_tasks: int = 30,
+                 max_tokens_limit: int = 8192,
+                 prompt_token_weight: float = 0.25,
+                 margin: float = 1.25,
+                 adaptive: bool = True):
+        self.initial_tasks = initial_tasks
+        self.initial_max_tokens = initial_max_tokens
+        self.min_tasks = min_tasks
+        self.max_tasks = max(max_tasks, initial_tasks)
+        self.max_tokens_limit = max_tokens_limit
+        self.prompt_token_weight = prompt_token_weight
+        self.margin = margin
+        self.adaptive = adaptive
+        self.tokens_per_task = None
+        self.prompt_tokens = None
+        self.completions = 0
+        self.truncated = 0
+        self.emitted = [0] * self.max_tasks
+        self.accepted = [0] * self.max_tasks
+
+    @property
+    def truncation_rate(self) -> Optional[float]:
+        return self.truncated / self.completions if self.completions else None
+
+    def observe_blocks(self, num_blocks: int) -> None:
+        """一次补全解析出 num_blocks 个块（无论是否有效）"""
+        for pos in range(min(num_blocks, self.max_tasks)):
+            self.emitted[pos] += 1
+
+    def observe_item(self, position: int, accepted: bool) -> None:
+        """补全中第 position 个块的最终结果"""
+        if accepted and position < self.max_tasks:
+            self.accepted[position] += 1
+
+    def observe_completion(self,
+                           num_blocks: int,
+                           completion_tokens: Optional[int],
+                           prompt_tokens: Optional[int],
+                           truncated: bool) -> None:
+        self.completions += 1
+        if truncated:
+            self.truncated += 1
+            self.margin = min(2.0, self.margin * 1.1)
+        else:
+            self.margin = max(1.05, self.margin * 0.998)
+            if completion_tokens and num_blocks:
+                sample = completion_tokens / num_blocks
+                self.tokens_per_task = (sample if self.tokens_per_task is None
+                                        else 0.95 * self.tokens_per_task + 0.05 * sample)
+        if prompt_tokens:
+            self.prompt_tokens = (prompt_tokens if self.prompt_tokens is None
+                                  else 0.95 * self.prompt_tokens + 0.05 * prompt_tokens)
+
+    def acceptance(self, position: int, prior: float, strength: float = 20.0) -> float:
+        """第 position 个块的接受率，样本少时向整体接受率收缩"""
+        return (self.accepted[position] + strength * prior) / (self.emitted[position] + strength)
+
+    def plan(self) -> Tuple[int, int]:
+        """返回本次请求的 (任务数, max_tokens)"""
+        if not self.adaptive or self.tokens_per_task is None:
+            return self.initial_tasks, self.initial_max_tokens
+
+        per_task = self.tokens_per_task * self.margin
+        # max_tokens 上限放不下的任务数不考虑
+        fit = int((self.max_tokens_limit - self._END_TOKENS) / per_task)
+        upper = max(1, min(self.max_tasks, fit))
+        lower = min(self.min_tasks, upper)
+
+        emitted = sum(self.emitted)
+        prior = sum(self.accepted) / emitted if emitted else 0.5
+        prompt_cost = self.prompt_token_weight * (self.prompt_tokens or 0)
+        best, best_rate = lower, -1.0
+        expected = 0.0
+        for n in range(1, upper + 1):
+            expected += self.acceptance(n - 1, prior)
+            if n < lower:
+                continue
+            rate = expected / (prompt_cost + n * self.tokens_per_task)
+            # 收益相同时取较小的 n，请求延迟更低
+            if rate > best_rate * 1.001:
+                best, best_rate = n, rate
+        return best, min(self.max_tokens_limit, math.ceil(best * per_task) + self._END_TOKENS)
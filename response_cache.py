@@ -0,0 +1,104 @@
+import json
+import time
+import sqlite3
+import hashlib
+from typing import Dict, Iterator, List, Optional
+
+
+class ResponseCache:
+    """以请求内容哈希为键的 SQLite 响应缓存
+
+    键由 (model, messages, temperature, top_p, max_tokens, stop, sample_index)
+    规范化后取 SHA-256 得到；sample_index 区分同一提示词的第几次采样。
+    设置 max_bytes 后按最近访问时间做 LRU 淘汰。
+    """
+
+    def __init__(self, path: str, max_bytes: Optional[int] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " completion TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str,
+                 messages: List[Dict],
+                 temperature: float,
+                 top_p: float,
+                 max_tokens: int,
+                 stop: List[str],
+                 sample_index: int = 0) -> str:
+        payload = json.dumps(
+            [model, messages, temperature, top_p, max_tokens, stop, sample_index],
+            ensure_ascii=False, sort_keys=True, separators=(",", ":")
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT completion FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        return row[0]
+
+    def put(self, key: str, model: str, completion: str) -> None:
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses (key, model, completion, size, created, accessed)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model, completion, len(completion.encode("utf-8")), now, now)
+        )
+        self._conn.commit()
+        if self.max_bytes is not None:
+            self.evict()
+
+    def total_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def evict(self) -> int:
+        """按最近最少访问的顺序删除条目，直到总大小不超过 max_bytes"""
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return 0
+        removed = 0
+        keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if removed >= excess:
+                break
+            keys.append((key,))
+            removed += size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self._conn.commit()
+        return len(keys)
+
+    def completions(self, model: Optional[str] = None) -> Iterator[str]:
+        """按写入顺序遍历缓存的原始补全文本，用于离线重放"""
+        if model is None:
+            cursor = self._conn.execute("SELECT completion FROM responses ORDER BY created")
+        else:
+            cursor = self._conn.execute(
+                "SELECT completion FROM responses WHERE model = ? ORDER BY created", (model,)
+            )
+        for (completion,) in cursor:
+            yield completion
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,327 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import hashlib
+import argparse
+
+import torch
+
+from lora_inference import MultiLoraModel, load_examples
+from merge_lora import find_adapters, resolve_model_dir
+
+HASHED_SUFFIXES = (".safetensors", ".bin", ".json", ".model", ".tiktoken")
+
+
+class ResultCache:
+    """
+    以 (模型哈希, 样本哈希) 为键的 SQLite 评测结果缓存
+
+    模型哈希由权重、配置和 tokenizer 文件的内容计算；每个文件的摘要按 (路径, 大小, 修改时间)
+    记录下来，同一个 checkpoint 再次评测时不必重新读一遍权重。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " PRIMARY KEY (path, size, mtime_ns))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " model TEXT NOT NULL,"
+            " example TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " PRIMARY KEY (model, example, kind))"
+        )
+        self._conn.commit()
+
+    def file_digest(self, path):
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        row = self._conn.execute("SELECT digest FROM files WHERE path = ? AND size = ? AND mtime_ns = ?", key).fetchone()
+        if row is not None:
+            return row[0]
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 24), b""):
+                h.update(chunk)
+        self._conn.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                           key + (h.hexdigest(),))
+        self._conn.commit()
+        return h.hexdigest()
+
+    def model_hash(self, model_dirs, settings):
+        """
+        模型目录（基础模型及可选的 adapter）内各文件摘要与评测设置一起计算的哈希
+
+        参数:
+            model_dirs: 本地目录列表
+            settings: 影响结果的评测设置，例如 dtype 和 max_len
+        """
+        parts = []
+        for model_dir in model_dirs:
+            for name in sorted(os.listdir(model_dir)):
+                path = os.path.join(model_dir, name)
+                if name.endswith(HASHED_SUFFIXES) and os.path.isfile(path):
+                    parts.append([name, self.file_digest(path)])
+        payload = json.dumps([parts, settings], sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def example_hash(example):
+        payload = json.dumps([example["instruction"], example["output"]], ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def load(self, model, kind, keys):
+        """当前模型已缓存的结果，按样本哈希"""
+        wanted = set(keys)
+        cursor = self._conn.execute("SELECT example, value FROM results WHERE model = ? AND kind = ?", (model, kind))
+        found = {example: json.loads(value) for example, value in cursor if example in wanted}
+        self.hits += len(found)
+        self.misses += len(wanted) - len(found)
+        return found
+
+    def put_many(self, model, kind, results):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO results (model, example, kind, value) VALUES (?, ?, ?, ?)",
+            [(model, example, kind, json.dumps(value, ensure_ascii=False)) for example, value in results.items()]
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+def available_memory(device):
+    if device.type == "cuda":
+        free, _ = torch.cuda.mem_get_info(device)
+        return free
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def bytes_per_token(config, dtype, generation=False):
+    """
+    估算每个 token 在一次无梯度前向中占用的显存
+
+    前向时同时存活的激活为 MLP 中间结果和若干份 hidden；计算损失时还有整行 logits 及其
+    fp32 的 log_softmax。生成时只保留最后一个位置的 logits，但每个 token 要存 KV cache。
+    """
+    elem = torch.finfo(dtype).bits // 8
+    hidden = config.hidden_size
+    inter = getattr(config, "intermediate_size", None) or 4 * hidden
+    activations = (3 * inter + 6 * hidden) * elem
+    if not generation:
+        return activations + config.vocab_size * (elem + 8)
+    heads = config.num_attention_heads
+    kv_heads = getattr(config, "num_key_value_heads", None) or heads
+    head_dim = getattr(config, "head_dim", None) or hidden // heads
+    return activations + 2 * config.num_hidden_layers * kv_heads * head_dim * elem
+
+
+def length_batches(order, lengths, token_budget, max_batch_size):
+    """
+    把按长度从长到短排好的样本切成批次，每批补齐后的 token 数不超过 token_budget
+
+    长度相近的样本在同一批，补齐浪费很小；短样本的批次自动更大。
+    """
+    batch = []
+    for i in order:
+        # order 从长到短，批次中第一个样本最长
+        padded = lengths[batch[0]] if batch else lengths[i]
+        if batch and (len(batch) >= max_batch_size or (len(batch) + 1) * padded > token_budget):
+            yield batch
+            batch = []
+        batch.append(i)
+    if batch:
+        yield batch
+
+
+def is_out_of_memory(error):
+    """torch.cuda.OutOfMemoryError，以及其他后端和 CPU 分配失败时抛出的 RuntimeError"""
+    if isinstance(error, torch.cuda.OutOfMemoryError):
+        return True
+    message = str(error)
+    return isinstance(error, RuntimeError) and ("out of memory" in message or "can't allocate memory" in message)
+
+
+def run_batches(order, lengths, token_budget, max_batch_size, fn):
+    """
+    依次对每批调用 fn，返回最终的预算
+
+    内存不足（见 is_out_of_memory）时把预算减半，对剩下的样本重新分批；单条样本仍然
+    放不下时抛出原异常。
+    """
+    pending = list(order)
+    while pending:
+        batch = next(length_batches(pending, lengths, token_budget, max_batch_size))
+        try:
+            fn(batch)
+        except RuntimeError as e:
+            if not is_out_of_memory(e) or len(batch) == 1:
+                raise
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            token_budget //= 2
+            print(f"Out of memory with {len(batch)} rows, token budget lowered to {token_budget}.")
+            continue
+        pending = pending[len(batch):]
+    return token_budget
+
+
+def evaluate_losses(lora, adapter, examples, max_len, token_budget, max_batch_size, on_batch):
+    """
+    计算每条样本 response 部分的 (负对数似然之和, token 数)
+
+    截断规则与训练一致：prompt 占满 max_len 的样本记为 dropped，过长的样本截断并以 eos 结尾。
+    on_batch 收到 {样本下标: 结果}，用于写缓存。
+    """
+    encoded, dropped = {}, {}
+    all_encoded = lora.encode([e["instruction"] for e in examples], [e["output"] for e in examples], max_len)
+    for i, e in enumerate(all_encoded):
+        if e is None:
+            dropped[i] = {"nll": 0.0, "tokens": 0, "dropped": True}
+        else:
+            encoded[i] = e
+    lengths = {i: len(ids) for i, (ids, _) in encoded.items()}
+    order = sorted(encoded, key=lambda i: -lengths[i])
+    if dropped:
+        on_batch(dropped)
+
+    def fn(batch):
+        results = lora.forward_losses([encoded[i] for i in batch], [adapter] * len(batch))
+        on_batch({i: {"nll": nll, "tokens": tokens} for i, (nll, tokens) in zip(batch, results)})
+
+    return run_batches(order, lengths, token_budget, max_batch_size, fn)
+
+
+def evaluate_generations(lora, adapter, examples, max_new_tokens, token_budget, max_batch_size, on_batch):
+    """贪心生成，按提示词长度分批；每行补齐后的长度按提示词加 max_new_tokens 计"""
+    lengths = [len(lora.tokenizer(e["instruction"])["input_ids"]) + max_new_tokens for e in examples]
+    order = sorted(range(len(examples)), key=lambda i: -lengths[i])
+
+    def fn(batch):
+        outputs = lora.generate([examples[i]["instruction"] for i in batch], [adapter] * len(batch),
+                                max_new_tokens, batch_size=len(batch))
+        on_batch(dict(zip(batch, outputs)))
+
+    return run_batches(order, lengths, token_budget, max_batch_size, fn)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default="../checkpoint/merged_model",
+                        help="Merged model, or the base model when --adapter_path is given")
+    parser.add_argument("--adapter_path", type=str, nargs="*", default=[],
+                        help="Evaluate these PEFT adapters unmerged on top of --model")
+    parser.add_argument("--data", type=str, default="../data", help="SFT output directory or a JSON/JSONL/Parquet file")
+    parser.add_argument("--split", type=str, default="test")
+    parser.add_argument("--num_examples", type=int, default=None)
+    parser.add_argument("--max_len", type=int, default=512)
+    parser.add_argument("--max_new_tokens", type=int, default=0, help="Also generate greedily when > 0")
+    parser.add_argument("--dtype", type=str, default="auto", help="auto, float32, bfloat16 or float16")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--memory_budget", type=float, default=None,
+                        help="GiB for activations; defaults to half of the free memory after loading the model")
+    parser.add_argument("--max_batch_size", type=int, default=64)
+    parser.add_argument("--cache", type=str, default="../cache/eval_cache.db",
+                        help="Keep outside the data directory: the training script loads it with json@")
+    parser.add_argument("--no_cache", action="store_true")
+    parser.add_argument("--output", type=str, default=None, help="Write metrics and generations as JSON")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    model_dir = resolve_model_dir(args.model)
+    adapter_dirs = find_adapters(args.adapter_path) if args.adapter_path else []
+    examples = load_examples(args.data, args.split, args.num_examples)
+    keys = [ResultCache.example_hash(e) for e in examples]
+    if not args.no_cache:
+        os.makedirs(os.path.dirname(os.path.abspath(args.cache)), exist_ok=True)
+    cache = None if args.no_cache else ResultCache(args.cache)
+
+    dtype = args.dtype if args.dtype == "auto" else getattr(torch, args.dtype)
+    lora = None
+    report = {"model": args.model, "data": args.data, "split": args.split, "examples": len(examples), "results": {}}
+    for adapter_dir in adapter_dirs or [None]:
+        name = os.path.basename(os.path.normpath(adapter_dir)) if adapter_dir else os.path.basename(
+            os.path.normpath(args.model))
+        dirs = [model_dir] + ([adapter_dir] if adapter_dir else [])
+        # tokenization 标记样本的分词方式，分词规则改变后旧的缓存结果不再命中
+        settings = {"dtype": args.dtype, "max_len": args.max_len, "tokenization": "openrlhf-sft"}
+        model_key = cache.model_hash(dirs, settings) if cache else None
+        kinds = [("loss", "loss")]
+        if args.max_new_tokens:
+            kinds.append(("generation", f"greedy:{args.max_new_tokens}"))
+
+        results = {}
+        for field, kind in kinds:
+            cached = cache.load(model_key, kind, keys) if cache else {}
+            results[field] = {i: cached[k] for i, k in enumerate(keys) if k in cached}
+        missing = {field: [i for i in range(len(examples)) if i not in results[field]] for field in results}
+
+        if any(missing.values()):
+            if lora is None:
+                lora = MultiLoraModel.from_pretrained(model_dir, adapter_dirs, len(adapter_dirs) or 1, dtype)
+                lora.model.to(args.device)
+                device = torch.device(args.device)
+                budget = args.memory_budget * 2 ** 30 if args.memory_budget else available_memory(device) / 2
+                torch_dtype = lora.model.dtype
+                loss_budget = int(budget // bytes_per_token(lora.model.config, torch_dtype))
+                gen_budget = int(budget // bytes_per_token(lora.model.config, torch_dtype, generation=True))
+                print(f"Token budget per batch: {loss_budget} (loss), {gen_budget} (generation).")
+            adapter = next(n for n, p in lora.adapters.items() if p == adapter_dir) if adapter_dir else None
+
+            for field, kind in kinds:
+                todo = missing[field]
+                if not todo:
+                    continue
+
+                def on_batch(batch_results, field=field, kind=kind, todo=todo):
+                    batch_results = {todo[i]: value for i, value in batch_results.items()}
+                    results[field].update(batch_results)
+                    if cache:
+                        cache.put_many(model_key, kind, {keys[i]: v for i, v in batch_results.items()})
+
+                subset = [examples[i] for i in todo]
+                if field == "loss":
+                    loss_budget = evaluate_losses(lora, adapter, subset, args.max_len, loss_budget,
+                                                  args.max_batch_size, on_batch)
+                else:
+                    gen_budget = evaluate_generations(lora, adapter, subset, args.max_new_tokens, gen_budget,
+                                                      args.max_batch_size, on_batch)
+
+        nll = sum(r["nll"] for r in results["loss"].values())
+        tokens = sum(r["tokens"] for r in results["loss"].values())
+        dropped = sum(1 for r in results["loss"].values() if r.get("dropped"))
+        entry = {"loss": nll / max(1, tokens), "tokens": tokens, "scored": len(results["loss"]) - dropped,
+                 "dropped": dropped}
+        entry["perplexity"] = math.exp(entry["loss"])
+        if args.max_new_tokens:
+            entry["generations"] = [{"instruction": e["instruction"], "reference": e["output"],
+                                     "output": results["generation"][i]} for i, e in enumerate(examples)]
+        report["results"][name] = entry
+        print(f"{name}: loss {entry['loss']:.4f}  ppl {entry['perplexity']:.2f}  "
+              f"({entry['scored']} examples, {tokens} tokens)")
+
+    report["seconds"] = time.perf_counter() - start
+    if cache:
+        print(f"{cache.hits} cached, {cache.misses} computed.")
+        cache.close()
+    print(f"Evaluated in {report['seconds']:.1f}s.")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
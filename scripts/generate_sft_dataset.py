@@ -1,35 +1,208 @@
 import json
 import argparse
-import random
+import glob
+import hashlib
 import os
+import re
 from tqdm import tqdm
 
+SPLITS = ("train", "test")
+# 数组的方括号和元素之间的逗号在顶层直接跳过，因此 JSON 数组和 JSONL 用同一个循环读取
+_SEPARATORS = re.compile(r"[\s,\[\]]*")
+
+
+def iter_json_items(path, chunk_size=1 << 20):
+    """逐个产出 JSON 数组或 JSONL 文件中的对象，每次只读入 chunk_size 个字符"""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf, pos = "", 0
+        while True:
+            pos = _SEPARATORS.match(buf, pos).end()
+            if pos == len(buf):
+                buf, pos = f.read(chunk_size), 0
+                if not buf:
+                    return
+                continue
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # 对象跨越了块边界：把剩余部分和下一块拼起来再解析
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            yield item
+            pos = end
+
+
+def iter_records(path):
+    """逐条产出 SFT 分片中的记录：.parquet 分片按行组读取，其余按 JSON 数组 / JSONL 读取"""
+    if not path.endswith(".parquet"):
+        yield from iter_json_items(path)
+        return
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit(f"Reading {path} requires pyarrow: pip install pyarrow")
+    for batch in pyarrow.parquet.ParquetFile(path).iter_batches():
+        yield from batch.to_pylist()
+
+
+def sft_record(example):
+    """把 instruction / input / output 样本转成训练使用的 instruction / output 两个字段"""
+    d = {}
+    d['instruction'] = example['instruction'] + (("\nInput: " + example['input']) if example['input'] != "" else "")
+    d['output'] = example['output']
+    return d
+
+
+def normalize(text):
+    return " ".join(text.split()).lower()
+
+
+def split_of(instruction, test_ratio, seed):
+    """按规范化后指令的带密钥哈希划分 train / test
+
+    同一条指令无论 input 是什么、出现在什么位置、数据集有多大，总是落在同一侧：
+    追加数据不会移动已有样本，测试集中的指令也不可能出现在训练集里。
+    """
+    digest = hashlib.blake2b(normalize(instruction).encode("utf-8"), digest_size=8,
+                             key=str(seed).encode("utf-8")).digest()
+    return "test" if int.from_bytes(digest, "big") < test_ratio * 2 ** 64 else "train"
+
+
+def record_key(d):
+    """规范化后整条 SFT 样本的 8 字节摘要，用于精确去重"""
+    text = normalize(d['instruction']) + "\0" + normalize(d['output'])
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class ShardWriter:
+    """把一个划分写成 {split}-00000.{jsonl,parquet}、{split}-00001... 每个分片 shard_size 条
+
+    分片先以临时文件名写入，commit() 时再改名，中断的运行不会留下被 json@<output_dir> 读到的半个分片。
+    """
+
+    def __init__(self, output_dir, split, fmt="jsonl", shard_size=100000, row_group_size=10000):
+        self.output_dir = output_dir
+        self.split = split
+        self.fmt = fmt
+        self.shard_size = shard_size
+        self.row_group_size = row_group_size
+        self.count = 0
+        self.paths = []
+        self._file = None
+        self._in_shard = 0
+        self._rows = []
+        if fmt == "parquet":
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise SystemExit("--format parquet requires pyarrow: pip install pyarrow")
+            self._pa = pyarrow
+            self._pq = pyarrow.parquet
+            self._schema = pyarrow.schema([("instruction", pyarrow.string()), ("output", pyarrow.string())])
+
+    def _open(self):
+        name = f"{self.split}-{len(self.paths):05d}.{self.fmt}"
+        path = os.path.join(self.output_dir, name)
+        tmp_path = os.path.join(self.output_dir, f".{name}.tmp")
+        self.paths.append((tmp_path, path))
+        if self.fmt == "parquet":
+            self._file = self._pq.ParquetWriter(tmp_path, self._schema)
+        else:
+            self._file = open(tmp_path, "w", encoding="utf-8")
+        self._in_shard = 0
+
+    def _flush_rows(self):
+        if self._rows:
+            self._file.write_table(self._pa.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+    def _close_shard(self):
+        if self._file is None:
+            return
+        if self.fmt == "parquet":
+            self._flush_rows()
+        self._file.close()
+        self._file = None
+
+    def write(self, d):
+        if self._file is None or self._in_shard >= self.shard_size:
+            self._close_shard()
+            self._open()
+        if self.fmt == "parquet":
+            self._rows.append(d)
+            if len(self._rows) >= self.row_group_size:
+                self._flush_rows()
+        else:
+            self._file.write(json.dumps(d, ensure_ascii=False) + "\n")
+        self._in_shard += 1
+        self.count += 1
+
+    def commit(self):
+        self._close_shard()
+        for tmp_path, path in self.paths:
+            os.replace(tmp_path, path)
+
+    def abort(self):
+        self._close_shard()
+        for tmp_path, _ in self.paths:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def stale_outputs(output_dir):
+    """之前运行留下的输出，json@<output_dir> 会把它们和新分片一起加载"""
+    paths = []
+    for split in SPLITS:
+        paths.append(os.path.join(output_dir, f"{split}.json"))
+        for ext in ("jsonl", "parquet"):
+            paths.extend(glob.glob(os.path.join(output_dir, f"{split}-[0-9][0-9][0-9][0-9][0-9].{ext}")))
+    return [p for p in paths if os.path.exists(p)]
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input_file", type=str, default="../data/alpaca_data.json")
+    parser.add_argument("--input_file", type=str, default="../data/alpaca_data.json",
+                        help="JSON array or JSONL of instruction/input/output records")
     parser.add_argument("--output_dir", type=str, default="../data")
     parser.add_argument("--test_ratio", type=float, default=0.1)
-    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--seed", type=int, default=42, help="Key of the split hash")
+    parser.add_argument("--format", type=str, default="jsonl", choices=["jsonl", "parquet"])
+    parser.add_argument("--shard_size", type=int, default=100000, help="Records per output shard")
     args = parser.parse_args()
-    random.seed(args.seed)
-    
-    dataset = []
-    with open(args.input_file, "r") as f:
-        examples = json.load(f)
-        for example in tqdm(examples):
-            d = {}
-            d['instruction'] = example['instruction'] + (("\nInput: " + example['input']) if example['input'] != "" else "")
-            d['output'] = example['output']
-            dataset.append(d)
-    test_start = int(len(dataset) *  (1 - args.test_ratio))
-    random.shuffle(dataset)
-    train = dataset[:test_start]
-    test = dataset[test_start:]
-    with open(os.path.join(args.output_dir, "train.json"), "w") as f1, open(os.path.join(args.output_dir, "test.json"), "w") as f2:
-        json.dump(train, f1, indent=2, sort_keys=True)
-        json.dump(test, f2, indent=2, sort_keys=True)
-    print(f"{len(train)} training examples.")
-    print(f"{len(test)} test examples.")
+
+    writers = {split: ShardWriter(args.output_dir, split, args.format, args.shard_size) for split in SPLITS}
+    seen = set()
+    duplicates = 0
+    try:
+        for example in tqdm(iter_json_items(args.input_file)):
+            d = sft_record(example)
+            key = record_key(d)
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            writers[split_of(example['instruction'], args.test_ratio, args.seed)].write(d)
+    except BaseException:
+        for writer in writers.values():
+            writer.abort()
+        raise
+
+    new_paths = {path for writer in writers.values() for _, path in writer.paths}
+    for path in stale_outputs(args.output_dir):
+        if path in new_paths:
+            continue
+        print(f"Removing stale output {path}")
+        os.remove(path)
+    for writer in writers.values():
+        writer.commit()
+    print(f"{writers['train'].count} training examples in {len(writers['train'].paths)} shards.")
+    print(f"{writers['test'].count} test examples in {len(writers['test'].paths)} shards.")
+    print(f"{duplicates} exact duplicates removed.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
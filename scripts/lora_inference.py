@@ -0,0 +1,304 @@
+import os
+import json
+import math
+import time
+import argparse
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import torch
+from torch import nn
+
+from generate_sft_dataset import iter_records, sft_record
+from merge_lora import find_adapters, load_lora_weights
+from pack_sft_dataset import split_files, tokenize_sft
+
+
+def load_examples(path, split="test", limit=None):
+    """
+    读取评测样本，统一为 instruction / output 两个字段
+
+    参数:
+        path: generate_sft_dataset.py 的输出目录（读取 split 对应的分片），或单个 JSON / JSONL / Parquet 文件
+        split: 目录输入时读取的划分
+        limit: 最多读取的条数
+    """
+    paths = split_files(path, split) if os.path.isdir(path) else [path]
+    if not paths:
+        raise FileNotFoundError(f"{path} 中没有 {split} 数据")
+    examples = []
+    for p in paths:
+        for example in iter_records(p):
+            examples.append(sft_record(example) if "input" in example else example)
+            if limit is not None and len(examples) >= limit:
+                return examples
+    return examples
+
+
+def run_segments(names):
+    """把按 adapter 排好序的行分成连续的段 [(adapter, start, end)]"""
+    segments = []
+    for i, name in enumerate(names):
+        if segments and segments[-1][0] == name:
+            segments[-1][2] = i + 1
+        else:
+            segments.append([name, i, i + 1])
+    return [tuple(s) for s in segments]
+
+
+class MultiLoraLinear(nn.Module):
+    """
+    包装一个 nn.Linear：输出为 base(x) 加上每一段行各自 adapter 的 LoRA 项
+
+    context.segments 给出当前批次中连续的行段及其 adapter，每段做两次小矩阵乘
+    （segmented LoRA matmul），没有 adapter 的段只走基础权重。与 PEFT 一致，LoRA 项在
+    adapter 权重的精度（fp16/bf16 会转为 fp32）下计算后再加回输出。
+    """
+
+    def __init__(self, base, context):
+        super().__init__()
+        self.base = base
+        self.context = context
+        self.lora = {}
+
+    def forward(self, x):
+        out = self.base(x)
+        for name, start, end in self.context.segments:
+            weights = self.lora.get(name)
+            if weights is None:
+                continue
+            A, B, scaling = weights
+            xs = x[start:end].to(A.dtype)
+            out[start:end] += ((xs @ A.T) @ B.T * scaling).to(out.dtype)
+        return out
+
+
+class MultiLoraModel:
+    """
+    常驻一个基础模型，按需加载多个未合并的 PEFT adapter，批次中每一行可使用不同的 adapter
+
+    最多同时驻留 max_loaded 个 adapter，超出时按 LRU 淘汰当前批次用不到的 adapter。
+    请求先按 adapter 排序再分批，使同一 adapter 的行在批内连续、在批间相邻，
+    每个 adapter 通常只需加载一次。
+    """
+
+    def __init__(self, model, tokenizer, adapters, max_loaded=4):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        if tokenizer.pad_token_id is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        self.adapters = dict(adapters)
+        self.max_loaded = max_loaded
+        self.context = SimpleNamespace(segments=[])
+        self.wrapped = {}
+        self.loaded = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_pretrained(cls, base_model, adapter_paths, max_loaded=4, torch_dtype="auto"):
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        model = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype=torch_dtype)
+        tokenizer = AutoTokenizer.from_pretrained(base_model)
+        adapter_paths = find_adapters(adapter_paths) if adapter_paths else []
+        names = [os.path.basename(os.path.normpath(p)) for p in adapter_paths]
+        if len(set(names)) < len(names):
+            names = adapter_paths
+        return cls(model, tokenizer, zip(names, adapter_paths), max_loaded)
+
+    def _wrap(self, module_name):
+        if module_name not in self.wrapped:
+            parent_name, _, child = module_name.rpartition(".")
+            parent = self.model.get_submodule(parent_name)
+            base = getattr(parent, child)
+            if not isinstance(base, nn.Linear):
+                raise NotImplementedError(f"{module_name} 不是 nn.Linear，不支持未合并推理")
+            self.wrapped[module_name] = MultiLoraLinear(base, self.context)
+            setattr(parent, child, self.wrapped[module_name])
+        return self.wrapped[module_name]
+
+    def _load(self, name):
+        deltas, replaced, fan_in_fan_out = load_lora_weights(self.adapters[name])
+        if replaced or fan_in_fan_out:
+            raise NotImplementedError(f"{name} 含 modules_to_save 或 fan_in_fan_out，请先合并再评测")
+        device = self.model.device
+        for key, (A, B, scaling) in deltas.items():
+            dtype = torch.float32 if A.dtype in (torch.float16, torch.bfloat16) else A.dtype
+            self._wrap(key[:-len(".weight")]).lora[name] = (A.to(device, dtype), B.to(device, dtype), scaling)
+        self.loads += 1
+
+    def _evict(self, name):
+        for module in self.wrapped.values():
+            module.lora.pop(name, None)
+        del self.loaded[name]
+        self.evictions += 1
+
+    def acquire(self, names):
+        """保证 names 中的 adapter 都已加载；需要腾出位置时淘汰最久未使用且不在 names 中的 adapter"""
+        names = [n for n in dict.fromkeys(names) if n is not None]
+        if len(names) > self.max_loaded:
+            raise ValueError(f"一个批次用到 {len(names)} 个 adapter，超过 max_loaded={self.max_loaded}")
+        for name in names:
+            if name in self.loaded:
+                self.loaded.move_to_end(name)
+                continue
+            while len(self.loaded) >= self.max_loaded:
+                victim = next(n for n in self.loaded if n not in names)
+                self._evict(victim)
+            self._load(name)
+            self.loaded[name] = True
+
+    def _batches(self, adapters, batch_size):
+        """按 adapter 排序后分批，每批不超过 batch_size 行、max_loaded 个不同的 adapter"""
+        order = sorted(range(len(adapters)), key=lambda i: (adapters[i] is not None, adapters[i] or "", i))
+        batch, distinct = [], set()
+        for i in order:
+            name = adapters[i]
+            new_adapter = name is not None and name not in distinct
+            if batch and (len(batch) >= batch_size or (new_adapter and len(distinct) >= self.max_loaded)):
+                yield batch
+                batch, distinct = [], set()
+            batch.append(i)
+            if name is not None:
+                distinct.add(name)
+        if batch:
+            yield batch
+
+    def _run(self, names, fn):
+        self.acquire(names)
+        self.context.segments = run_segments(names)
+        try:
+            with torch.no_grad():
+                return fn()
+        finally:
+            self.context.segments = []
+
+    def generate(self, prompts, adapters, max_new_tokens=128, batch_size=8):
+        """
+        贪心生成；adapters[i] 为第 i 个提示词使用的 adapter 名，None 表示基础模型
+
+        参数:
+            prompts: 提示词列表
+            adapters: 与 prompts 等长的 adapter 名列表
+            max_new_tokens: 每条最多生成的 token 数
+            batch_size: 每批的行数
+        """
+        results = [None] * len(prompts)
+        self.tokenizer.padding_side = "left"
+        for batch in self._batches(adapters, batch_size):
+            names = [adapters[i] for i in batch]
+            enc = self.tokenizer([prompts[i] for i in batch], return_tensors="pt", padding=True).to(self.model.device)
+            out = self._run(names, lambda: self.model.generate(
+                **enc, max_new_tokens=max_new_tokens, do_sample=False, pad_token_id=self.tokenizer.pad_token_id))
+            for i, ids in zip(batch, out[:, enc["input_ids"].shape[1]:]):
+                results[i] = self.tokenizer.decode(ids, skip_special_tokens=True)
+        return results
+
+    def encode(self, prompts, responses, max_len):
+        """
+        与训练一致地分词并截断（见 pack_sft_dataset.tokenize_sft），前 prompt_len 个 token 不计损失
+
+        返回与输入等长的 [(token ids, prompt 长度)]，训练时会被丢弃的样本为 None。
+        """
+        return [None if encoded is None else encoded[:2]
+                for encoded in tokenize_sft(self.tokenizer, prompts, responses, max_len)]
+
+    def forward_losses(self, encoded, names):
+        """
+        对一批已编码的样本做一次前向，返回每行 response 部分的 (负对数似然之和, token 数)
+
+        参数:
+            encoded: [(token ids, prompt 长度)]
+            names: 每行使用的 adapter 名，需按 adapter 连续排列
+        """
+        width = max(len(ids) for ids, _ in encoded)
+        input_ids = torch.full((len(encoded), width), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(encoded), width), dtype=torch.long)
+        labels = torch.full((len(encoded), width), -100, dtype=torch.long)
+        for row, (ids, prompt_len) in enumerate(encoded):
+            input_ids[row, :len(ids)] = torch.tensor(ids)
+            attention_mask[row, :len(ids)] = 1
+            labels[row, prompt_len:len(ids)] = input_ids[row, prompt_len:len(ids)]
+        device = self.model.device
+        logits = self._run(names, lambda: self.model(input_ids=input_ids.to(device),
+                                                     attention_mask=attention_mask.to(device)).logits)
+        targets = labels[:, 1:].to(device)
+        nll = nn.functional.cross_entropy(logits[:, :-1].float().transpose(1, 2), targets,
+                                          ignore_index=-100, reduction="none")
+        return list(zip(nll.sum(dim=1).tolist(), (targets != -100).sum(dim=1).tolist()))
+
+    def score(self, prompts, responses, adapters, batch_size=8, max_len=512):
+        """返回每条样本 response 部分的 (负对数似然之和, token 数)；训练时会被丢弃的样本为 None"""
+        results = [None] * len(prompts)
+        encoded = self.encode(prompts, responses, max_len)
+        kept = [i for i, e in enumerate(encoded) if e is not None]
+        self.tokenizer.padding_side = "right"
+        for batch in self._batches([adapters[i] for i in kept], batch_size):
+            batch = [kept[j] for j in batch]
+            for i, result in zip(batch, self.forward_losses([encoded[i] for i in batch],
+                                                            [adapters[i] for i in batch])):
+                results[i] = result
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base_model", type=str, default="meta-llama/Meta-Llama-3-8B")
+    parser.add_argument("--adapter_path", type=str, nargs="+", default=["../checkpoint/llama8b-sft-lora"],
+                        help="PEFT adapters, or checkpoint directories containing them")
+    parser.add_argument("--include_base", action="store_true", help="Also evaluate the base model without adapters")
+    parser.add_argument("--data", type=str, default="../data", help="SFT output directory or a JSON/JSONL/Parquet file")
+    parser.add_argument("--split", type=str, default="test")
+    parser.add_argument("--num_examples", type=int, default=200)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--max_len", type=int, default=512, help="Training max_len; longer samples are truncated or dropped as in training")
+    parser.add_argument("--max_loaded_adapters", type=int, default=4)
+    parser.add_argument("--max_new_tokens", type=int, default=128)
+    parser.add_argument("--num_generate", type=int, default=0, help="Examples to generate greedily per adapter")
+    parser.add_argument("--output", type=str, default=None, help="Write per-adapter results as JSON")
+    args = parser.parse_args()
+
+    lora = MultiLoraModel.from_pretrained(args.base_model, args.adapter_path, args.max_loaded_adapters)
+    names = ([None] if args.include_base else []) + list(lora.adapters)
+    examples = load_examples(args.data, args.split, args.num_examples)
+    print(f"{len(examples)} examples, {len(lora.adapters)} adapters, "
+          f"at most {args.max_loaded_adapters} resident.")
+
+    # 每条样本都在每个 adapter 下评测一次，混在同一批次中
+    pairs = [(example, name) for example in examples for name in names]
+    start = time.perf_counter()
+    scores = lora.score([e["instruction"] for e, _ in pairs], [e["output"] for e, _ in pairs],
+                        [name for _, name in pairs], args.batch_size, args.max_len)
+    results = {}
+    for (_, name), score in zip(pairs, scores):
+        entry = results.setdefault(name or "base", {"nll": 0.0, "tokens": 0, "dropped": 0})
+        if score is None:
+            entry["dropped"] += 1
+            continue
+        nll, tokens = score
+        entry["nll"] += nll
+        entry["tokens"] += tokens
+    for entry in results.values():
+        entry["loss"] = entry["nll"] / max(1, entry["tokens"])
+        entry["perplexity"] = math.exp(entry["loss"])
+
+    if args.num_generate:
+        gen_pairs = [(example, name) for example in examples[:args.num_generate] for name in names]
+        outputs = lora.generate([e["instruction"] for e, _ in gen_pairs], [name for _, name in gen_pairs],
+                                args.max_new_tokens, args.batch_size)
+        for (example, name), output in zip(gen_pairs, outputs):
+            results[name or "base"].setdefault("generations", []).append(
+                {"instruction": example["instruction"], "reference": example["output"], "output": output})
+
+    seconds = time.perf_counter() - start
+    for name, entry in sorted(results.items(), key=lambda x: x[1]["loss"]):
+        print(f"{name:>30}: loss {entry['loss']:.4f}  ppl {entry['perplexity']:.2f}  "
+              f"({entry['tokens']} tokens, {entry['dropped']} dropped)")
+    print(f"{seconds:.1f}s, {lora.loads} adapter loads, {lora.evictions} evictions.")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"base_model": args.base_model, "examples": len(examples), "seconds": seconds,
+                       "results": results}, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
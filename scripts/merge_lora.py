@@ -1,42 +1,393 @@
+import os
+import re
+import glob
+import json
+import math
+import shutil
 import argparse
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from peft import PeftModel
+from concurrent.futures import ThreadPoolExecutor
+import torch
+from safetensors import safe_open
+from safetensors.torch import save, save_file, load_file
+
+SAFETENSORS_INDEX = "model.safetensors.index.json"
+SAFETENSORS_SINGLE = "model.safetensors"
+# 适配器文件中的 LoRA 权重名，如 base_model.model.model.layers.0.self_attn.q_proj.lora_A.weight
+LORA_KEY_RE = re.compile(r"^(?:base_model\.model\.)?(?P<module>.+)\.lora_(?P<part>[AB])(?:\.[^.]+)?\.weight$")
+
 
 def merge_peft_adapter(base_model_name, adapter_path, output_path):
     """
     合并基础模型和PEFT adapter
-    
+
     参数:
         base_model_name: 基础模型名称或路径
         adapter_path: PEFT adapter路径
         output_path: 合并后模型的保存路径
     """
+    # 流式合并不需要 transformers 和 peft，只在这里导入以减少其常驻内存
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from peft import PeftModel
+
     print(f"正在加载基础模型: {base_model_name}")
-    base_model = AutoModelForCausalLM.from_pretrained(base_model_name)
-    
+    # 按检查点中的原始精度加载，合并结果与流式合并逐位一致
+    base_model = AutoModelForCausalLM.from_pretrained(base_model_name, torch_dtype="auto")
+
     print(f"正在加载adapter: {adapter_path}")
     model = PeftModel.from_pretrained(base_model, adapter_path)
-    
+
     print("正在合并权重...")
     # 获取合并后的模型
     merged_model = model.merge_and_unload()
-    
+
     print(f"正在保存合并后的模型到: {output_path}")
     # 直接保存合并后的模型，而不是adapter
     merged_model.save_pretrained(output_path)
-    
+
     # 保存tokenizer
     print("正在保存tokenizer...")
     tokenizer = AutoTokenizer.from_pretrained(base_model_name)
     tokenizer.save_pretrained(output_path)
-    
+
     print("合并完成!")
 
+
+def resolve_model_dir(name_or_path):
+    """
+    返回模型所在的本地目录；Hub 上的模型名只下载 safetensors 权重、配置和 tokenizer 文件
+
+    参数:
+        name_or_path: 本地目录或 Hub 上的模型名
+    """
+    if os.path.isdir(name_or_path):
+        return name_or_path
+    from huggingface_hub import snapshot_download
+    return snapshot_download(name_or_path, allow_patterns=["*.json", "*.safetensors", "tokenizer*", "*.model"])
+
+
+def weight_shards(model_dir):
+    """
+    返回 (索引 JSON 或 None, 各分片文件名)
+
+    参数:
+        model_dir: 模型目录
+    """
+    index_path = os.path.join(model_dir, SAFETENSORS_INDEX)
+    if os.path.exists(index_path):
+        with open(index_path, "r") as f:
+            index = json.load(f)
+        return index, sorted(set(index["weight_map"].values()))
+    if os.path.exists(os.path.join(model_dir, SAFETENSORS_SINGLE)):
+        return None, [SAFETENSORS_SINGLE]
+    raise FileNotFoundError(f"{model_dir} 中没有 safetensors 权重，请使用非流式合并")
+
+
+def _pattern_value(patterns, module_name, default):
+    """与 PEFT 的 rank_pattern / alpha_pattern 相同：模式匹配模块名的结尾"""
+    for pattern, value in patterns.items():
+        if re.match(rf"(.*\.)?({pattern})$", module_name):
+            return value
+    return default
+
+
+def load_lora_weights(adapter_path):
+    """
+    读取 PEFT adapter，返回 (LoRA 增量, 整体替换的权重)
+
+    LoRA 增量以基础模型中的权重名为键，值为 (A, B, scaling)；整体替换的权重来自
+    modules_to_save（如 lm_head），同样以基础模型中的权重名为键。
+
+    参数:
+        adapter_path: PEFT adapter路径
+    """
+    with open(os.path.join(adapter_path, "adapter_config.json"), "r") as f:
+        config = json.load(f)
+    if config.get("use_dora") or config.get("lora_bias"):
+        raise NotImplementedError("流式合并暂不支持 DoRA 和 lora_bias，请使用非流式合并")
+    if os.path.exists(os.path.join(adapter_path, "adapter_model.safetensors")):
+        tensors = load_file(os.path.join(adapter_path, "adapter_model.safetensors"))
+    else:
+        tensors = torch.load(os.path.join(adapter_path, "adapter_model.bin"), map_location="cpu", weights_only=True)
+
+    pairs = {}
+    replaced = {}
+    for key, tensor in tensors.items():
+        match = LORA_KEY_RE.match(key)
+        if match:
+            pairs.setdefault(match.group("module"), {})[match.group("part")] = tensor
+        elif "lora_" in key:
+            raise NotImplementedError(f"流式合并不支持的 adapter 权重: {key}")
+        else:
+            replaced[re.sub(r"^base_model\.model\.", "", key).replace(".modules_to_save", "")] = tensor
+
+    deltas = {}
+    for module, pair in pairs.items():
+        if set(pair) != {"A", "B"}:
+            raise ValueError(f"{module} 缺少 lora_A 或 lora_B")
+        r = pair["A"].shape[0]
+        alpha = _pattern_value(config.get("alpha_pattern") or {}, module, config["lora_alpha"])
+        scaling = alpha / math.sqrt(r) if config.get("use_rslora") else alpha / r
+        deltas[f"{module}.weight"] = (pair["A"], pair["B"], scaling)
+    return deltas, replaced, bool(config.get("fan_in_fan_out"))
+
+
+def lora_delta(A, B, scaling, fan_in_fan_out=False):
+    """
+    计算 (alpha/r)·B·A，运算顺序和精度与 PEFT 的 get_delta_weight 一致
+
+    PEFT 加载 adapter 时把 fp16/bf16 权重转为 fp32，因此这里同样在 fp32 下相乘。
+    """
+    if A.dtype in (torch.float16, torch.bfloat16):
+        A, B = A.float(), B.float()
+    delta = B @ A
+    if fan_in_fan_out:
+        delta = delta.T
+    return delta * scaling
+
+
+def copy_model_files(base_dir, output_path):
+    """复制配置、tokenizer 等非权重文件"""
+    for name in os.listdir(base_dir):
+        src = os.path.join(base_dir, name)
+        if (os.path.isfile(src) and not name.endswith((".safetensors", ".bin", ".pt", ".pth"))
+                and name != SAFETENSORS_INDEX and not name.startswith(".")):
+            shutil.copyfile(src, os.path.join(output_path, name))
+
+
+def stream_merge_lora(base_model_name, adapter_path, output_path):
+    """
+    逐个分片地合并基础模型和 LoRA adapter，峰值内存约为一个分片
+
+    每个 safetensors 分片通过 mmap 打开，只对 LoRA 作用的权重原位执行 W += (alpha/r)·B·A
+    （保持原始精度），写出同名的输出分片后再处理下一个；不含 LoRA 权重的分片直接复制。
+    索引、配置和 tokenizer 文件原样复制。
+
+    参数:
+        base_model_name: 基础模型名称或路径
+        adapter_path: PEFT adapter路径
+        output_path: 合并后模型的保存路径
+    """
+    base_dir = resolve_model_dir(base_model_name)
+    index, shards = weight_shards(base_dir)
+    deltas, replaced, fan_in_fan_out = load_lora_weights(adapter_path)
+    print(f"正在合并 {len(deltas)} 个 LoRA 权重、替换 {len(replaced)} 个权重，共 {len(shards)} 个分片")
+
+    os.makedirs(output_path, exist_ok=True)
+    remaining = set(deltas) | set(replaced)
+    for shard in shards:
+        src = os.path.join(base_dir, shard)
+        dst = os.path.join(output_path, shard)
+        with safe_open(src, framework="pt") as f:
+            names = list(f.keys())
+            if not remaining.intersection(names):
+                print(f"复制分片 {shard}")
+                shutil.copyfile(src, dst)
+                continue
+            print(f"合并分片 {shard}")
+            metadata = f.metadata()
+            tensors = {}
+            for name in names:
+                tensor = f.get_tensor(name)
+                if name in deltas:
+                    tensor += lora_delta(*deltas[name], fan_in_fan_out)
+                elif name in replaced:
+                    tensor = replaced[name].to(tensor.dtype)
+                remaining.discard(name)
+                tensors[name] = tensor
+        save_file(tensors, dst, metadata=metadata)
+        del tensors
+
+    if remaining:
+        raise KeyError(f"基础模型中找不到这些权重: {sorted(remaining)[:5]}")
+    if index is not None:
+        with open(os.path.join(output_path, SAFETENSORS_INDEX), "w") as f:
+            json.dump(index, f, indent=2)
+    copy_model_files(base_dir, output_path)
+    print("合并完成!")
+
+
+def find_adapters(paths):
+    """
+    展开 adapter 路径：不含 adapter_config.json 的目录（如检查点根目录）展开为其下所有 adapter 目录
+
+    参数:
+        paths: adapter 目录或检查点根目录列表
+    """
+    adapters = []
+    for path in paths:
+        if os.path.exists(os.path.join(path, "adapter_config.json")):
+            adapters.append(path)
+            continue
+        found = sorted(os.path.dirname(p) for p in glob.glob(os.path.join(path, "**", "adapter_config.json"), recursive=True))
+        if not found:
+            raise FileNotFoundError(f"{path} 下没有 PEFT adapter")
+        adapters.extend(found)
+    return adapters
+
+
+def _output_names(adapter_paths):
+    """每个 adapter 的输出子目录名：默认取目录名，重名时改用相对公共父目录的路径"""
+    names = [os.path.basename(os.path.normpath(p)) for p in adapter_paths]
+    if len(set(names)) < len(names):
+        root = os.path.commonpath([os.path.abspath(p) for p in adapter_paths])
+        names = [os.path.relpath(os.path.abspath(p), root).replace(os.sep, "_") for p in adapter_paths]
+    return names
+
+
+def _link_or_copy(src, dst):
+    """硬链接，跨文件系统等无法链接时退回复制"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def merge_many_lora(base_model_name, adapter_paths, output_root, num_workers=4, hardlink=False):
+    """
+    基础模型只加载一次，依次合并多个 LoRA adapter，分别写到 output_root 下的子目录
+
+    逐个分片处理：分片中任一 adapter 都不涉及的权重只序列化一次，再复制到各输出目录；
+    涉及的权重单独写成每个 adapter 各自的 -lora 分片。每个 adapter 在原位加上增量、
+    序列化后再恢复原值（从保存的原始值复制，避免低精度下减去增量带来的舍入误差），
+    序列化结果交给写线程并行写盘。不变的分片只做文件复制，不再逐个反序列化和合并；
+    使用 hardlink 时连复制也省掉，磁盘写入量随 adapter 涉及的权重增长，而不是随模型
+    大小增长。每个输出与 stream_merge_lora 的结果逐位一致。
+
+    参数:
+        base_model_name: 基础模型名称或路径
+        adapter_paths: PEFT adapter路径列表
+        output_root: 输出根目录，每个 adapter 写到以其目录名命名的子目录
+        num_workers: 并行写盘的线程数，也是同时驻留内存的已序列化分片数上限
+        hardlink: 不复制，改为硬链接共享不变的分片以节省磁盘；此时各输出目录之间、
+            以及完全不变的分片与基础模型之间共享同一份文件，原地修改任何一个都会改坏其余的
+    """
+    if hardlink:
+        print("警告: 使用硬链接共享不变的分片，各输出目录与基础模型共用同一份文件，"
+              "请勿原地修改其中任何一个")
+    base_dir = resolve_model_dir(base_model_name)
+    index, shards = weight_shards(base_dir)
+    names = _output_names(adapter_paths)
+    adapters = []
+    for name, path in zip(names, adapter_paths):
+        print(f"正在加载adapter: {path}")
+        adapters.append((name, *load_lora_weights(path)))
+    targets = set()
+    for _, deltas, replaced, _ in adapters:
+        targets |= set(deltas) | set(replaced)
+    print(f"正在合并 {len(adapters)} 个 adapter，涉及 {len(targets)} 个权重，共 {len(shards)} 个分片")
+
+    shared_dir = os.path.join(output_root, ".shared")
+    os.makedirs(shared_dir, exist_ok=True)
+    for name in names:
+        os.makedirs(os.path.join(output_root, name), exist_ok=True)
+    weight_map = {}
+    lora_files = {}
+    total_size = 0
+    written = 0
+
+    def share(path, filename):
+        nonlocal written
+        for name in names:
+            dst = os.path.join(output_root, name, filename)
+            if hardlink:
+                _link_or_copy(path, dst)
+            else:
+                shutil.copyfile(path, dst)
+                written += os.path.getsize(dst)
+
+    with ThreadPoolExecutor(num_workers) as pool:
+        pending = []
+        for shard in shards:
+            src = os.path.join(base_dir, shard)
+            with safe_open(src, framework="pt") as f:
+                tensor_names = list(f.keys())
+                metadata = f.metadata()
+                touched = [n for n in tensor_names if n in targets]
+                if not touched:
+                    # 整个分片都不变：直接从基础模型复制（或硬链接）到各输出
+                    print(f"共享分片 {shard}")
+                    share(src, shard)
+                    weight_map.update({n: shard for n in tensor_names})
+                    continue
+                untouched = {n: f.get_tensor(n) for n in tensor_names if n not in targets}
+                originals = {n: f.get_tensor(n) for n in touched}
+
+            print(f"合并分片 {shard}")
+            # 没有索引时基础模型只有一个分片，只会走到这里
+            total_size += sum(t.nbytes for t in untouched.values()) + sum(t.nbytes for t in originals.values())
+            if untouched:
+                shared = os.path.join(shared_dir, shard)
+                save_file(untouched, shared, metadata=metadata)
+                written += os.path.getsize(shared)
+                share(shared, shard)
+                weight_map.update({n: shard for n in untouched})
+            del untouched
+
+            lora_file = shard[:-len(".safetensors")] + "-lora.safetensors"
+            lora_files[shard] = lora_file
+            weight_map.update({n: lora_file for n in touched})
+            working = {n: t.clone() for n, t in originals.items()}
+            for name, deltas, replaced, fan_in_fan_out in adapters:
+                for n in touched:
+                    if n in deltas:
+                        working[n] += lora_delta(*deltas[n], fan_in_fan_out)
+                    elif n in replaced:
+                        working[n].copy_(replaced[n].to(working[n].dtype))
+                data = save(working, metadata=metadata)
+                for n in touched:
+                    if n in deltas or n in replaced:
+                        working[n].copy_(originals[n])
+                # 限制同时驻留内存的已序列化分片数
+                if len(pending) >= num_workers:
+                    pending.pop(0).result()
+                pending.append(pool.submit(_write_bytes, os.path.join(output_root, name, lora_file), data))
+                written += len(data)
+            del working, originals
+        for future in pending:
+            future.result()
+
+    if index is not None:
+        total_size = index["metadata"]["total_size"]
+    merged_index = {"metadata": {"total_size": total_size}, "weight_map": dict(sorted(weight_map.items()))}
+    for name in names:
+        out = os.path.join(output_root, name)
+        with open(os.path.join(out, SAFETENSORS_INDEX), "w") as f:
+            json.dump(merged_index, f, indent=2)
+        copy_model_files(base_dir, out)
+        # 单文件的基础模型已改为带索引的分片，去掉复制过来的同名文件以免误用
+        if index is None and os.path.exists(os.path.join(out, SAFETENSORS_SINGLE)):
+            os.remove(os.path.join(out, SAFETENSORS_SINGLE))
+    # 各输出目录中已是副本或指向数据的硬链接，临时的共享目录可以删除
+    shutil.rmtree(shared_dir)
+    print(f"合并完成! 共写入 {written / 2 ** 30:.2f} GiB，"
+          f"逐个合并需写入约 {len(names) * total_size / 2 ** 30:.2f} GiB")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--base_model", type=str, required=True, help="Base model name or path")
-    parser.add_argument("--adapter_path", type=str, required=True, help="Path to PEFT adapter")
+    parser.add_argument("--adapter_path", type=str, nargs="+", required=True,
+                        help="Path to PEFT adapter; several adapters or a checkpoint directory merge each adapter "
+                             "into its own subdirectory of --output_path")
     parser.add_argument("--output_path", type=str, required=True, help="Path to save merged model")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Merge shard by shard from mmapped safetensors instead of loading the full model")
+    parser.add_argument("--num_workers", type=int, default=4, help="Writer threads when merging several adapters")
+    parser.add_argument("--hardlink", action="store_true",
+                        help="When merging several adapters, hard-link unchanged shards instead of copying them; "
+                             "outputs then share files with each other and with the base model, so never edit "
+                             "them in place")
     args = parser.parse_args()
-    
-    merge_peft_adapter(args.base_model, args.adapter_path, args.output_path)
\ No newline at end of file
+
+    adapter_paths = find_adapters(args.adapter_path)
+    if len(adapter_paths) > 1:
+        merge_many_lora(args.base_model, adapter_paths, args.output_path, args.num_workers, args.hardlink)
+    elif args.streaming:
+        stream_merge_lora(args.base_model, adapter_paths[0], args.output_path)
+    else:
+        merge_peft_adapter(args.base_model, adapter_paths[0], args.output_path)
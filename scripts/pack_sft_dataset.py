@@ -0,0 +1,267 @@
+import json
+import argparse
+import glob
+import os
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+from generate_sft_dataset import SPLITS, iter_records
+
+_tokenizer = None
+
+
+def _init_worker(tokenizer_name):
+    global _tokenizer
+    # 进程间已经并行，关闭 tokenizers 自身的线程池避免过度订阅
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    from transformers import AutoTokenizer
+    _tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+
+
+def tokenize_sft(tokenizer, prompts, responses, max_len):
+    """按训练时的方式分词一批 (prompt, response)
+
+    复现 openrlhf SFTDataset 在不使用 input_template 和 chat template 时（即
+    train_llama3_8b_sft_lora.sh 的设置）的处理：prompt 与 prompt + response 都不加特殊
+    token（不加 bos）；拼接后去掉末尾换行，不以 eos 结尾时追加 " " + eos_token 再分词；
+    截断到 max_len 后把最后一个 token 替换为 eos。prompt 或 response 为空、或 prompt
+    不少于 max_len - 2 个 token 的样本被丢弃。
+
+    返回与输入等长的列表，每项为 (token ids, prompt token 数, 是否截断)，丢弃的样本为 None。
+    """
+    eos = tokenizer.eos_token
+    texts = []
+    for prompt, response in zip(prompts, responses):
+        text = (prompt + response).rstrip("\n")
+        texts.append(text if text.endswith(eos) else text + " " + eos)
+    prompt_ids = tokenizer(prompts, max_length=max_len, truncation=True, add_special_tokens=False)["input_ids"]
+    text_ids = tokenizer(texts, add_special_tokens=False)["input_ids"]
+    results = []
+    for prompt, response, p, ids in zip(prompts, responses, prompt_ids, text_ids):
+        if not prompt or not response or len(p) >= max_len - 2:
+            results.append(None)
+            continue
+        truncated = len(ids) > max_len
+        ids = list(ids[:max_len])
+        ids[-1] = tokenizer.eos_token_id
+        results.append((ids, len(p), truncated))
+    return results
+
+
+def _tokenize_batch(batch, max_len):
+    return tokenize_sft(_tokenizer, [prompt for prompt, _ in batch], [response for _, response in batch], max_len)
+
+
+def split_files(data_dir, split):
+    """generate_sft_dataset.py 为某个划分写出的文件：JSONL 或 Parquet 分片，或旧版的 {split}.json"""
+    pattern = os.path.join(data_dir, f"{split}-[0-9][0-9][0-9][0-9][0-9]")
+    jsonl = sorted(glob.glob(pattern + ".jsonl"))
+    parquet = sorted(glob.glob(pattern + ".parquet"))
+    if jsonl and parquet:
+        raise SystemExit(f"{data_dir} has both JSONL and Parquet {split} shards; "
+                         f"rerun generate_sft_dataset.py to replace them with one format")
+    paths = jsonl or parquet
+    legacy = os.path.join(data_dir, f"{split}.json")
+    if not paths and os.path.exists(legacy):
+        paths = [legacy]
+    return paths
+
+
+def iter_batches(paths, input_key, output_key, batch_size):
+    batch = []
+    for path in paths:
+        for example in iter_records(path):
+            batch.append((example[input_key], example[output_key]))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def first_fit_decreasing(lengths, capacity):
+    """按长度从大到小，把每个样本放进第一个还放得下的序列
+
+    用一棵记录各序列剩余容量最大值的线段树找最左侧放得下的序列，O(n log n)。
+    未使用的序列剩余容量为 capacity，且都排在已使用的序列之后，因此最左侧放得下的
+    就是首次适应的结果。返回每个序列包含的样本下标列表，按序列打开的顺序。
+    """
+    order = np.argsort(-np.asarray(lengths), kind="stable")
+    size = 1
+    while size < max(1, len(lengths)):
+        size *= 2
+    tree = [capacity] * (2 * size)
+    bins = []
+    for idx in order.tolist():
+        need = int(lengths[idx])
+        node = 1
+        while node < size:
+            node = 2 * node if tree[2 * node] >= need else 2 * node + 1
+        b = node - size
+        if b == len(bins):
+            bins.append([])
+        bins[b].append(idx)
+        tree[node] -= need
+        node //= 2
+        while node:
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+            node //= 2
+    return bins
+
+
+def pack_split(paths, output_dir, split, args):
+    """分词、截断、装箱并写出一个划分，返回统计信息
+
+    分词结果先按输入顺序写入临时的 token 文件，内存里只保留每个样本的长度；装箱之后
+    再按序列顺序拷贝到 {split}.tokens.bin，使每个打包序列在文件中是连续的一段。
+    """
+    dtype = np.dtype(args.dtype)
+    tmp_path = os.path.join(output_dir, f".{split}.unpacked.tmp")
+    lengths, prompt_lens = [], []
+    dropped = truncated = 0
+    batches = iter_batches(paths, args.input_key, args.output_key, args.batch_size)
+    tokenize = partial(_tokenize_batch, max_len=args.max_len)
+    if args.num_workers > 1:
+        pool = Pool(args.num_workers, initializer=_init_worker, initargs=(args.tokenizer,))
+        results = pool.imap(tokenize, batches)
+    else:
+        # 主进程在 main() 中已加载分词器
+        pool = None
+        results = map(tokenize, batches)
+    try:
+        with open(tmp_path, "wb") as f:
+            for batch in tqdm(results, desc=f"tokenize {split}"):
+                for encoded in batch:
+                    if encoded is None:
+                        dropped += 1
+                        continue
+                    ids, prompt_len, was_truncated = encoded
+                    truncated += was_truncated
+                    f.write(np.asarray(ids, dtype=dtype).tobytes())
+                    lengths.append(len(ids))
+                    prompt_lens.append(prompt_len)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    lengths = np.asarray(lengths, dtype=np.int64)
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    bins = first_fit_decreasing(lengths, args.max_len)
+
+    # samples 每行为 (起始位置, 长度, prompt 长度)，按打包顺序排列；packs[i]:packs[i+1] 为第 i 个序列的样本
+    num_tokens = int(lengths.sum())
+    samples = np.empty((len(lengths), 3), dtype=np.int64)
+    packs = np.zeros(len(bins) + 1, dtype=np.int64)
+    unpacked = np.memmap(tmp_path, dtype=dtype, mode="r") if num_tokens else np.empty(0, dtype=dtype)
+    with open(os.path.join(output_dir, f"{split}.tokens.bin"), "wb") as f:
+        row = pos = 0
+        for i, members in enumerate(bins):
+            for idx in members:
+                f.write(unpacked[starts[idx]:starts[idx] + lengths[idx]].tobytes())
+                samples[row] = (pos, lengths[idx], prompt_lens[idx])
+                pos += lengths[idx]
+                row += 1
+            packs[i + 1] = row
+    del unpacked
+    os.remove(tmp_path)
+    np.save(os.path.join(output_dir, f"{split}.samples.npy"), samples)
+    np.save(os.path.join(output_dir, f"{split}.packs.npy"), packs)
+
+    return {
+        "files": [os.path.basename(p) for p in paths],
+        "samples": len(lengths),
+        "dropped": dropped,
+        "truncated": truncated,
+        "tokens": num_tokens,
+        "sequences": len(bins),
+        # 打包后的有效 token 比例，以及每个样本单独补齐到 max_len 时的比例
+        "packing_efficiency": num_tokens / (len(bins) * args.max_len) if bins else 0.0,
+        "unpacked_efficiency": num_tokens / (len(lengths) * args.max_len) if len(lengths) else 0.0,
+    }
+
+
+class PackedSFTDataset:
+    """读取 pack_sft_dataset.py 的输出；token、样本表和序列表都以内存映射打开
+
+    每一项是一个打包序列：input_ids、按样本编号（从 1 开始）的 attention_mask（即
+    openrlhf packing_samples 使用的格式）、只在 response 上为 1 的 loss_mask，以及各样本长度。
+    """
+
+    def __init__(self, data_dir, split="train"):
+        with open(os.path.join(data_dir, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.max_len = self.meta["max_len"]
+        self.tokens = np.memmap(os.path.join(data_dir, f"{split}.tokens.bin"),
+                                dtype=self.meta["dtype"], mode="r")
+        self.samples = np.load(os.path.join(data_dir, f"{split}.samples.npy"), mmap_mode="r")
+        self.packs = np.load(os.path.join(data_dir, f"{split}.packs.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.packs) - 1
+
+    def __getitem__(self, i):
+        rows = self.samples[self.packs[i]:self.packs[i + 1]]
+        start, end = rows[0, 0], rows[-1, 0] + rows[-1, 1]
+        lengths = rows[:, 1]
+        loss_mask = np.ones(end - start, dtype=np.int64)
+        for pos, _, prompt_len in rows:
+            loss_mask[pos - start:pos - start + prompt_len] = 0
+        return {
+            "input_ids": np.asarray(self.tokens[start:end], dtype=np.int64),
+            "attention_mask": np.repeat(np.arange(1, len(rows) + 1), lengths),
+            "loss_mask": loss_mask,
+            "packed_seq_lens": lengths.tolist(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tokenize and pack the SFT splits into memory-mapped files read by PackedSFTDataset. "
+                    "train_llama3_8b_sft_lora.sh does not use this output: openrlhf still tokenizes ../data itself "
+                    "at the start of every run.")
+    parser.add_argument("--data_dir", type=str, default="../data", help="Output directory of generate_sft_dataset.py")
+    parser.add_argument("--output_dir", type=str, default="../packed",
+                        help="Keep outside --data_dir: the training script loads that directory with json@")
+    parser.add_argument("--tokenizer", type=str, default="meta-llama/Meta-Llama-3-8B")
+    parser.add_argument("--max_len", type=int, default=512)
+    parser.add_argument("--input_key", type=str, default="instruction")
+    parser.add_argument("--output_key", type=str, default="output")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch_size", type=int, default=1000, help="Records per tokenization task")
+    args = parser.parse_args()
+
+    _init_worker(args.tokenizer)
+    # Llama-3 的词表超过 uint16 的范围
+    args.dtype = "uint16" if len(_tokenizer) <= 2 ** 16 else "uint32"
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    meta = {
+        "tokenizer": args.tokenizer,
+        "vocab_size": len(_tokenizer),
+        "dtype": args.dtype,
+        "max_len": args.max_len,
+        "input_key": args.input_key,
+        "output_key": args.output_key,
+        "splits": {},
+    }
+    for split in SPLITS:
+        paths = split_files(args.data_dir, split)
+        if not paths:
+            print(f"No {split} files in {args.data_dir}, skipped.")
+            continue
+        stats = pack_split(paths, args.output_dir, split, args)
+        meta["splits"][split] = stats
+        print(f"{split}: {stats['samples']} samples ({stats['dropped']} dropped, {stats['truncated']} truncated) "
+              f"packed into {stats['sequences']} sequences of {args.max_len} tokens, "
+              f"packing efficiency {stats['packing_efficiency']:.1%} "
+              f"(padding each sample to max_len: {stats['unpacked_efficiency']:.1%}).")
+    with open(os.path.join(args.output_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+if __name__ == "__main__":
+    main()
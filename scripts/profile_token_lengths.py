@@ -0,0 +1,239 @@
+import json
+import argparse
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from generate_sft_dataset import SPLITS, iter_records, sft_record
+from pack_sft_dataset import first_fit_decreasing, split_files
+
+FIELDS = ("instruction", "input", "output", "prompt", "sample")
+PERCENTILES = (50, 90, 95, 99, 99.9)
+
+_tokenizer = None
+
+
+def _init_worker(tokenizer_name):
+    global _tokenizer
+    # 进程间已经并行，关闭 tokenizers 自身的线程池避免过度订阅
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    from transformers import AutoTokenizer
+    _tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+
+
+def _measure_batch(batch):
+    """返回一批样本各字段的 token 数和词数，形状均为 (len(FIELDS), len(batch))
+
+    prompt / sample 为训练实际看到的文本（与 pack_sft_dataset.tokenize_sft 相同：不加特殊 token，末尾追加 eos），
+    output 的 token 数取 sample 与 prompt 之差，即训练时 response 部分的长度，省去一次分词。
+    SFT 格式的输入没有 input 字段（instruction 已包含 input），此时 input 记为 0。
+    """
+    backend = _tokenizer.backend_tokenizer
+    # 只需要长度；较新的 tokenizers 提供不计算 offsets 的 encode_batch_fast
+    encode_batch = getattr(backend, "encode_batch_fast", backend.encode_batch)
+    records = [sft_record(example) if "input" in example else example for example in batch]
+    eos = _tokenizer.eos_token
+    samples = [(d["instruction"] + d["output"]).rstrip("\n") for d in records]
+    columns = {
+        "instruction": [example["instruction"] for example in batch],
+        "input": [example.get("input", "") for example in batch],
+        "output": [example["output"] for example in batch],
+        "prompt": [d["instruction"] for d in records],
+        "sample": [text if text.endswith(eos) else text + " " + eos for text in samples],
+    }
+
+    def count(texts, add_special_tokens):
+        return [len(e.ids) for e in encode_batch(texts, add_special_tokens=add_special_tokens)]
+
+    tokens = np.zeros((len(FIELDS), len(batch)), dtype=np.int64)
+    i = {field: k for k, field in enumerate(FIELDS)}
+    tokens[i["instruction"]] = count(columns["instruction"], False)
+    if any(columns["input"]):
+        tokens[i["input"]] = count(columns["input"], False)
+    if any("input" in example for example in batch):
+        tokens[i["prompt"]] = count(columns["prompt"], False)
+    else:
+        tokens[i["prompt"]] = tokens[i["instruction"]]
+    tokens[i["sample"]] = count(columns["sample"], False)
+    tokens[i["output"]] = tokens[i["sample"]] - tokens[i["prompt"]]
+
+    words = np.zeros((len(FIELDS), len(batch)), dtype=np.int64)
+    for field in ("instruction", "input", "output"):
+        words[i[field]] = [len(text.split()) for text in columns[field]]
+    return tokens, words
+
+
+def input_paths(path):
+    """单个 JSON / JSONL / Parquet 文件，或 generate_sft_dataset.py 的输出目录"""
+    if os.path.isdir(path):
+        return [p for split in SPLITS for p in split_files(path, split)]
+    return [path]
+
+
+def iter_batches(paths, batch_size):
+    batch = []
+    for path in paths:
+        for example in iter_records(path):
+            batch.append(example)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def distribution(values):
+    values = np.asarray(values)
+    if not len(values):
+        return {"count": 0}
+    stats = {"count": int(len(values)), "mean": float(values.mean()), "min": int(values.min())}
+    for q, v in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        stats[f"p{q:g}"] = float(v)
+    stats["max"] = int(values.max())
+    return stats
+
+
+def truncation(samples, prompts, max_len):
+    """按 openrlhf 的规则：prompt 占满 max_len 的样本被丢弃，其余超长样本被截断"""
+    dropped = prompts >= max_len - 2
+    truncated = ~dropped & (samples > max_len)
+    lost = np.where(dropped, samples, np.maximum(samples - max_len, 0)).sum()
+    return {
+        "dropped_rate": float(dropped.mean()),
+        "truncated_rate": float(truncated.mean()),
+        "lost_token_rate": float(lost / samples.sum()),
+    }
+
+
+def padding_waste(lengths, batch_size, rng):
+    """micro-batch 内补齐到最长样本时 pad token 的比例：随机顺序与按长度分组两种情况；没有样本时为 None"""
+    if not len(lengths):
+        return {"random": None, "length_grouped": None}
+    result = {}
+    for order, values in (("random", rng.permutation(lengths)), ("length_grouped", np.sort(lengths))):
+        pad = (-len(values)) % batch_size
+        batches = np.concatenate([values, np.zeros(pad, dtype=values.dtype)]).reshape(-1, batch_size)
+        padded = (batches.max(axis=1) * batch_size).sum()
+        result[order] = float(1 - values.sum() / padded)
+    return result
+
+
+def percent(value):
+    return "n/a (no samples fit max_len)" if value is None else f"{value:.1%}"
+
+
+def profile(tokens, words, args):
+    idx = {field: i for i, field in enumerate(FIELDS)}
+    samples, prompts = tokens[idx["sample"]], tokens[idx["prompt"]]
+    report = {
+        "tokens": {field: distribution(tokens[i]) for field, i in idx.items()},
+        "words": {field: distribution(words[i]) for field, i in idx.items() if field in ("instruction", "input", "output")},
+        # 提示词要求 input / output 不超过 100 词
+        "over_word_limit": {field: float((words[idx[field]] > args.word_limit).mean()) for field in ("input", "output")},
+        "truncation": {str(max_len): truncation(samples, prompts, max_len) for max_len in args.max_lens},
+    }
+
+    rng = np.random.default_rng(args.seed)
+    capped = np.minimum(samples[prompts < args.max_len - 2], args.max_len)
+    report["padding_waste"] = {str(b): padding_waste(capped, b, rng) for b in args.micro_batch_sizes}
+    packs = first_fit_decreasing(capped, args.max_len)
+    # 所有样本都会被丢弃时没有可打包的序列
+    report["packing_waste"] = float(1 - capped.sum() / (len(packs) * args.max_len)) if packs else None
+
+    recommended_len = next((m for m in sorted(args.max_lens)
+                            if report["truncation"][str(m)]["truncated_rate"]
+                            + report["truncation"][str(m)]["dropped_rate"] <= args.max_truncation),
+                           max(args.max_lens))
+    # 以当前配置（micro_batch_size * max_len）的 token 数作为每个 micro-batch 的显存预算
+    budget = args.token_budget or args.micro_batch_size * args.max_len
+    mean_len = float(np.minimum(samples, recommended_len).mean())
+    padded_batch = max([b for b in args.micro_batch_sizes if b * recommended_len <= budget], default=1)
+    packed_batch = max([b for b in args.micro_batch_sizes if b * mean_len <= budget], default=1)
+    current = report["padding_waste"].get(str(args.micro_batch_size))
+    if current is None:
+        current = padding_waste(capped, args.micro_batch_size, rng)
+    current_waste = current["random"]
+    report["recommendations"] = {
+        "max_len": recommended_len,
+        "micro_train_batch_size": packed_batch if args.packing else padded_batch,
+        "micro_train_batch_size_without_packing": padded_batch,
+        "micro_train_batch_size_with_packing": packed_batch,
+        "packing_samples": current_waste is not None and current_waste > report["packing_waste"] + 0.1,
+        "token_budget": budget,
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_file", type=str, default="../data/alpaca_data.json",
+                        help="Generated JSON / JSONL / Parquet, or the output directory of generate_sft_dataset.py")
+    parser.add_argument("--tokenizer", type=str, default="meta-llama/Meta-Llama-3-8B")
+    parser.add_argument("--max_len", type=int, default=512, help="Current training max_len")
+    parser.add_argument("--micro_batch_size", type=int, default=4, help="Current micro_train_batch_size")
+    parser.add_argument("--packing", action="store_true", help="Training uses --packing_samples")
+    parser.add_argument("--max_lens", type=int, nargs="+", default=[256, 384, 512, 768, 1024, 2048])
+    parser.add_argument("--micro_batch_sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--max_truncation", type=float, default=0.005,
+                        help="Largest acceptable fraction of dropped or truncated samples")
+    parser.add_argument("--token_budget", type=int, default=None,
+                        help="Tokens per micro-batch; defaults to micro_batch_size * max_len")
+    parser.add_argument("--word_limit", type=int, default=100)
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch_size", type=int, default=1000, help="Records per tokenization task")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output_json", type=str, default=None,
+                        help="Write the report; a .jsonl path appends one line per run for tracking")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    batches = iter_batches(input_paths(args.input_file), args.batch_size)
+    if args.num_workers > 1:
+        with Pool(args.num_workers, initializer=_init_worker, initargs=(args.tokenizer,)) as pool:
+            results = list(pool.imap(_measure_batch, batches))
+    else:
+        _init_worker(args.tokenizer)
+        results = [_measure_batch(batch) for batch in batches]
+    if not results:
+        raise SystemExit(f"No records in {args.input_file}")
+    tokens = np.concatenate([t for t, _ in results], axis=1)
+    words = np.concatenate([w for _, w in results], axis=1)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "input_file": args.input_file,
+        "tokenizer": args.tokenizer,
+        "max_len": args.max_len,
+        "micro_batch_size": args.micro_batch_size,
+    }
+    report.update(profile(tokens, words, args))
+    report["seconds"] = time.perf_counter() - start
+
+    print(f"{tokens.shape[1]} records profiled in {report['seconds']:.1f}s.")
+    for field in FIELDS:
+        d = report["tokens"][field]
+        print(f"{field:>12} tokens: mean {d['mean']:7.1f}  p50 {d['p50']:6.0f}  p95 {d['p95']:6.0f}  "
+              f"p99 {d['p99']:6.0f}  max {d['max']:6d}")
+    for field, rate in report["over_word_limit"].items():
+        print(f"{field} over {args.word_limit} words: {rate:.2%}")
+    for max_len, t in report["truncation"].items():
+        print(f"max_len {max_len:>5}: dropped {t['dropped_rate']:.2%}  truncated {t['truncated_rate']:.2%}  "
+              f"tokens lost {t['lost_token_rate']:.2%}")
+    for b, w in report["padding_waste"].items():
+        print(f"micro batch {b:>3}: padding waste {percent(w['random'])} "
+              f"(length-grouped {percent(w['length_grouped'])})")
+    print(f"packing waste at max_len {args.max_len}: {percent(report['packing_waste'])}")
+    print(f"recommendations: {json.dumps(report['recommendations'])}")
+
+    if args.output_json:
+        if args.output_json.endswith(".jsonl"):
+            with open(args.output_json, "a") as f:
+                f.write(json.dumps(report) + "\n")
+        else:
+            with open(args.output_json, "w") as f:
+                json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
 set -x
 
+# generate_sft_dataset.py --format parquet 写出的分片需要 parquet 加载器
+dataset_format=json
+if compgen -G "../data/train-*.parquet" > /dev/null; then
+    dataset_format=parquet
+fi
+
 read -r -d '' training_commands <<EOF
 openrlhf.cli.train_sft \
     --max_len 512 \
-    --dataset json@../data \
+    --dataset ${dataset_format}@../data \
     --input_key instruction \
     --output_key output \
     --train_batch_size 64 \
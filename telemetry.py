@@ -0,0 +1,187 @@
+import json
+import time
+import asyncio
+import threading
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _quantiles(samples) -> Dict[str, float]:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {f"p{int(q * 100)}": ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+
+class PipelineMetrics:
+    """生成流水线各阶段的指标
+
+    请求延迟只保留最近 window 个样本用于计算分位数；其余都是累计计数。
+    """
+
+    def __init__(self, window: int = 10000):
+        self.started = time.time()
+        self.latencies = deque(maxlen=window)
+        self.latency_sum = 0.0
+        self.requests = 0
+        self.request_errors = 0
+        self.cache_hits = 0
+        self.tokens = defaultdict(int)
+        self.completions = 0
+        self.parsed_items = 0
+        self.accepted = 0
+        self.rejections = defaultdict(int)
+        self.stage_seconds = defaultdict(float)
+        self.stage_calls = defaultdict(int)
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe_request(self, latency: float, usage=None) -> None:
+        """记录一次成功请求的延迟以及 response.usage 中的 token 用量"""
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(latency)
+            self.latency_sum += latency
+            if usage is None:
+                return
+            for field in ("prompt_tokens", "completion_tokens", "prompt_cache_hit_tokens", "prompt_cache_miss_tokens"):
+                value = getattr(usage, field, None)
+                if value:
+                    self.tokens[field] += value
+            # OpenAI 风格的缓存命中字段
+            details = getattr(usage, "prompt_tokens_details", None)
+            cached = getattr(details, "cached_tokens", None) if details is not None else None
+            if cached and not getattr(usage, "prompt_cache_hit_tokens", None):
+                self.tokens["prompt_cache_hit_tokens"] += cached
+
+    def observe_error(self) -> None:
+        with self._lock:
+            self.request_errors += 1
+
+    def observe_cache_hit(self) -> None:
+        with self._lock:
+            self.cache_hits += 1
+
+    def observe_completion(self, num_items: int) -> None:
+        """记录一次补全解析出的有效指令条数"""
+        with self._lock:
+            self.completions += 1
+            self.parsed_items += num_items
+
+    def reject(self, reason: str) -> None:
+        with self._lock:
+            self.rejections[reason] += 1
+
+    def accept(self) -> None:
+        with self._lock:
+            self.accepted += 1
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def timer(self, stage: str):
+        """累计某个阶段的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stage_seconds[stage] += elapsed
+                self.stage_calls[stage] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "time": time.time(),
+                "elapsed": time.time() - self.started,
+                "requests": self.requests,
+                "request_errors": self.request_errors,
+                "cache_hits": self.cache_hits,
+                "latency": dict(_quantiles(self.latencies),
+                                mean=self.latency_sum / self.requests if self.requests else None),
+                "tokens": dict(self.tokens),
+                "completions": self.completions,
+                "parse_yield": self.parsed_items / self.completions if self.completions else None,
+                "accepted": self.accepted,
+                "rejections": dict(self.rejections),
+                "stage_seconds": dict(self.stage_seconds),
+                "gauges": dict(self.gauges),
+            }
+
+    def prometheus_text(self) -> str:
+        """Prometheus 文本格式的指标"""
+        snap = self.snapshot()
+        lines = [
+            "# TYPE alpaca_requests_total counter",
+            f"alpaca_requests_total {snap['requests']}",
+            "# TYPE alpaca_request_errors_total counter",
+            f"alpaca_request_errors_total {snap['request_errors']}",
+            "# TYPE alpaca_cache_hits_total counter",
+            f"alpaca_cache_hits_total {snap['cache_hits']}",
+            "# TYPE alpaca_request_latency_seconds summary",
+        ]
+        for q in QUANTILES:
+            value = snap["latency"].get(f"p{int(q * 100)}")
+            if value is not None:
+                lines.append(f'alpaca_request_latency_seconds{{quantile="{q}"}} {value}')
+        lines.append(f"alpaca_request_latency_seconds_sum {self.latency_sum}")
+        lines.append(f"alpaca_request_latency_seconds_count {snap['requests']}")
+        lines.append("# TYPE alpaca_tokens_total counter")
+        for field, value in sorted(snap["tokens"].items()):
+            lines.append(f'alpaca_tokens_total{{kind="{field}"}} {value}')
+        lines.append("# TYPE alpaca_completions_total counter")
+        lines.append(f"alpaca_completions_total {snap['completions']}")
+        lines.append("# TYPE alpaca_parsed_items_total counter")
+        lines.append(f"alpaca_parsed_items_total {self.parsed_items}")
+        lines.append("# TYPE alpaca_accepted_total counter")
+        lines.append(f"alpaca_accepted_total {snap['accepted']}")
+        lines.append("# TYPE alpaca_rejections_total counter")
+        for reason, value in sorted(snap["rejections"].items()):
+            lines.append(f'alpaca_rejections_total{{reason="{reason}"}} {value}')
+        lines.append("# TYPE alpaca_stage_seconds_total counter")
+        for stage, value in sorted(snap["stage_seconds"].items()):
+            lines.append(f'alpaca_stage_seconds_total{{stage="{stage}"}} {value}')
+        for name, value in sorted(snap["gauges"].items()):
+            lines.append(f"# TYPE alpaca_{name} gauge")
+            lines.append(f"alpaca_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_jsonl(self, path: str) -> None:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.snapshot(), ensure_ascii=False) + "\n")
+
+    async def emit_periodically(self, path: str, interval: float = 30.0) -> None:
+        """每隔 interval 秒向 path 追加一行 JSON 快照，直到被取消"""
+        while True:
+            await asyncio.sleep(interval)
+            self.write_jsonl(path)
+
+
+def serve_prometheus(metrics: PipelineMetrics, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """在后台线程中提供 /metrics 接口"""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,66 @@
+import pytest
+
+from completion_parser import BLACKLIST, InstructionValidator, Rule, compile_blacklist, iter_blocks, parse_block
+
+
+def test_parse_block_fields_and_continuation_lines():
+    item = parse_block("\n1. Instruction: List three fruits.\nInput: <noinput>\nOutput: Apple\n\n- banana\r\n- cherry\n")
+    assert item == {"instruction": "List three fruits.", "input": "<noinput>", "output": "Apple  - banana - cherry"}
+
+
+def test_parse_block_uses_last_field_name_on_a_line():
+    assert parse_block("Output: see Input: above.")["input"] == "above."
+    assert parse_block("Instruction: Compare Output: and Input: labels")["instruction"] == "Compare Output: and Input: labels"
+
+
+def test_iter_blocks_skips_empty_blocks():
+    text = "###\nInstruction: A\nInput: B\nOutput: C\n###\n\n###Instruction: D\nOutput: E"
+    assert list(iter_blocks(text)) == [{"instruction": "A", "input": "B", "output": "C"},
+                                       {"instruction": "D", "output": "E"}]
+
+
+@pytest.mark.parametrize("instruction, blocked", [
+    ("Explain these diagrams to a student", True),
+    ("Describe the drawing on the wall", True),
+    ("Write a musical review", True),
+    ("Please go to the store", True),
+    ("Summarize this paragraph briefly please", False),
+    ("Build a profile and a roadmap", False),
+    ("Write a biography of the mapmaker", True),
+    ("Explain the bitmap format", False),
+])
+def test_blacklist_matches_from_word_start(instruction, blocked):
+    assert (compile_blacklist(BLACKLIST).search(instruction.lower()) is not None) == blocked
+
+
+def item(instruction, input_text="<noinput>", output=" answer "):
+    return {"instruction": instruction, "input": input_text, "output": output}
+
+
+@pytest.mark.parametrize("candidate, reason", [
+    ({"instruction": "Only instruction here"}, "missing_fields"),
+    (item("Too short"), "length"),
+    (item(" ".join(["word"] * 151)), "length"),
+    (item("Draw a cat in ASCII art"), "blacklist"),
+    (item("- List four colours of the rainbow"), "punctuation"),
+    (item("Écris une phrase en français ici"), "non_ascii"),
+    (item("  List four colours of the rainbow  "), None),
+])
+def test_validator_reasons_and_counts(candidate, reason):
+    validator = InstructionValidator()
+    assert validator.rejection_reason(candidate) == reason
+    assert dict(validator.rejections) == ({} if reason is None else {reason: 1})
+
+
+def test_validator_normalizes_fields():
+    candidate = item("  List four colours of the rainbow  ")
+    assert InstructionValidator().rejection_reason(candidate) is None
+    assert candidate == {"instruction": "List four colours of the rainbow", "input": "", "output": "answer"}
+
+
+def test_custom_rules_run_in_order():
+    validator = InstructionValidator([Rule("no_numbers", lambda i: not any(c.isdigit() for c in i["instruction"])),
+                                      Rule("never", lambda i: False)])
+    assert validator.rejection_reason(item("Add 2 and 3")) == "no_numbers"
+    assert validator.rejection_reason(item("Add two and three")) == "never"
+    assert dict(validator.rejections) == {"no_numbers": 1, "never": 1}
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from dataset_sink import JsonlSink, compact, load_jsonl
+
+ITEMS = [{"instruction": f"任务 {i}", "input": "", "output": "ok"} for i in range(3)]
+
+
+def write_items(path, items):
+    with JsonlSink(str(path), fsync_every=2, append=False) as sink:
+        for item in items:
+            sink.append(item)
+
+
+def test_round_trip_and_append(tmp_path):
+    path = tmp_path / "data.jsonl"
+    write_items(path, ITEMS[:2])
+    with JsonlSink(str(path)) as sink:
+        sink.append(ITEMS[2])
+    assert load_jsonl(str(path)) == ITEMS
+
+
+@pytest.mark.parametrize("tail", [b'{"instruction": "half', b'{"instruction": "x"}', b"not json\n"])
+def test_torn_last_line_is_dropped_and_truncated(tmp_path, tail):
+    path = tmp_path / "data.jsonl"
+    write_items(path, ITEMS)
+    size = path.stat().st_size
+    with open(path, "ab") as f:
+        f.write(tail)
+    assert load_jsonl(str(path)) == ITEMS
+    assert path.stat().st_size == size
+    # 截断后可以继续追加，不会与残缺的行拼在一起
+    with JsonlSink(str(path)) as sink:
+        sink.append({"instruction": "next"})
+    assert load_jsonl(str(path))[-1] == {"instruction": "next"}
+
+
+def test_compact_writes_json_array(tmp_path):
+    path = tmp_path / "data.jsonl"
+    write_items(path, ITEMS)
+    output = tmp_path / "data.json"
+    assert compact(str(path), str(output)) == 3
+    assert json.loads(output.read_text(encoding="utf-8")) == ITEMS
+    assert not (tmp_path / "data.json.tmp").exists()
@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+import pytest
+
+from endpoints import Endpoint, EndpointPool
+
+
+class FakeStream:
+    def __init__(self, chunks, error=None):
+        self.chunks = list(chunks)
+        self.error = error
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(0)
+        if self.chunks:
+            return self.chunks.pop(0)
+        if self.error is not None:
+            raise self.error
+        raise StopAsyncIteration
+
+    async def close(self):
+        self.closed = True
+
+
+def make_pool(eject_after=5):
+    endpoint = Endpoint("http://localhost:1/v1", api_key="test", max_concurrency=4)
+    return endpoint, EndpointPool([endpoint], eject_after=eject_after, max_retries=0)
+
+
+def test_stream_holds_slot_until_consumed():
+    endpoint, pool = make_pool()
+
+    async def run():
+        stream = await pool.call(lambda ep: asyncio.sleep(0, FakeStream(["a", "b"])))
+        assert endpoint.outstanding == 1
+        assert endpoint.controller.concurrency.in_flight == 1
+        assert endpoint.requests == 0
+        assert [chunk async for chunk in stream] == ["a", "b"]
+        assert endpoint.outstanding == 0
+        assert endpoint.controller.concurrency.in_flight == 0
+        assert endpoint.requests == 1
+
+    asyncio.run(run())
+
+
+def test_stream_closed_early_releases_slot():
+    endpoint, pool = make_pool()
+
+    async def run():
+        stream = await pool.call(lambda ep: asyncio.sleep(0, FakeStream(["a", "b", "c"])))
+        async for _ in stream:
+            break
+        await stream.close()
+        await stream.close()
+        assert endpoint.outstanding == 0
+        assert endpoint.controller.concurrency.in_flight == 0
+        assert endpoint.requests == 1
+
+    asyncio.run(run())
+
+
+def test_error_mid_stream_counts_as_failure():
+    endpoint, pool = make_pool(eject_after=2)
+
+    async def run():
+        for _ in range(2):
+            stream = await pool.call(lambda ep: asyncio.sleep(0, FakeStream(["a"], ConnectionError("reset"))))
+            with pytest.raises(ConnectionError):
+                async for _ in stream:
+                    pass
+            assert endpoint.outstanding == 0
+            assert endpoint.controller.concurrency.in_flight == 0
+        assert endpoint.requests == 0
+        assert pool.ejections == 1
+
+    asyncio.run(run())
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def test_bad_key_on_only_endpoint_raises_without_retrying():
+    endpoint = Endpoint("http://localhost:1/v1", api_key="bad")
+    pool = EndpointPool([endpoint], max_retries=6)
+    calls = []
+
+    async def request(ep):
+        calls.append(ep)
+        raise StatusError(401)
+
+    async def run():
+        with pytest.raises(StatusError):
+            await asyncio.wait_for(pool.call(request), timeout=1)
+
+    asyncio.run(run())
+    assert len(calls) == 1
+    assert pool.retries == 0
+    assert pool.ejections == 1
+    assert endpoint.outstanding == 0
+
+
+def test_bad_key_fails_over_to_healthy_endpoint():
+    bad = Endpoint("http://localhost:1/v1", api_key="bad")
+    good = Endpoint("http://localhost:2/v1", api_key="good")
+    pool = EndpointPool([bad, good], max_retries=6)
+    calls = []
+
+    async def request(ep):
+        calls.append(ep)
+        if ep is bad:
+            raise StatusError(403)
+        return "ok"
+
+    async def run():
+        return [await pool.call(request) for _ in range(3)]
+
+    assert asyncio.run(run()) == ["ok"] * 3
+    assert calls.count(bad) == 1
+    assert calls.count(good) == 3
+    assert not bad.available(time.monotonic())
+    assert pool.ejections == 1
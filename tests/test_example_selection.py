@@ -0,0 +1,57 @@
+import random
+from collections import Counter
+
+import pytest
+
+from example_selection import AliasTable, ExamplePool, task_verb
+
+
+def seeds(instructions):
+    return [{"instruction": text, "example": f"###\nInstruction: {text}\n"} for text in instructions]
+
+
+def frequencies(draw, n, size):
+    counts = Counter(draw() for _ in range(n))
+    return [counts[i] / n for i in range(size)]
+
+
+def test_task_verb():
+    assert task_verb("Write a poem.") == "write"
+    assert task_verb("  What is the capital of France?") == "what"
+    assert task_verb("!!!") == ""
+
+
+def test_alias_table_matches_weights():
+    weights = [1.0, 2.0, 0.0, 7.0]
+    table = AliasTable(weights, random.Random(0))
+    observed = frequencies(table.sample, 40000, len(weights))
+    assert observed == pytest.approx([w / sum(weights) for w in weights], abs=0.01)
+
+
+def test_sample_is_distinct_and_capped():
+    pool = ExamplePool(seeds(["Write a poem", "List some fruits", "Explain gravity"]), rng=random.Random(0))
+    for _ in range(100):
+        ids = pool.sample(3)
+        assert sorted(ids) == [0, 1, 2]
+    assert len(pool.sample(10)) == 3
+
+
+def test_rare_verbs_and_productive_examples_weigh_more():
+    pool = ExamplePool(seeds(["Write a poem", "Write a story", "Write a song", "Explain gravity"]),
+                       rng=random.Random(0))
+    assert pool.weight(3) > pool.weight(0)
+    pool.observe([1], accepted=True)
+    pool.observe([2], accepted=False)
+    assert pool.weight(1) > pool.weight(0) > pool.weight(2)
+
+
+def test_pending_items_are_drawn_in_proportion_to_weight():
+    # min_rebuild 很大：新加入的示例都留在拒绝抽样的 pending 列表中
+    pool = ExamplePool(seeds(["Write a poem", "Explain gravity"]), rng=random.Random(1), min_rebuild=10 ** 6)
+    pool.add("Write a story", "###\nInstruction: Write a story\n")
+    pool.add("Summarize the news", "###\nInstruction: Summarize the news\n")
+    assert pool._pending == [2, 3]
+    observed = frequencies(lambda: pool.sample(1)[0], 40000, len(pool))
+    share = pool._pending_total / (pool._pending_total + pool._table.total)
+    assert observed[2] + observed[3] == pytest.approx(share, abs=0.01)
+    assert observed[3] / observed[2] == pytest.approx(pool._pending_weights[1] / pool._pending_weights[0], rel=0.05)
@@ -0,0 +1,176 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from completion_parser import iter_blocks
+from example_selection import ExamplePool
+from generate_instructions_async import AlpacaDataGenerator
+
+
+def make_generator():
+    return AlpacaDataGenerator(api_key="test", max_workers=2, seed=0, metrics_file=None)
+
+
+def run_generation(generator, tmp_path, num_instructions=5):
+    output_file = str(tmp_path / "alpaca_data.json")
+    return asyncio.run(asyncio.wait_for(
+        generator.generate_dataset("data/seed_tasks.jsonl", num_instructions, output_file), timeout=10))
+
+
+def test_producer_error_is_raised(tmp_path):
+    generator = make_generator()
+
+    def fail():
+        raise RuntimeError("plan failed")
+
+    generator.sizer.plan = fail
+    with pytest.raises(RuntimeError, match="plan failed"):
+        run_generation(generator, tmp_path)
+
+
+def test_producer_error_after_items_is_raised(tmp_path):
+    generator = make_generator()
+    calls = 0
+
+    async def generate_single(messages, max_tokens=None):
+        nonlocal calls
+        calls += 1
+        if calls > 1:
+            raise ConnectionError("retries exhausted")
+        return [(0, {"instruction": "Write a haiku about autumn leaves.", "input": "", "output": "Leaves fall."})]
+
+    generator.generate_single = generate_single
+    with pytest.raises(ConnectionError, match="retries exhausted"):
+        run_generation(generator, tmp_path)
+
+
+def test_generation_completes(tmp_path):
+    generator = make_generator()
+    seeds = generator.load_seed_tasks("data/seed_tasks.jsonl")
+    counter = 0
+
+    async def generate_single(messages, max_tokens=None):
+        nonlocal counter
+        task = seeds[counter % len(seeds)]
+        counter += 1
+        await asyncio.sleep(0)
+        return [(0, {"instruction": task["instruction"], "input": task["input"], "output": task["output"]})]
+
+    generator.generate_single = generate_single
+    run_generation(generator, tmp_path, num_instructions=3)
+    assert (tmp_path / "alpaca_data.json").exists()
+
+
+def test_cache_is_keyed_by_serving_model(tmp_path):
+    from types import SimpleNamespace
+
+    from endpoints import Endpoint
+    from response_cache import ResponseCache
+
+    cache = ResponseCache(str(tmp_path / "responses.db"))
+    endpoints = [Endpoint("http://localhost:1/v1", api_key="test", model=m) for m in ("model-a", "model-b")]
+    generator = AlpacaDataGenerator(api_key="test", endpoints=endpoints, cache=cache, seed=0)
+    served = []
+
+    async def call(request, estimated_tokens=0):
+        endpoint = endpoints[len(served) % 2]
+        served.append(endpoint.model)
+
+        async def create(**kwargs):
+            text = (f"###\nInstruction: Summarize the article written by {kwargs['model']} today.\n"
+                    f"Input: <noinput>\nOutput: A summary.\n")
+            message = SimpleNamespace(content=text)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=None)
+
+        endpoint.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        return await request(endpoint)
+
+    generator.pool.call = call
+    messages = [{"role": "user", "content": "prompt"}]
+    for _ in range(2):
+        asyncio.run(generator.generate_single(messages))
+    assert served == ["model-a", "model-b"]
+    for model in ("model-a", "model-b"):
+        completions = list(cache.completions(model))
+        assert len(completions) == 1 and model in completions[0]
+
+    # A fresh run hits the entry of whichever model served each sample, without new requests
+    generator._sample_counts.clear()
+    items = [asyncio.run(generator.generate_single(messages)) for _ in range(2)]
+    assert len(served) == 2
+    assert [pairs[0][1]["instruction"].split()[-2] for pairs in items] == ["model-a", "model-b"]
+    cache.close()
+
+
+def shard_prompts(seed, shard_id, example_selection, count=20):
+    generator = AlpacaDataGenerator(api_key="test", seed=seed, shard_id=shard_id, num_shards=4,
+                                    example_selection=example_selection)
+    seeds = generator.load_seed_tasks("data/seed_tasks.jsonl")
+    if example_selection == "adaptive":
+        generator.example_pool = ExamplePool(seeds, rng=generator.rng)
+    return [generator.create_prompt(seeds)[0] for _ in range(count)]
+
+
+@pytest.mark.parametrize("example_selection", ["uniform", "adaptive"])
+def test_shard_prompts_are_reproducible(example_selection):
+    assert shard_prompts(42, 1, example_selection) == shard_prompts(42, 1, example_selection)
+    assert shard_prompts(42, 1, example_selection) != shard_prompts(42, 2, example_selection)
+
+
+def test_sharding_requires_seed():
+    with pytest.raises(ValueError):
+        AlpacaDataGenerator(api_key="test", num_shards=2, shard_id=1)
+
+
+class FakeChunkStream:
+    def __init__(self, text, size=7):
+        self.pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.pieces:
+            raise StopAsyncIteration
+        piece = self.pieces.pop(0)
+        delta = SimpleNamespace(content=piece)
+        finish_reason = "stop" if not self.pieces else None
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=delta, finish_reason=finish_reason)])
+
+    async def close(self):
+        self.closed = True
+
+
+def run_stream(make_text):
+    generator = AlpacaDataGenerator(api_key="test", seed=0, stream=True, example_selection="uniform")
+    seeds = generator.load_seed_tasks("data/seed_tasks.jsonl")
+    messages, _ = generator.create_prompt(seeds)
+    examples = [item["instruction"] for item in iter_blocks(messages[-1]["content"]) if "instruction" in item]
+    text = make_text(examples)
+
+    async def create_completion(messages, stream=False, max_tokens=None, served=None):
+        return FakeChunkStream(text)
+
+    generator._create_completion = create_completion
+
+    async def collect():
+        return [item["instruction"] async for _, item in generator.generate_streaming(messages, num_tasks=10)]
+
+    return asyncio.run(collect())
+
+
+def block(instruction, output="A short answer."):
+    return f"###\nInstruction: {instruction}\nInput: <noinput>\nOutput: {output}\n"
+
+
+def test_stream_ignores_rejected_fragments_found_in_prompt():
+    fresh = "Describe the water cycle to a ten year old."
+    # 示例指令的前两个词（如流中途截断的块）出现在提示词里，但校验不通过，不应中止整个流
+    assert run_stream(lambda examples: block(" ".join(examples[0].split()[:2])) + block(fresh)) == [fresh]
+
+
+def test_stream_stops_when_a_valid_block_repeats_an_example():
+    fresh = "Describe the water cycle to a ten year old."
+    assert run_stream(lambda examples: block(examples[0]) + block(fresh)) == []
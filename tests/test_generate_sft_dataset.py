@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+from generate_sft_dataset import split_of
+
+INSTRUCTIONS = ["Write a poem about the sea.", "List three fruits.", "Explain gravity to a child.",
+                "Translate hello into French.", "Sort these numbers: 3, 1, 2.", "Describe your ideal weekend.",
+                "What is the capital of Peru?", "Summarize the plot of Hamlet."]
+
+
+def test_split_is_pinned_across_runs_and_versions():
+    # 划分写死在这里：哈希或规范化方式的任何改动都会移动已有样本，必须显式更新
+    assert [split_of(text, 0.5, 42) for text in INSTRUCTIONS] == [
+        "test", "train", "train", "test", "train", "test", "train", "test"]
+
+
+def test_split_ignores_case_and_whitespace_only():
+    for text in INSTRUCTIONS:
+        assert split_of("  " + text.upper().replace(" ", "\n\t "), 0.5, 42) == split_of(text, 0.5, 42)
+
+
+def test_split_does_not_depend_on_dataset_contents():
+    rng = random.Random(0)
+    texts = [f"Instruction number {i} about {rng.random()}" for i in range(2000)]
+    before = {text: split_of(text, 0.1, 7) for text in texts[:1000]}
+    for text in texts[1000:]:
+        split_of(text, 0.1, 7)
+    assert {text: split_of(text, 0.1, 7) for text in reversed(texts[:1000])} == before
+
+
+@pytest.mark.parametrize("ratio", [0.0, 0.05, 0.2, 1.0])
+def test_split_ratio_and_seed(ratio):
+    texts = [f"Task {i}: do something useful" for i in range(20000)]
+    share = sum(split_of(text, ratio, 1) == "test" for text in texts) / len(texts)
+    assert share == pytest.approx(ratio, abs=0.01)
+    if 0 < ratio < 1:
+        assert [split_of(t, ratio, 1) for t in texts[:500]] != [split_of(t, ratio, 2) for t in texts[:500]]
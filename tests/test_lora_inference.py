@@ -0,0 +1,49 @@
+import pytest
+import torch
+
+from evaluate_sft import evaluate_losses
+from lora_inference import MultiLoraModel
+from pack_sft_dataset import tokenize_sft
+
+
+@pytest.fixture(scope="module")
+def lora(small_tokenizer):
+    from transformers import LlamaConfig, LlamaForCausalLM
+    torch.manual_seed(0)
+    config = LlamaConfig(vocab_size=len(small_tokenizer), hidden_size=32, intermediate_size=64,
+                         num_hidden_layers=2, num_attention_heads=4, num_key_value_heads=4,
+                         max_position_embeddings=256)
+    return MultiLoraModel(LlamaForCausalLM(config), small_tokenizer, {})
+
+
+PROMPTS = ["Explain how a binary search works.", "The quick brown fox " * 20, "Write a short poem about the sea."]
+RESPONSES = ["Halve the range. " * 30, "jumps.", "The sea is wide.\n"]
+
+
+def test_encode_applies_training_truncation(lora, small_tokenizer):
+    max_len = 32
+    encoded = lora.encode(PROMPTS, RESPONSES, max_len)
+    reference = tokenize_sft(small_tokenizer, PROMPTS, RESPONSES, max_len)
+    assert encoded == [None if r is None else r[:2] for r in reference]
+    assert encoded[1] is None
+    assert len(encoded[0][0]) == max_len and encoded[0][0][-1] == small_tokenizer.eos_token_id
+    assert len(encoded[2][0]) < max_len
+
+
+def test_score_and_evaluate_use_truncated_sequences(lora):
+    max_len = 32
+    scores = lora.score(PROMPTS, RESPONSES, [None] * 3, batch_size=2, max_len=max_len)
+    assert scores[1] is None
+    encoded = lora.encode(PROMPTS, RESPONSES, max_len)
+    for i in (0, 2):
+        ids, prompt_len = encoded[i]
+        nll, tokens = lora.forward_losses([encoded[i]], [None])[0]
+        assert scores[i][1] == tokens == len(ids) - prompt_len
+        assert scores[i][0] == pytest.approx(nll, rel=1e-4)
+
+    results = {}
+    examples = [{"instruction": p, "output": r} for p, r in zip(PROMPTS, RESPONSES)]
+    evaluate_losses(lora, None, examples, max_len, token_budget=10 ** 6, max_batch_size=8,
+                    on_batch=results.update)
+    assert results[1]["dropped"]
+    assert [results[i]["tokens"] for i in (0, 2)] == [scores[0][1], scores[2][1]]
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from pack_sft_dataset import first_fit_decreasing, tokenize_sft
+
+
+def reference_sft(tokenizer, prompt, response, max_len):
+    """openrlhf SFTDataset（不使用 input_template / chat template）对单个样本的处理"""
+    prompt_token = tokenizer(prompt, max_length=max_len, padding=False, truncation=True,
+                             return_tensors="pt", add_special_tokens=False)
+    prompt_ids_len = prompt_token["attention_mask"].int().sum().item()
+    if not prompt or not response or prompt_ids_len >= max_len - 2:
+        return None
+    text = (prompt + response).rstrip("\n")
+    if not text.endswith(tokenizer.eos_token):
+        text += " " + tokenizer.eos_token
+    input_token = tokenizer(text, max_length=max_len, padding=False, truncation=True,
+                            return_tensors="pt", add_special_tokens=False)
+    input_token["input_ids"][0][-1] = tokenizer.eos_token_id
+    return input_token["input_ids"][0].tolist(), prompt_ids_len
+
+
+def test_tokenize_sft_matches_openrlhf(small_tokenizer):
+    max_len = 512
+    pairs = [
+        ("Write a short poem about the sea.\nInput: waves and light", "The sea is wide.\n\n"),
+        ("Explain how a binary search works.", "Halve the range. " * 200),
+        ("The quick brown fox " * 200, "jumps."),
+        ("Explain the fox.", ""),
+        ("Explain the dog.", "It is lazy.</s>"),
+    ]
+    prompts, responses = zip(*pairs)
+    results = tokenize_sft(small_tokenizer, list(prompts), list(responses), max_len)
+    for (prompt, response), result in zip(pairs, results):
+        expected = reference_sft(small_tokenizer, prompt, response, max_len)
+        if expected is None:
+            assert result is None
+            continue
+        ids, prompt_len, truncated = result
+        assert (ids, prompt_len) == expected
+        assert len(ids) <= max_len and ids[-1] == small_tokenizer.eos_token_id
+        assert ids[0] != small_tokenizer.bos_token_id
+        assert truncated == (len(ids) == max_len)
+    assert [r is None for r in results] == [False, False, True, True, False]
+    assert results[1][2] and len(results[1][0]) == max_len
+
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_first_fit_decreasing_bound(seed):
+    rng = np.random.RandomState(seed)
+    capacity = 512
+    lengths = rng.randint(1, capacity + 1, size=2000)
+    bins = first_fit_decreasing(lengths, capacity)
+    assert sorted(i for b in bins for i in b) == list(range(len(lengths)))
+    loads = [int(lengths[b].sum()) for b in bins]
+    assert max(loads) <= capacity
+    # 首次适应递减最多使用 11/9 OPT + 6/9 个序列，OPT 不少于总长 / 容量
+    lower = int(np.ceil(lengths.sum() / capacity))
+    assert lower <= len(bins) <= 11 / 9 * lower + 6 / 9
+    # 首次适应：任意两个序列都装不进同一个序列
+    loads.sort()
+    assert len(loads) < 2 or loads[0] + loads[1] > capacity
+
+
+def test_first_fit_decreasing_small_cases():
+    assert first_fit_decreasing([], 512) == []
+    assert first_fit_decreasing([512, 512], 512) == [[0], [1]]
+    assert first_fit_decreasing([100, 400, 300, 200], 500) == [[1, 0], [2, 3]]
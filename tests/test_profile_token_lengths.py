@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+import profile_token_lengths
+from profile_token_lengths import FIELDS, padding_waste, profile
+
+
+def make_args(**overrides):
+    args = dict(max_len=16, micro_batch_size=4, packing=False, max_lens=[16, 32], micro_batch_sizes=[2, 4],
+                max_truncation=0.005, token_budget=None, word_limit=100, seed=42)
+    args.update(overrides)
+    return SimpleNamespace(**args)
+
+
+def make_tokens(prompts, samples):
+    tokens = np.zeros((len(FIELDS), len(prompts)), dtype=np.int64)
+    idx = {field: i for i, field in enumerate(FIELDS)}
+    tokens[idx["prompt"]] = prompts
+    tokens[idx["sample"]] = samples
+    tokens[idx["output"]] = np.asarray(samples) - np.asarray(prompts)
+    return tokens, np.ones_like(tokens)
+
+
+def test_profile_when_every_prompt_is_too_long():
+    tokens, words = make_tokens([14, 20, 30], [20, 25, 40])
+    report = profile(tokens, words, make_args())
+    assert report["packing_waste"] is None
+    assert report["padding_waste"]["4"] == {"random": None, "length_grouped": None}
+    assert report["recommendations"]["packing_samples"] is False
+    assert padding_waste(np.zeros(0, dtype=np.int64), 4, np.random.default_rng(0))["random"] is None
+
+
+def test_current_batch_size_waste_is_not_recomputed(monkeypatch):
+    calls = []
+
+    def counting(lengths, batch_size, rng):
+        calls.append(batch_size)
+        return padding_waste(lengths, batch_size, rng)
+
+    monkeypatch.setattr(profile_token_lengths, "padding_waste", counting)
+    tokens, words = make_tokens([2, 3, 4, 5, 6], [8, 9, 12, 15, 30])
+    profile(tokens, words, make_args())
+    assert calls == [2, 4]
+    calls.clear()
+    profile(tokens, words, make_args(micro_batch_size=8))
+    assert calls == [2, 4, 8]
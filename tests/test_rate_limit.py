@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from rate_limit import AIMDConcurrencyLimiter, APIController
+
+
+def make_controller():
+    return APIController(concurrency=AIMDConcurrencyLimiter(initial=4, cooldown=0), max_retries=0)
+
+
+def call(controller, outcome):
+    async def request():
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return asyncio.run(controller.call(request))
+
+
+def test_non_retryable_errors_leave_window_unchanged():
+    controller = make_controller()
+    for _ in range(20):
+        with pytest.raises(ValueError):
+            call(controller, ValueError("invalid request"))
+    assert controller.concurrency.limit == 4
+    assert controller.concurrency.in_flight == 0
+    assert controller.concurrency.error_rate == 0
+
+
+def test_success_grows_and_retryable_error_shrinks_window():
+    controller = make_controller()
+    assert call(controller, "ok") == "ok"
+    assert controller.concurrency.limit == pytest.approx(4.25)
+    with pytest.raises(ConnectionError):
+        call(controller, ConnectionError("reset"))
+    assert controller.concurrency.limit == pytest.approx(2.125)
+    assert controller.concurrency.in_flight == 0
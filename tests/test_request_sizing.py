@@ -0,0 +1,55 @@
+import math
+
+import pytest
+
+from request_sizing import RequestSizer
+
+
+def feed(sizer, accept_until, rounds=200, blocks=30, tokens_per_task=100, prompt_tokens=1000):
+    """每轮补全产出 blocks 个块，只有前 accept_until 个被接受"""
+    for _ in range(rounds):
+        sizer.observe_blocks(blocks)
+        for position in range(blocks):
+            sizer.observe_item(position, position < accept_until)
+        sizer.observe_completion(blocks, blocks * tokens_per_task, prompt_tokens, truncated=False)
+
+
+def test_initial_plan_until_first_completion():
+    sizer = RequestSizer()
+    assert sizer.plan() == (20, 3072)
+    assert sizer.truncation_rate is None
+
+
+def test_non_adaptive_always_returns_initial_values():
+    sizer = RequestSizer(adaptive=False)
+    feed(sizer, accept_until=5)
+    assert sizer.plan() == (20, 3072)
+
+
+def test_task_count_follows_where_blocks_stop_being_accepted():
+    few, many = RequestSizer(), RequestSizer()
+    feed(few, accept_until=8)
+    feed(many, accept_until=30)
+    assert 5 <= few.plan()[0] < many.plan()[0] == 30
+
+
+def test_max_tokens_covers_planned_tasks_within_limit():
+    sizer = RequestSizer(max_tokens_limit=8192)
+    feed(sizer, accept_until=30, tokens_per_task=1000)
+    tasks, max_tokens = sizer.plan()
+    assert tasks == int((8192 - RequestSizer._END_TOKENS) / (1000 * sizer.margin))
+    assert max_tokens == min(8192, math.ceil(tasks * 1000 * sizer.margin) + RequestSizer._END_TOKENS)
+    assert max_tokens <= 8192
+
+
+def test_margin_grows_on_truncation_and_decays_otherwise():
+    sizer = RequestSizer(margin=1.25)
+    for _ in range(20):
+        sizer.observe_completion(20, None, None, truncated=True)
+    assert sizer.margin == 2.0
+    assert sizer.truncation_rate == 1.0
+    assert sizer.tokens_per_task is None
+    for _ in range(2000):
+        sizer.observe_completion(20, 2000, None, truncated=False)
+    assert sizer.margin == pytest.approx(1.05)
+    assert sizer.tokens_per_task == pytest.approx(100)
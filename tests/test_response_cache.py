@@ -0,0 +1,54 @@
+import itertools
+
+import pytest
+
+import response_cache
+from response_cache import ResponseCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    # 单调递增的时钟，使访问顺序不受系统时间精度影响
+    clock = itertools.count(1)
+    monkeypatch.setattr(response_cache.time, "time", lambda: float(next(clock)))
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_bytes=30)
+    yield cache
+    cache.close()
+
+
+def test_key_depends_on_every_request_field():
+    base = ("m", [{"role": "user", "content": "hi"}], 1.0, 1.0, 100, ["END"], 0)
+    key = ResponseCache.make_key(*base)
+    assert ResponseCache.make_key(*base) == key
+    for i, changed in enumerate(["n", [{"role": "user", "content": "ho"}], 0.5, 0.9, 200, [], 1]):
+        assert ResponseCache.make_key(*base[:i], changed, *base[i + 1:]) != key
+
+
+def test_lru_eviction_keeps_recently_read_entries(cache):
+    for key in "abc":
+        cache.put(key, "m", key * 10)
+    assert len(cache) == 3 and cache.total_bytes() == 30
+    assert cache.get("a") == "a" * 10
+    cache.put("d", "m", "d" * 10)
+    # b 最久未被访问，先被淘汰；刚读过的 a 保留
+    assert cache.get("b") is None
+    assert [cache.get(k) for k in "acd"] == ["a" * 10, "c" * 10, "d" * 10]
+    assert cache.total_bytes() <= 30
+    assert (cache.hits, cache.misses) == (4, 1)
+
+
+def test_eviction_counts_utf8_bytes_and_removes_until_within_budget(cache):
+    cache.put("a", "m", "x" * 10)
+    cache.put("b", "m", "x" * 10)
+    cache.put("c", "m", "字" * 10)
+    assert cache.total_bytes() == 30
+    assert len(cache) == 1 and cache.get("c") == "字" * 10
+
+
+def test_completions_filter_by_model_in_write_order(cache):
+    cache.max_bytes = None
+    cache.put("1", "m1", "first")
+    cache.put("2", "m2", "second")
+    cache.put("3", "m1", "third")
+    assert list(cache.completions()) == ["first", "second", "third"]
+    assert list(cache.completions("m1")) == ["first", "third"]
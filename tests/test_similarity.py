@@ -0,0 +1,101 @@
+import random
+
+import pytest
+from rouge_score import rouge_scorer
+
+from similarity import MinHashLSHIndex, RougeLKernel, tokenize
+
+SCORER = rouge_scorer.RougeScorer(["rougeL"], use_stemmer=False)
+VOCAB = "the a of to write list explain code data city poem story model sort number python".split()
+
+
+def sentence(rng, length):
+    return " ".join(rng.choice(VOCAB) for _ in range(length))
+
+
+def reference_scores(references, candidate):
+    return [SCORER.score(reference, candidate)["rougeL"].fmeasure for reference in references]
+
+
+def make_kernel(references):
+    kernel = RougeLKernel()
+    for reference in references:
+        kernel.add(reference)
+    return kernel
+
+
+@pytest.fixture
+def paths(monkeypatch):
+    """记录每次打分走的是 NumPy 还是大整数路径"""
+    used = []
+    for name in ("_lcs_numpy", "_lcs_python"):
+        original = getattr(RougeLKernel, name)
+
+        def spy(self, candidate, indices, original=original, name=name):
+            used.append(name)
+            return original(self, candidate, indices)
+
+        monkeypatch.setattr(RougeLKernel, name, spy)
+    return used
+
+
+@pytest.mark.parametrize("num_references, candidate_len, path", [
+    (40, 12, "_lcs_numpy"),
+    (40, 64, "_lcs_numpy"),
+    (40, 65, "_lcs_python"),
+    (40, 150, "_lcs_python"),
+    (5, 12, "_lcs_python"),
+    (5, 64, "_lcs_python"),
+])
+def test_scores_match_rouge_score(paths, num_references, candidate_len, path):
+    rng = random.Random(num_references * 1000 + candidate_len)
+    references = [sentence(rng, rng.randint(1, 90)) for _ in range(num_references)] + ["!!!"]
+    kernel = make_kernel(references)
+    for _ in range(10):
+        candidate = sentence(rng, candidate_len)
+        assert len(tokenize(candidate)) == candidate_len
+        assert kernel.score_many(candidate).tolist() == reference_scores(references, candidate)
+    assert set(paths) == {path}
+
+
+@pytest.mark.parametrize("num_references", [5, 40])
+@pytest.mark.parametrize("candidate", ["", "   ", "?!", "zebra quokka", "zebra the quokka"])
+def test_empty_and_out_of_vocabulary_candidates(num_references, candidate):
+    rng = random.Random(num_references)
+    references = [sentence(rng, rng.randint(1, 30)) for _ in range(num_references)]
+    kernel = make_kernel(references)
+    assert kernel.score_many(candidate).tolist() == reference_scores(references, candidate)
+    assert kernel.has_match(candidate, 0.7) is False
+
+
+def test_subset_of_indices():
+    rng = random.Random(7)
+    references = [sentence(rng, 10) for _ in range(30)]
+    kernel = make_kernel(references)
+    candidate = references[3]
+    indices = [3, 17, 29]
+    assert kernel.score_many(candidate, indices).tolist() == reference_scores([references[i] for i in indices],
+                                                                              candidate)
+    assert kernel.score_many(candidate, []).tolist() == []
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_exact_duplicates_are_always_found(seed):
+    rng = random.Random(seed)
+    index = MinHashLSHIndex(seed=seed)
+    instructions = [sentence(rng, rng.randint(1, 40)) for _ in range(300)]
+    for instruction in instructions:
+        index.add(instruction)
+    for instruction in instructions:
+        assert index.has_near_duplicate(instruction)
+        # 分词前的大小写和标点差异不影响判定
+        assert index.has_near_duplicate(instruction.upper() + "?")
+
+
+def test_index_agrees_with_rouge_on_unrelated_and_empty_instructions():
+    index = MinHashLSHIndex()
+    index.add("Write a poem about the city at night.")
+    index.add("!!!")
+    assert not index.has_near_duplicate("Sort a list of numbers in python.")
+    assert not index.has_near_duplicate("")
+    assert len(index) == 2